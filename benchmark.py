@@ -0,0 +1,288 @@
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import argparse
+import platform
+import subprocess
+import contextlib
+import io
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from stock_storage import TARGET_COLUMNS
+
+# ==========================================
+# 基准测试套件
+# 1. 确定性合成行情：N 只股票 × M 年日线，列与 stock_data 完全一致 (TARGET_COLUMNS)，
+#    含上市时间差异、停牌缺口、板块涨跌停限制与涨停事件，并生成配套 stock_names.csv。
+# 2. 在多个规模下分阶段计时各脚本核心函数 (读取/指标/过滤/回测/写出/同步/下载追加)，
+#    结果写成 JSON，可用 compare 对比两次提交之间的耗时变化。
+# ==========================================
+
+BENCH_DATA_DIR = "bench_data"
+BENCH_RESULTS_DIR = "bench_results"
+DEFAULT_SCALES = "100x2,500x5"   # 股票数x年数，逗号分隔
+SEED = 20240101
+END_DATE = "2026-09-30"          # 固定结束日期，保证不同时间生成的数据一致
+TRADING_DAYS_PER_YEAR = 244
+CODE_PREFIXES = ['600', '601', '603', '000', '002', '300', '688']
+ST_RATIO = 0.03
+LATE_LISTING_RATIO = 0.2         # 这部分股票在区间中途上市
+SUSPEND_RATIO = 0.005            # 每只股票随机停牌的交易日比例
+LIMIT_UP_PROB = 0.008            # 每日涨停概率
+REGRESSION_THRESHOLD = 1.2       # compare 中耗时超过基线此倍数标记为退化
+
+def board_limit(codes, is_st):
+    """各股票的涨跌幅限制：ST 5%，创业板/科创板 20%，其余 10%"""
+    growth = np.array([c.startswith(('300', '301', '688')) for c in codes])
+    return np.where(is_st, 0.05, np.where(growth, 0.2, 0.1))
+
+def synthetic_market(n_symbols, years, seed=SEED):
+    """生成合成行情，返回 (代码列表, 名称列表, {代码: TARGET_COLUMNS 格式的 DataFrame})"""
+    rng = np.random.default_rng(seed)
+    n_days = years * TRADING_DAYS_PER_YEAR
+    dates = pd.bdate_range(end=END_DATE, periods=n_days).strftime('%Y-%m-%d').values
+    codes = [f"{CODE_PREFIXES[k % len(CODE_PREFIXES)]}{k // len(CODE_PREFIXES):03d}" for k in range(n_symbols)]
+    is_st = rng.random(n_symbols) < ST_RATIO
+    limit = board_limit(codes, is_st)
+
+    # 带均值回归的价格路径，逐日按板块限制截断并四舍五入到分
+    anchor = rng.uniform(4, 40, n_symbols)
+    shocks = rng.standard_t(4, (n_days, n_symbols)) * 0.018
+    limit_up = rng.random((n_days, n_symbols)) < LIMIT_UP_PROB
+    close = np.empty((n_days, n_symbols))
+    prev = np.empty((n_days, n_symbols))
+    close[0] = np.round(anchor * rng.uniform(0.7, 1.3, n_symbols), 2)
+    prev[0] = close[0]
+    for t in range(1, n_days):
+        p = close[t - 1]
+        up, down = np.round(p * (1 + limit), 2), np.round(p * (1 - limit), 2)
+        target = p * np.exp(shocks[t] - 0.02 * np.log(p / anchor))
+        c = np.clip(np.round(target, 2), down, up)
+        close[t] = np.maximum(np.where(limit_up[t], up, c), 1.0)
+        prev[t] = p
+
+    up, down = np.round(prev * (1 + limit), 2), np.round(prev * (1 - limit), 2)
+    opens = np.clip(np.round(prev * (1 + rng.normal(0, 0.008, close.shape)), 2), down, up)
+    high = np.minimum(np.round(np.maximum(opens, close) * (1 + np.abs(rng.normal(0, 0.008, close.shape))), 2), up)
+    low = np.maximum(np.round(np.minimum(opens, close) * (1 - np.abs(rng.normal(0, 0.008, close.shape))), 2), down)
+    move = np.abs(close / prev - 1)
+    base_vol = rng.lognormal(11, 0.8, n_symbols)
+    volume = (base_vol * rng.lognormal(0, 0.4, close.shape) * (1 + 8 * move)).astype(np.int64)
+    float_shares = base_vol * 100 / (rng.uniform(0.5, 5, n_symbols) / 100)
+
+    start_rows = np.where(rng.random(n_symbols) < LATE_LISTING_RATIO,
+                          rng.integers(0, int(n_days * 0.6), n_symbols), 0)
+    suspended = rng.random((n_days, n_symbols)) < SUSPEND_RATIO
+    frames = {}
+    for j, code in enumerate(codes):
+        keep = ~suspended[:, j]
+        keep[:start_rows[j]] = False
+        df = pd.DataFrame({
+            '日期': dates, '股票代码': code, '开盘': opens[:, j], '收盘': close[:, j],
+            '最高': high[:, j], '最低': low[:, j], '成交量': volume[:, j],
+            '成交额': np.round(volume[:, j] * 100 * (opens[:, j] + close[:, j] + high[:, j] + low[:, j]) / 4, 1),
+            '振幅': np.round((high[:, j] - low[:, j]) / prev[:, j] * 100, 2),
+            '涨跌幅': np.round((close[:, j] / prev[:, j] - 1) * 100, 2),
+            '涨跌额': np.round(close[:, j] - prev[:, j], 2),
+            '换手率': np.round(volume[:, j] * 100 / float_shares[j] * 100, 2),
+        })[keep]
+        frames[code] = df[TARGET_COLUMNS].reset_index(drop=True)
+    names = [("ST" if is_st[j] else "") + f"合成{code}" for j, code in enumerate(codes)]
+    return codes, names, frames
+
+def generate_market(root, n_symbols, years, seed=SEED):
+    """在 root 下生成 stock_data/*.csv 与 stock_names.csv，同样的参数总是生成同样的字节"""
+    codes, names, frames = synthetic_market(n_symbols, years, seed)
+    data_dir = os.path.join(root, "stock_data")
+    os.makedirs(data_dir, exist_ok=True)
+    for code, df in frames.items():
+        df.to_csv(os.path.join(data_dir, f"{code}.csv"), index=False, encoding='utf-8')
+    pd.DataFrame({'code': codes, 'name': names}).to_csv(os.path.join(root, "stock_names.csv"),
+                                                        index=False, encoding='utf-8-sig')
+    return codes
+
+@contextlib.contextmanager
+def working_dir(path):
+    """各脚本使用相对路径 (stock_data / stock_names.csv / 结果目录)，计时期间切换到数据根目录"""
+    old = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(old)
+
+def timed(fn, repeat=1):
+    """执行 repeat 次取最短耗时，屏蔽脚本自身的打印"""
+    best, result = None, None
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            t0 = time.perf_counter()
+            result = fn()
+            cost = time.perf_counter() - t0
+        best = cost if best is None else min(best, cost)
+    return best, result
+
+def _load_all(files):
+    from stock_storage import load_stock
+    return {os.path.basename(f).split('.')[0]: load_stock(f) for f in files}
+
+def run_stages(root, repeat=1):
+    """在已生成的数据根目录下依次计时各阶段，返回 {阶段名: 秒数或跳过原因}"""
+    import stock_scanner_go_mini as scanner
+    import volume_reversal_strategy as reversal
+    import zhangting_huimaqiang as zhangting
+    import sync_stock_data
+
+    stages = {}
+    with working_dir(root):
+        files = sorted(glob.glob(os.path.join("stock_data", "*.csv")))
+        names_df = pd.read_csv("stock_names.csv", dtype={'code': str})
+        name_map = dict(zip(names_df['code'], names_df['name']))
+
+        stages['load'], frames = timed(lambda: _load_all(files), repeat)
+        stages['scan.indicators'], _ = timed(lambda: [scanner.calculate_indicators(df) for df in frames.values()], repeat)
+        stages['scan.filter'], scan_hits = timed(
+            lambda: [r for c, df in frames.items() if (r := scanner.analyze_frame(df, c, name_map[c])) is not None], repeat)
+        stages['scan.vectorized'], _ = timed(lambda: scanner.scan_vectorized(name_map), repeat)
+        stages['scan.write'], _ = timed(lambda: scanner.save_results(scan_hits, datetime.now(scanner.SHANGHAI_TZ)), repeat)
+
+        stages['reversal.backtest'], reversal_hits = timed(
+            lambda: [r for c, df in frames.items() if (r := reversal.analyze_frame(df, c, name_map[c])) is not None], repeat)
+        stages['reversal.write'], _ = timed(lambda: reversal.save_results(reversal_hits), repeat)
+
+        stages['zhangting.backtest'], zhangting_hits = timed(
+            lambda: [r for c, df in frames.items() if (r := zhangting.analyze_frame(df, c, name_map[c])) is not None], repeat)
+        stages['zhangting.write'], _ = timed(lambda: zhangting.save_results(zhangting_hits), repeat)
+
+        # 同步：先全量复制，再在源文件末尾各追加一行后做增量同步
+        shutil.rmtree("sync_target", ignore_errors=True)
+        stages['sync.full'], _ = timed(lambda: sync_stock_data.sync_csv_files("stock_data", "sync_target", full=True))
+        shutil.rmtree("sync_source", ignore_errors=True)
+        shutil.copytree("stock_data", "sync_source")
+        shutil.copytree("sync_target", "sync_target_inc")
+        for f in glob.glob(os.path.join("sync_source", "*.csv")):
+            with open(f, 'rb') as src:
+                last = src.read().rstrip(b'\n').rsplit(b'\n', 1)[-1]
+            with open(f, 'ab') as dst:
+                dst.write(last + b'\n')
+        stages['sync.incremental'], _ = timed(lambda: sync_stock_data.sync_csv_files("sync_source", "sync_target"))
+
+        # 下载器与名单管理依赖 akshare 模块 (本地阶段不联网)，未安装时记录跳过
+        try:
+            import stock_data_downloader as downloader
+            import stock_list_manager
+        except ImportError as e:
+            stages['downloader.tail_read'] = stages['downloader.append'] = stages['list.filter'] = f"skipped: {e}"
+        else:
+            targets = sorted(glob.glob(os.path.join("sync_target_inc", "*.csv")))
+            stages['downloader.tail_read'], _ = timed(lambda: [downloader.read_last_date(f) for f in targets], repeat)
+            new_rows = {f: frames[os.path.basename(f).split('.')[0]].tail(1) for f in targets}
+            stages['downloader.append'], _ = timed(lambda: [downloader.append_rows(f, df) for f, df in new_rows.items()])
+            spot = pd.DataFrame({'代码': names_df['code'], '名称': names_df['name'],
+                                 '最新价': [frames[c]['收盘'].iloc[-1] for c in names_df['code']]})
+            stages['list.filter'], _ = timed(lambda: stock_list_manager.filter_stock_list(spot), repeat)
+
+        for d in ("sync_source", "sync_target", "sync_target_inc"):
+            shutil.rmtree(d, ignore_errors=True)
+    return stages
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def parse_scales(text):
+    """"100x2,500x5" -> [(100, 2), (500, 5)]"""
+    scales = []
+    for item in text.split(","):
+        n, years = item.lower().split("x")
+        scales.append((int(n), int(years)))
+    return scales
+
+def run_benchmarks(scales, data_root=BENCH_DATA_DIR, seed=SEED, repeat=1, out_dir=BENCH_RESULTS_DIR):
+    commit = _git_commit()
+    report = {
+        "commit": commit, "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "seed": seed,
+        "python": platform.python_version(), "pandas": pd.__version__, "numpy": np.__version__,
+        "cpu_count": os.cpu_count(), "scales": {},
+    }
+    for n_symbols, years in scales:
+        label = f"{n_symbols}x{years}"
+        root = os.path.abspath(os.path.join(data_root, f"{label}_s{seed}"))
+        if not os.path.exists(os.path.join(root, "stock_names.csv")):
+            t0 = time.perf_counter()
+            generate_market(root, n_symbols, years, seed)
+            print(f"🧪 生成合成行情 {label}: {n_symbols} 只 × {years * TRADING_DAYS_PER_YEAR} 个交易日，"
+                  f"耗时 {time.perf_counter() - t0:.1f}s")
+        stages = run_stages(root, repeat)
+        report["scales"][label] = stages
+        print(f"\n===== {label} =====")
+        for name, value in stages.items():
+            print(f"  {name:<22} {value:>9.3f}s" if isinstance(value, float) else f"  {name:<22} {value}")
+
+    os.makedirs(out_dir, exist_ok=True)
+    out_path = os.path.join(out_dir, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{commit or 'nogit'}.json")
+    with open(out_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n✅ 基准结果已保存至 {out_path}")
+    return report
+
+def compare_reports(base_path, new_path, threshold=REGRESSION_THRESHOLD):
+    """对比两次基准结果，返回退化 (耗时超过基线 threshold 倍) 的 (规模, 阶段) 列表"""
+    with open(base_path, 'r', encoding='utf-8') as f:
+        base = json.load(f)
+    with open(new_path, 'r', encoding='utf-8') as f:
+        new = json.load(f)
+    print(f"基线 {base.get('commit')} ({base.get('timestamp')}) → 新 {new.get('commit')} ({new.get('timestamp')})")
+    regressions = []
+    for label, stages in new["scales"].items():
+        old_stages = base["scales"].get(label, {})
+        print(f"\n===== {label} =====")
+        for name, value in stages.items():
+            old = old_stages.get(name)
+            if not isinstance(value, float) or not isinstance(old, float):
+                continue
+            ratio = value / old if old > 0 else float('inf')
+            flag = "⚠️" if ratio > threshold else "  "
+            print(f"{flag} {name:<22} {old:>9.3f}s → {value:>9.3f}s  ×{ratio:.2f}")
+            if ratio > threshold:
+                regressions.append((label, name))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="合成行情基准测试")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_gen = sub.add_parser("generate", help="只生成合成行情")
+    p_gen.add_argument("root", help="输出根目录 (其下生成 stock_data/ 与 stock_names.csv)")
+    p_gen.add_argument("--symbols", type=int, default=500)
+    p_gen.add_argument("--years", type=int, default=5)
+    p_gen.add_argument("--seed", type=int, default=SEED)
+    p_run = sub.add_parser("run", help="生成 (如未缓存) 并计时各阶段")
+    p_run.add_argument("--scales", default=DEFAULT_SCALES, help=f"规模列表，默认 {DEFAULT_SCALES}")
+    p_run.add_argument("--seed", type=int, default=SEED)
+    p_run.add_argument("--repeat", type=int, default=1, help="每阶段重复次数，取最短耗时")
+    p_run.add_argument("--data-root", default=BENCH_DATA_DIR, help="合成数据缓存目录")
+    p_run.add_argument("--out", default=BENCH_RESULTS_DIR, help="结果 JSON 目录")
+    p_cmp = sub.add_parser("compare", help="对比两次基准结果")
+    p_cmp.add_argument("base")
+    p_cmp.add_argument("new")
+    p_cmp.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    if args.command == "generate":
+        codes = generate_market(args.root, args.symbols, args.years, args.seed)
+        print(f"✅ 已生成 {len(codes)} 只股票至 {args.root}")
+    elif args.command == "run":
+        run_benchmarks(parse_scales(args.scales), args.data_root, args.seed, args.repeat, args.out)
+    else:
+        if compare_reports(args.base, args.new, args.threshold):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
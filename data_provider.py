@@ -0,0 +1,419 @@
+import os
+import time
+import glob
+import shutil
+import random
+import json
+import pickle
+import hashlib
+import argparse
+import threading
+import contextlib
+from collections import deque
+from datetime import datetime, timedelta, timezone
+import pandas as pd
+
+# ==========================================
+# 行情数据源抽象
+# 下载器与名单管理只通过 provider 取数，接口与 akshare 同名同参：
+#   stock_zh_a_hist / tool_trade_date_hist_sina / stock_zh_a_spot_em
+# 实现：
+#   akshare   - 真实接口 (延迟导入 akshare)
+#   record    - 调用 akshare 的同时把每次响应写到 fixture 目录
+#   replay    - 只从 fixture 目录回放录制的响应，完全离线
+#   synthetic - 确定性合成行情，可配置延迟、随机错误与服务端限流，用于本地压测并发/频控/重试
+# 默认数据源由环境变量 STOCK_DATA_PROVIDER 决定；真实接口默认再包一层磁盘响应缓存 (CachingProvider)。
+# ==========================================
+
+DATA_PROVIDER = os.environ.get("STOCK_DATA_PROVIDER", "akshare")
+FIXTURE_DIR = os.environ.get("STOCK_FIXTURE_DIR", "fixtures")
+
+# 合成数据源默认参数 (均可用环境变量覆盖)
+SYNTHETIC_SYMBOLS = int(os.environ.get("STOCK_SYNTHETIC_SYMBOLS", 300))
+SYNTHETIC_YEARS = int(os.environ.get("STOCK_SYNTHETIC_YEARS", 3))
+SYNTHETIC_LATENCY = float(os.environ.get("STOCK_SYNTHETIC_LATENCY", 0.05))       # 每次请求的基础延迟 (秒)
+SYNTHETIC_JITTER = float(os.environ.get("STOCK_SYNTHETIC_JITTER", 0.05))         # 附加的随机延迟上限 (秒)
+SYNTHETIC_ERROR_RATE = float(os.environ.get("STOCK_SYNTHETIC_ERROR_RATE", 0.0))  # 随机失败概率
+SYNTHETIC_THROTTLE = float(os.environ.get("STOCK_SYNTHETIC_THROTTLE", 0))        # 每秒请求数上限，0 为不限
+SYNTHETIC_SEED = 20240101
+
+# 响应缓存：键为 (股票, 周期, 起止日期, 复权, 交易日)，内容按哈希去重存放
+CACHE_DIR = os.environ.get("STOCK_PROVIDER_CACHE_DIR", ".provider_cache")
+PROVIDER_CACHE = os.environ.get("STOCK_PROVIDER_CACHE", "1") != "0"
+CACHEABLE_PROVIDERS = ("akshare", "record")
+TODAY_TTL = 600              # 盘中含当日行、或收盘后仍缺当日行的响应只缓存 10 分钟
+CACHE_KEEP_DAYS = 3          # 交易日早于此天数的缓存条目在启动时清理
+MARKET_CLOSE_HOUR = 15
+SHANGHAI_TZ = timezone(timedelta(hours=8))  # 北京时间无夏令时，固定 UTC+8
+
+class ProviderError(Exception):
+    """数据源请求失败 (录制缺失、注入的网络错误、触发限流)"""
+
+class AkshareProvider:
+    name = "akshare"
+
+    def __init__(self):
+        import akshare
+        self.ak = akshare
+
+    def stock_zh_a_hist(self, symbol, period="daily", start_date="19700101", end_date="20500101", adjust=""):
+        return self.ak.stock_zh_a_hist(symbol=symbol, period=period, start_date=start_date,
+                                       end_date=end_date, adjust=adjust)
+
+    def tool_trade_date_hist_sina(self):
+        return self.ak.tool_trade_date_hist_sina()
+
+    def stock_zh_a_spot_em(self):
+        return self.ak.stock_zh_a_spot_em()
+
+def _fixture_path(fixture_dir, method, *parts):
+    key = "_".join(str(p) for p in parts) if parts else "all"
+    return os.path.join(fixture_dir, method, f"{key}.pkl")
+
+class RecordingProvider:
+    """透传给真实数据源，并把每次成功的响应按 (接口, 参数) 落盘"""
+    name = "record"
+
+    def __init__(self, inner=None, fixture_dir=FIXTURE_DIR):
+        self.inner = inner or AkshareProvider()
+        self.fixture_dir = fixture_dir
+
+    def _record(self, df, method, *parts):
+        path = _fixture_path(self.fixture_dir, method, *parts)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        df.to_pickle(path + ".tmp")
+        os.replace(path + ".tmp", path)
+        return df
+
+    def stock_zh_a_hist(self, symbol, period="daily", start_date="19700101", end_date="20500101", adjust=""):
+        df = self.inner.stock_zh_a_hist(symbol, period, start_date, end_date, adjust)
+        return self._record(df, "stock_zh_a_hist", symbol, period, adjust or "none", start_date, end_date)
+
+    def tool_trade_date_hist_sina(self):
+        return self._record(self.inner.tool_trade_date_hist_sina(), "tool_trade_date_hist_sina")
+
+    def stock_zh_a_spot_em(self):
+        return self._record(self.inner.stock_zh_a_spot_em(), "stock_zh_a_spot_em")
+
+class ReplayProvider:
+    """只读回放录制结果
+
+    历史接口先找参数完全相同的录制；找不到时取同一股票/周期/复权方式覆盖范围最大的一份，
+    按请求的起止日期截取，这样增量下载换了起始日期也能回放。
+    """
+    name = "replay"
+
+    def __init__(self, fixture_dir=FIXTURE_DIR):
+        self.fixture_dir = fixture_dir
+
+    def _load(self, path):
+        if not os.path.exists(path):
+            raise ProviderError(f"没有录制的响应: {path}")
+        return pd.read_pickle(path)
+
+    def stock_zh_a_hist(self, symbol, period="daily", start_date="19700101", end_date="20500101", adjust=""):
+        exact = _fixture_path(self.fixture_dir, "stock_zh_a_hist", symbol, period, adjust or "none", start_date, end_date)
+        if os.path.exists(exact):
+            return pd.read_pickle(exact)
+        pattern = _fixture_path(self.fixture_dir, "stock_zh_a_hist", symbol, period, adjust or "none", "*", "*")
+        candidates = glob.glob(pattern)
+        if not candidates:
+            raise ProviderError(f"没有录制的响应: {symbol} {period} {adjust}")
+        df = max((pd.read_pickle(p) for p in candidates), key=len)
+        dates = pd.to_datetime(df['日期'].astype(str)).dt.strftime('%Y%m%d')
+        return df[(dates >= start_date) & (dates <= end_date)].reset_index(drop=True)
+
+    def tool_trade_date_hist_sina(self):
+        return self._load(_fixture_path(self.fixture_dir, "tool_trade_date_hist_sina"))
+
+    def stock_zh_a_spot_em(self):
+        return self._load(_fixture_path(self.fixture_dir, "stock_zh_a_spot_em"))
+
+class SyntheticProvider:
+    """确定性合成行情 + 可配置的延迟 / 随机错误 / 服务端限流
+
+    行情复用 benchmark.synthetic_market，同样的 seed 总是返回同样的数据；
+    错误注入按 (股票, 第几次请求) 决定，与线程调度顺序无关，重试行为可复现。
+    """
+    name = "synthetic"
+
+    def __init__(self, n_symbols=SYNTHETIC_SYMBOLS, years=SYNTHETIC_YEARS, latency=SYNTHETIC_LATENCY,
+                 jitter=SYNTHETIC_JITTER, error_rate=SYNTHETIC_ERROR_RATE, throttle=SYNTHETIC_THROTTLE,
+                 seed=SYNTHETIC_SEED):
+        from benchmark import synthetic_market
+
+        self.codes, self.names, self.frames = synthetic_market(n_symbols, years, seed)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle = throttle
+        self.seed = seed
+        self.calls = 0
+        self.errors = 0
+        self.throttled = 0
+        self._attempts = {}
+        self._recent = deque()
+        self._lock = threading.Lock()
+
+    def _request(self, key):
+        """模拟一次网络请求：计数、限流判定、延迟、错误注入"""
+        with self._lock:
+            self.calls += 1
+            attempt = self._attempts.get(key, 0)
+            self._attempts[key] = attempt + 1
+            now = time.monotonic()
+            while self._recent and now - self._recent[0] > 1.0:
+                self._recent.popleft()
+            self._recent.append(now)
+            over_limit = self.throttle and len(self._recent) > self.throttle
+            if over_limit:
+                self.throttled += 1
+        digest = hashlib.md5(f"{self.seed}:{key}:{attempt}".encode()).digest()
+        draw = int.from_bytes(digest[:8], 'big') / 2 ** 64
+        time.sleep(self.latency + self.jitter * random.random())
+        if over_limit:
+            raise ProviderError(f"请求过于频繁 (>{self.throttle}/s)")
+        if draw < self.error_rate:
+            with self._lock:
+                self.errors += 1
+            raise ProviderError(f"注入的网络错误: {key}")
+
+    def stock_zh_a_hist(self, symbol, period="daily", start_date="19700101", end_date="20500101", adjust=""):
+        self._request(symbol)
+        df = self.frames.get(symbol)
+        if df is None:
+            return pd.DataFrame()
+        dates = df['日期'].str.replace("-", "")
+        return df[(dates >= start_date) & (dates <= end_date)].reset_index(drop=True)
+
+    def tool_trade_date_hist_sina(self):
+        self._request("trade_dates")
+        dates = sorted(set().union(*(df['日期'] for df in self.frames.values())))
+        return pd.DataFrame({'trade_date': pd.to_datetime(dates).date})
+
+    def stock_zh_a_spot_em(self):
+        self._request("spot")
+        last = pd.DataFrame([df.iloc[-1] for df in self.frames.values() if len(df)])
+        spot = last.rename(columns={'股票代码': '代码', '收盘': '最新价', '开盘': '今开'})
+        spot.insert(1, '名称', [self.names[self.codes.index(c)] for c in spot['代码']])
+        return spot.drop(columns=['日期']).reset_index(drop=True)
+
+    def stats(self):
+        return {'calls': self.calls, 'errors': self.errors, 'throttled': self.throttled}
+
+class CachingProvider:
+    """按请求参数 + 当天日期缓存历史接口响应，重试与重跑时已成功的区间不再请求网络
+
+    过期规则：
+      - 请求区间在今天之前结束：不会再变化，视为不可变
+      - 响应含当日数据：收盘前 TODAY_TTL 秒后过期 (盘中数据仍在变)，收盘后视为不可变
+      - 只含历史数据、请求发生在收盘前：收盘时过期 (收盘后应能取到当日行)
+      - 只含历史数据、请求发生在收盘后：TODAY_TTL 秒后过期 (数据源可能晚些才发布当日行，重试要能取到)
+    缓存键包含当天日期，跨日自动失效；旧条目与无人引用的内容在启动时清理。
+    """
+    name = "cached"
+
+    def __init__(self, inner, cache_dir=CACHE_DIR, keep_days=CACHE_KEEP_DAYS):
+        self.inner = inner
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()  # 下载器多线程共用一个实例，计数需加锁
+        os.makedirs(os.path.join(cache_dir, "refs"), exist_ok=True)
+        os.makedirs(os.path.join(cache_dir, "objects"), exist_ok=True)
+        self.prune(keep_days)
+
+    def _ref_path(self, key):
+        digest = hashlib.sha1(json.dumps(key, ensure_ascii=False).encode()).hexdigest()
+        return os.path.join(self.cache_dir, "refs", f"{digest}.json")
+
+    def _write_atomic(self, path, write):
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        write(tmp_path)
+        os.replace(tmp_path, path)
+
+    def _get(self, key, now):
+        ref_path = self._ref_path(key)
+        try:
+            with open(ref_path, 'r', encoding='utf-8') as f:
+                ref = json.load(f)
+            if ref['expires'] is not None and now.timestamp() >= ref['expires']:
+                return None
+            return pd.read_pickle(os.path.join(self.cache_dir, "objects", f"{ref['object']}.pkl"))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _put(self, key, df, expires):
+        payload = pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL)
+        digest = hashlib.sha1(payload).hexdigest()
+        obj_path = os.path.join(self.cache_dir, "objects", f"{digest}.pkl")
+        if not os.path.exists(obj_path):
+            def write_object(p):
+                with open(p, 'wb') as f:
+                    f.write(payload)
+            self._write_atomic(obj_path, write_object)
+        ref = {'key': key, 'object': digest, 'expires': expires}
+
+        def write_ref(p):
+            with open(p, 'w', encoding='utf-8') as f:
+                json.dump(ref, f)
+        self._write_atomic(self._ref_path(key), write_ref)
+
+    def _expires(self, df, now, end_date=None):
+        today = now.strftime('%Y-%m-%d')
+        if end_date is not None and str(end_date) < now.strftime('%Y%m%d'):
+            return None
+        has_today = df is not None and not df.empty and '日期' in df.columns and \
+            pd.to_datetime(df['日期'].astype(str)).dt.strftime('%Y-%m-%d').max() >= today
+        closed = now.hour >= MARKET_CLOSE_HOUR
+        if has_today:
+            return None if closed else now.timestamp() + TODAY_TTL
+        if not closed:
+            return now.replace(hour=MARKET_CLOSE_HOUR, minute=0, second=0, microsecond=0).timestamp()
+        return now.timestamp() + TODAY_TTL
+
+    def stock_zh_a_hist(self, symbol, period="daily", start_date="19700101", end_date="20500101", adjust=""):
+        now = datetime.now(SHANGHAI_TZ)
+        key = ["stock_zh_a_hist", symbol, period, start_date, end_date, adjust, now.strftime('%Y-%m-%d')]
+        df = self._get(key, now)
+        with self._lock:
+            if df is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if df is not None:
+            return df
+        df = self.inner.stock_zh_a_hist(symbol, period, start_date, end_date, adjust)
+        if df is not None:
+            self._put(key, df, self._expires(df, now, end_date))
+        return df
+
+    def tool_trade_date_hist_sina(self):
+        # 交易日历当天内不变
+        now = datetime.now(SHANGHAI_TZ)
+        key = ["tool_trade_date_hist_sina", now.strftime('%Y-%m-%d')]
+        df = self._get(key, now)
+        if df is None:
+            df = self.inner.tool_trade_date_hist_sina()
+            self._put(key, df, None)
+        return df
+
+    def stock_zh_a_spot_em(self):
+        return self.inner.stock_zh_a_spot_em()  # 实时快照不缓存
+
+    def prune(self, keep_days=CACHE_KEEP_DAYS):
+        """删除交易日过旧或已过期的条目，再删除没有条目引用的内容文件"""
+        now = datetime.now(SHANGHAI_TZ)
+        cutoff = (now - timedelta(days=keep_days)).strftime('%Y-%m-%d')
+        refs_dir, objects_dir = os.path.join(self.cache_dir, "refs"), os.path.join(self.cache_dir, "objects")
+        live = set()
+        for name in os.listdir(refs_dir):
+            path = os.path.join(refs_dir, name)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    ref = json.load(f)
+                stale = ref['key'][-1] < cutoff or (ref['expires'] is not None and now.timestamp() >= ref['expires'])
+            except (OSError, ValueError, KeyError):
+                stale, ref = True, None
+            if stale:
+                with contextlib.suppress(OSError):
+                    os.remove(path)
+            else:
+                live.add(ref['object'])
+        for name in os.listdir(objects_dir):
+            if name.split('.')[0] not in live:
+                with contextlib.suppress(OSError):
+                    os.remove(os.path.join(objects_dir, name))
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+PROVIDERS = {"akshare": AkshareProvider, "record": RecordingProvider,
+             "replay": ReplayProvider, "synthetic": SyntheticProvider}
+
+_default_provider = None
+_default_lock = threading.Lock()
+
+def make_provider(name=None, cache=None, **options):
+    """创建数据源；cache 为 None 时按 STOCK_PROVIDER_CACHE 给真实接口包上响应缓存"""
+    name = name or DATA_PROVIDER
+    if name not in PROVIDERS:
+        raise ValueError(f"未知数据源: {name} (可选 {', '.join(PROVIDERS)})")
+    provider = PROVIDERS[name](**options)
+    if cache is None:
+        cache = PROVIDER_CACHE and name in CACHEABLE_PROVIDERS
+    return CachingProvider(provider) if cache else provider
+
+def get_provider():
+    """进程内共享的默认数据源，首次使用时按 STOCK_DATA_PROVIDER 创建"""
+    global _default_provider
+    with _default_lock:
+        if _default_provider is None:
+            _default_provider = make_provider()
+        return _default_provider
+
+def set_provider(provider, cache=None):
+    """替换默认数据源 (provider 实例或名称)，返回实例"""
+    global _default_provider
+    if isinstance(provider, str):
+        provider = make_provider(provider, cache)
+    with _default_lock:
+        _default_provider = provider
+    return provider
+
+def bench_downloader(root, workers_list, rate, burst, **options):
+    """在 root 下用合成数据源离线跑完整下载流程，比较不同并发数的吞吐与重试"""
+    import stock_data_downloader as downloader
+    import stock_list_manager
+    import data_provider  # 以脚本运行时本模块是 __main__，必须设置下载器实际导入的那份默认数据源
+
+    results = []
+    for workers in workers_list:
+        run_dir = os.path.join(root, f"workers_{workers}")
+        shutil.rmtree(run_dir, ignore_errors=True)
+        os.makedirs(run_dir)
+        old = os.getcwd()
+        os.chdir(run_dir)
+        try:
+            provider = data_provider.set_provider(SyntheticProvider(**options))
+            os.makedirs(downloader.DATA_DIR, exist_ok=True)
+            stock_list_manager.filter_stock_list(provider.stock_zh_a_spot_em()).to_csv(
+                downloader.FILTERED_LIST_PATH, index=False, encoding='utf-8-sig')
+            t0 = time.perf_counter()
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                try:
+                    downloader.main(["--workers", str(workers), "--rate", str(rate), "--burst", str(burst)])
+                except SystemExit:
+                    pass
+            cost = time.perf_counter() - t0
+        finally:
+            os.chdir(old)
+        stats = provider.stats()
+        files = len(glob.glob(os.path.join(run_dir, downloader.DATA_DIR, "[0-9]*.csv")))
+        results.append((workers, cost, stats, files))
+        print(f"⚙️ 并发 {workers:>3}: {cost:6.2f}s，请求 {stats['calls']}，注入错误 {stats['errors']}，"
+              f"被限流 {stats['throttled']}，落盘 {files} 只")
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="数据源工具：离线压测下载流程")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_bench = sub.add_parser("bench", help="用合成数据源压测下载器的并发/频控/重试")
+    p_bench.add_argument("root", help="工作目录 (每个并发数一个子目录)")
+    p_bench.add_argument("--workers", default="1,4,8", help="逗号分隔的并发数列表")
+    p_bench.add_argument("--rate", type=float, default=50.0)
+    p_bench.add_argument("--burst", type=int, default=10)
+    p_bench.add_argument("--symbols", type=int, default=SYNTHETIC_SYMBOLS)
+    p_bench.add_argument("--latency", type=float, default=SYNTHETIC_LATENCY)
+    p_bench.add_argument("--jitter", type=float, default=SYNTHETIC_JITTER)
+    p_bench.add_argument("--error-rate", type=float, default=SYNTHETIC_ERROR_RATE)
+    p_bench.add_argument("--throttle", type=float, default=SYNTHETIC_THROTTLE)
+    args = parser.parse_args(argv)
+
+    workers_list = [int(w) for w in args.workers.split(",")]
+    bench_downloader(args.root, workers_list, args.rate, args.burst, n_symbols=args.symbols,
+                     latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                     throttle=args.throttle)
+
+if __name__ == "__main__":
+    main()
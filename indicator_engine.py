@@ -0,0 +1,226 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from stock_storage import STOCK_DATA_DIR, load_stock, list_symbols, dates_to_int
+
+# ==========================================
+# 横截面向量化指标引擎
+# 把全市场数据排成 (行 × 股票) 的二维数组，一次性计算 calculate_indicators 的全部指标。
+# 每只股票的数据“底部对齐”：最后一行都是各自的最新交易日，上方不足部分填 NaN，
+# 这样滚动窗口与逐只计算看到的是完全相同的序列，结果逐位一致。
+# 内存映射价格面板 (stock_panel.py) 存在且不比日线旧时直接从面板切出，不再逐只解析文件。
+# ==========================================
+
+INDICATOR_FIELDS = ['收盘', '最高', '最低', '成交量', '换手率', '涨跌幅']
+INDICATOR_NAMES = ['rsi6', 'kdj_k', 'ma5', 'ma60', 'avg_turnover_30', 'vol_ma5', 'vol_ratio']
+DEFAULT_LOOKBACK = 250       # 日常扫描只取最近 N 行，全量历史传 None
+
+class AlignedMarket:
+    """底部对齐的全市场数据：fields[字段] 为 (行 × 股票) float64，valid 标记真实数据行，
+    dates 为同形状的 int32 YYYYMMDD (填充行为 0)"""
+
+    def __init__(self, symbols, fields, valid, last_dates, lengths, dates=None):
+        self.symbols = symbols
+        self.fields = fields
+        self.valid = valid
+        self.last_dates = last_dates
+        self.lengths = lengths
+        self.dates = dates
+
+    def tail(self, rows):
+        """只保留最后 rows 行 (如丢弃仅用于预热指标的前缀)；lengths 仍为各股文件总行数"""
+        if rows is None or rows >= self.valid.shape[0]:
+            return self
+        return AlignedMarket(self.symbols, {f: v[-rows:] for f, v in self.fields.items()}, self.valid[-rows:],
+                             self.last_dates, self.lengths, None if self.dates is None else self.dates[-rows:])
+
+def align_frames(frames, lookback=DEFAULT_LOOKBACK, fields=INDICATOR_FIELDS):
+    """{代码: DataFrame} -> AlignedMarket；lookback 为 None 时保留完整历史，fields 为需要对齐的列"""
+    symbols = list(frames)
+    lengths = np.array([len(frames[s]) for s in symbols], dtype=np.int64)
+    rows = int(lengths.max(initial=0)) if lookback is None else int(min(lookback, lengths.max(initial=0)))
+    aligned = {f: np.full((rows, len(symbols)), np.nan) for f in fields}
+    valid = np.zeros((rows, len(symbols)), dtype=bool)
+    dates = np.zeros((rows, len(symbols)), dtype=np.int32)
+    last_dates = []
+    for j, s in enumerate(symbols):
+        df = frames[s]
+        n = min(len(df), rows)
+        for f in fields:
+            if f in df.columns:
+                aligned[f][rows - n:, j] = df[f].values[len(df) - n:]
+        valid[rows - n:, j] = True
+        if n:
+            dates[rows - n:, j] = dates_to_int(df['日期'].values[len(df) - n:])
+        last_dates.append(df['日期'].iloc[-1] if len(df) else None)
+    return AlignedMarket(symbols, aligned, valid, last_dates, lengths, dates)
+
+def fresh_panel(codes, fields, data_dir=STOCK_DATA_DIR):
+    """面板由 data_dir 的完整历史构建、不比其中任何日线文件旧、且覆盖所需股票与字段时返回 PricePanel，否则 None"""
+    from stock_panel import PANEL_DIR, META_FILE, open_panel
+
+    meta_path = os.path.join(PANEL_DIR, META_FILE)
+    try:
+        built = os.path.getmtime(meta_path)
+        if any(os.path.getmtime(os.path.join(data_dir, f"{c}.csv")) > built for c in codes):
+            return None
+        panel = open_panel()
+    except (OSError, ValueError):
+        return None
+    if panel.data_dir != os.path.abspath(data_dir) or panel.start_date is not None \
+            or any(f not in panel.field_index for f in fields):
+        return None
+    return panel if all(c in panel.symbol_index for c in codes) else None
+
+def load_market(codes=None, lookback=DEFAULT_LOOKBACK, data_dir=STOCK_DATA_DIR, fields=INDICATOR_FIELDS,
+                use_panel=True):
+    """读取全市场并底部对齐 (fields 可在指标字段之外追加其他列)
+
+    有可用的内存映射面板时零拷贝打开并切片，否则从存储后端逐只读取。
+    """
+    codes = codes if codes is not None else list_symbols(data_dir)
+    panel = fresh_panel(codes, fields, data_dir) if use_panel and codes else None
+    if panel is not None:
+        return market_from_panel(panel, lookback, codes, fields)
+    frames = {}
+    for code in codes:
+        try:
+            df = load_stock(os.path.join(data_dir, f"{code}.csv"), columns=['日期'] + list(fields))
+        except Exception as e:
+            print(f"读取失败 {code}: {e}")
+            continue
+        if not df.empty:
+            frames[code] = df
+    return align_frames(frames, lookback, fields)
+
+def market_from_panel(panel, lookback=DEFAULT_LOOKBACK, codes=None, fields=INDICATOR_FIELDS):
+    """从内存映射面板构建底部对齐数据，每列把停牌产生的 NaN 行压缩掉
+
+    lookback 与逐只读取一致：每只股票取自己最近 lookback 个有数据的交易日 (停牌日不占名额)。
+    面板是 float32，价格低于 131072 时两位小数字段 round(2) 后与 CSV 数值完全一致；
+    成交量超过 2^24 手时 float32 会丢失精度，量比可能有末位差异。
+    """
+    symbols = list(panel.symbols) if codes is None else list(codes)
+    cols = np.array([panel.symbol_index[c] for c in symbols], dtype=np.int64)
+    present = ~np.isnan(panel.field('收盘')[:, cols])
+    lengths = present.sum(axis=0)
+    last_rows = np.where(lengths > 0, len(present) - 1 - np.argmax(present[::-1], axis=0), -1)
+    start = 0
+    if lookback is not None:
+        # 从末尾数起的有数据行数，超过 lookback 的行不要；切片从最早仍需要的一行开始
+        from_end = np.cumsum(present[::-1], axis=0, dtype=np.int32)[::-1]
+        present &= from_end <= lookback
+        needed = np.flatnonzero(present.any(axis=1))
+        start = int(needed[0]) if len(needed) else len(present)
+        present = present[start:]
+    data = panel.data[start:]  # memmap 视图，不复制
+    # 稳定排序把无数据行排到上方、真实行保持原顺序排到底部
+    order = np.argsort(present, axis=0, kind='stable')
+    valid = np.take_along_axis(present, order, axis=0)
+    rows = int(lengths.max(initial=0)) if lookback is None else int(min(lookback, lengths.max(initial=0)))
+    order, valid = order[len(order) - rows:], valid[len(valid) - rows:]
+    out = {}
+    for f in fields:
+        values = np.take_along_axis(data[:, cols, panel.field_index[f]], order, axis=0).astype(np.float64)
+        if f != '成交量':
+            values = np.round(values, 2)
+        values[~valid] = np.nan
+        out[f] = values
+    dates = np.broadcast_to(panel.dates[start:, None], present.shape)
+    aligned_dates = np.where(valid, np.take_along_axis(dates, order, axis=0), 0).astype(np.int32)
+    last_dates = [None if r < 0 else f"{panel.dates[r] // 10000:04d}-{panel.dates[r] // 100 % 100:02d}-{panel.dates[r] % 100:02d}"
+                  for r in last_rows.tolist()]
+    return AlignedMarket(symbols, out, valid, last_dates, lengths, aligned_dates)
+
+def compute_indicators(market):
+    """对 AlignedMarket 计算与 calculate_indicators 相同的指标，返回 {指标名: (行 × 股票) 数组}
+
+    逐元素运算用 numpy，滚动/EWM 用 pandas 同一套 cython 内核按列批量执行，
+    运算顺序与逐只版本完全一致，因此结果逐位相同。
+    """
+    f = market.fields
+    close = pd.DataFrame(f['收盘'])
+    valid = market.valid
+
+    # 1. RSI6 (逐只版本首行 diff 为 NaN 后被置 0，填充行必须保持 NaN 才能不进入窗口)
+    delta = close.diff().values
+    gain = np.where(delta > 0, delta, 0.0)
+    loss = -np.where(delta < 0, delta, 0.0)
+    gain[~valid] = np.nan
+    loss[~valid] = np.nan
+    gain = pd.DataFrame(gain).rolling(window=6).mean().values
+    loss = pd.DataFrame(loss).rolling(window=6).mean().values
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rs = gain / np.where(loss == 0, np.nan, loss)
+        rsi6 = 100 - (100 / (1 + rs))
+
+    # 2. KDJ (9,3,3)
+    low_list = pd.DataFrame(f['最低']).rolling(window=9).min().values
+    high_list = pd.DataFrame(f['最高']).rolling(window=9).max().values
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rsv = (f['收盘'] - low_list) / (high_list - low_list) * 100
+    kdj_k = pd.DataFrame(rsv).ewm(com=2).mean().values
+
+    # 3. MA5 & MA60
+    ma5 = close.rolling(window=5).mean().values
+    ma60 = close.rolling(window=60).mean().values
+
+    # 4. 换手率均值与量比
+    avg_turnover_30 = pd.DataFrame(f['换手率']).rolling(window=30).mean().values
+    vol_ma5 = pd.DataFrame(f['成交量']).shift(1).rolling(window=5).mean().values
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vol_ratio = f['成交量'] / vol_ma5
+
+    return {'rsi6': rsi6, 'kdj_k': kdj_k, 'ma5': ma5, 'ma60': ma60,
+            'avg_turnover_30': avg_turnover_30, 'vol_ma5': vol_ma5, 'vol_ratio': vol_ratio}
+
+def verify_against_pandas(codes=None, lookback=None, data_dir=STOCK_DATA_DIR):
+    """逐位校验：向量化结果与 stock_scanner_go_mini.calculate_indicators 逐只结果完全相等
+
+    lookback 非空时逐只版本也只喂最近 lookback 行，两条路径输入一致。
+    返回不一致的 (代码, 指标) 列表。
+    """
+    from stock_scanner_go_mini import calculate_indicators
+
+    market = load_market(codes, lookback, data_dir)
+    result = compute_indicators(market)
+    rows = market.valid.shape[0]
+    mismatches = []
+    for j, code in enumerate(market.symbols):
+        df = load_stock(os.path.join(data_dir, f"{code}.csv"))
+        if lookback is not None:
+            df = df.iloc[-lookback:]
+        expected = calculate_indicators(df)
+        n = len(expected)
+        for name in INDICATOR_NAMES:
+            if not np.array_equal(expected[name].values, result[name][rows - n:, j], equal_nan=True):
+                mismatches.append((code, name))
+    print(f"🔎 校验 {len(market.symbols)} 只股票 × {len(INDICATOR_NAMES)} 个指标: "
+          f"{'全部逐位一致' if not mismatches else f'{len(mismatches)} 处不一致'}")
+    return mismatches
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="横截面向量化指标引擎")
+    parser.add_argument("command", choices=["verify", "bench"])
+    parser.add_argument("--lookback", type=int, default=None, help="只取最近 N 行，默认全部历史")
+    parser.add_argument("--limit", type=int, default=None, help="只取前 N 只股票")
+    args = parser.parse_args(argv)
+
+    codes = list_symbols()[:args.limit] if args.limit else None
+    if args.command == "verify":
+        if verify_against_pandas(codes, args.lookback):
+            sys.exit(1)
+        return
+
+    market = load_market(codes, args.lookback)
+    t0 = time.perf_counter()
+    compute_indicators(market)
+    cost = time.perf_counter() - t0
+    rows, cols = market.valid.shape
+    print(f"⏱️ {cols} 只股票 × {rows} 行指标计算耗时 {cost:.3f}s")
+
+if __name__ == "__main__":
+    main()
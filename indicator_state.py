@@ -0,0 +1,289 @@
+import os
+import sys
+import json
+import math
+import argparse
+import numpy as np
+from stock_storage import STOCK_DATA_DIR, load_stock, list_symbols, read_csv_tail
+
+# ==========================================
+# 增量指标状态
+# 为每只股票持久化计算 calculate_indicators 所需的最小状态：
+# 各滚动窗口的最近 N 个值、KDJ 的 EWM 累加器 (weighted / old_wt) 和上一根 MA5。
+# 每来一根新 K 线只做常数次运算，夜间扫描从“全历史重算”变成“每只股票一次更新”。
+# ==========================================
+
+STATE_PATH = os.path.join(STOCK_DATA_DIR, "indicator_state.json")
+STATE_VERSION = 1
+WINDOWS = {'closes': 60, 'gains': 6, 'losses': 6, 'highs': 9, 'lows': 9, 'turnovers': 30, 'vols': 6}
+TAIL_ROWS = 20               # 增量读取 CSV 末尾行数，缺口超过此数时回退为全量重建
+KDJ_COM = 2
+VALIDATE_TOLERANCE = 1e-8    # 滚动均值的求和顺序与 pandas 不同，允许末位误差
+
+# 与 pandas ewm(com=2, adjust=True) 内核使用完全相同的系数表达式
+_ALPHA = 1. / (1. + KDJ_COM)
+_OLD_WT_FACTOR = 1. - _ALPHA
+_NEW_WT = 1.
+
+def _div(a, b):
+    """与 numpy/pandas 一致的除法：除零得到 inf 或 NaN 而不是抛异常"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return float(np.float64(a) / np.float64(b))
+
+def _window_mean(values, window):
+    """窗口未满或含 NaN 时为 NaN，与 rolling(window).mean() 的 min_periods 行为一致"""
+    if len(values) < window:
+        return math.nan
+    tail = values[-window:]
+    if any(v != v for v in tail):
+        return math.nan
+    return math.fsum(tail) / window
+
+def _window_extreme(values, window, fn):
+    if len(values) < window:
+        return math.nan
+    tail = values[-window:]
+    if any(v != v for v in tail):
+        return math.nan
+    return fn(tail)
+
+def new_state():
+    state = {k: [] for k in WINDOWS}
+    state.update({'last_date': None, 'rows': 0, 'kdj_weighted': math.nan, 'kdj_old_wt': 1.0,
+                  'kdj_nobs': 0, 'ma5': math.nan})
+    return state
+
+def _push(state, key, value):
+    buf = state[key]
+    buf.append(value)
+    if len(buf) > WINDOWS[key]:
+        del buf[0]
+
+def _ewm_step(state, cur):
+    """pandas ewma (adjust=True, ignore_na=False) 单步，逐位复现其 cython 实现"""
+    is_observation = cur == cur
+    state['kdj_nobs'] += int(is_observation)
+    if state['rows'] == 1:
+        state['kdj_weighted'] = cur
+        state['kdj_old_wt'] = 1.0
+    else:
+        weighted = state['kdj_weighted']
+        if weighted == weighted:
+            state['kdj_old_wt'] *= _OLD_WT_FACTOR
+            if is_observation:
+                old_wt = state['kdj_old_wt']
+                if weighted != cur:
+                    weighted = ((old_wt * weighted) + (_NEW_WT * cur)) / (old_wt + _NEW_WT)
+                state['kdj_old_wt'] = old_wt + _NEW_WT
+                state['kdj_weighted'] = weighted
+        elif is_observation:
+            state['kdj_weighted'] = cur
+    return state['kdj_weighted'] if state['kdj_nobs'] >= 1 else math.nan
+
+def update(state, bar):
+    """用一根新 K 线 (含 日期/收盘/最高/最低/成交量/换手率/涨跌幅) 更新状态，返回最新指标"""
+    close = float(bar['收盘'])
+    prev_close = state['closes'][-1] if state['closes'] else math.nan
+    state['rows'] += 1
+
+    # 1. RSI6 (首行 diff 为 NaN，与 where(delta > 0, 0) 一样记为 0)
+    delta = close - prev_close
+    _push(state, 'gains', delta if delta > 0 else 0.0)
+    _push(state, 'losses', -delta if delta < 0 else 0.0)
+    gain = _window_mean(state['gains'], 6)
+    loss = _window_mean(state['losses'], 6)
+    rs = _div(gain, loss if loss != 0 else math.nan)
+    rsi6 = 100 - _div(100, 1 + rs)
+
+    # 2. KDJ (9,3,3)
+    _push(state, 'highs', float(bar['最高']))
+    _push(state, 'lows', float(bar['最低']))
+    low_9 = _window_extreme(state['lows'], 9, min)
+    high_9 = _window_extreme(state['highs'], 9, max)
+    rsv = _div(close - low_9, high_9 - low_9) * 100
+    kdj_k = _ewm_step(state, rsv)
+
+    # 3. MA5 & MA60
+    _push(state, 'closes', close)
+    prev_ma5 = state['ma5']
+    ma5 = _window_mean(state['closes'], 5)
+    ma60 = _window_mean(state['closes'], 60)
+    state['ma5'] = ma5
+
+    # 4. 换手率均值与量比 (量均线不含当日)
+    _push(state, 'turnovers', float(bar['换手率']))
+    vol = float(bar['成交量'])
+    vol_ma5 = _window_mean(state['vols'], 5) if len(state['vols']) >= 5 else math.nan
+    _push(state, 'vols', vol)
+    vol_ratio = _div(vol, vol_ma5)
+
+    state['last_date'] = str(bar['日期'])
+    return {'日期': state['last_date'], 'rows': state['rows'], '收盘': close, '涨跌幅': float(bar['涨跌幅']),
+            'rsi6': rsi6, 'kdj_k': kdj_k, 'ma5': ma5, 'prev_ma5': prev_ma5, 'ma60': ma60,
+            'avg_turnover_30': _window_mean(state['turnovers'], 30), 'vol_ma5': vol_ma5, 'vol_ratio': vol_ratio}
+
+def init_state(df):
+    """从完整历史一次性建立状态：窗口直接取末尾，EWM 累加器按 pandas 递推重放一遍"""
+    df = df.reset_index(drop=True)
+    state = new_state()
+    if df.empty:
+        return state
+    close = df['收盘'].astype(float)
+    delta = close.diff()
+    rsv = ((close - df['最低'].rolling(9).min()) / (df['最高'].rolling(9).max() - df['最低'].rolling(9).min()) * 100).values
+
+    state['rows'] = 0
+    for cur in rsv.tolist():
+        state['rows'] += 1
+        _ewm_step(state, cur)
+
+    tail = lambda s, k: [float(v) for v in s.values[-WINDOWS[k]:]]
+    state['closes'] = tail(close, 'closes')
+    state['gains'] = tail(delta.where(delta > 0, 0), 'gains')
+    state['losses'] = tail(-delta.where(delta < 0, 0), 'losses')
+    state['highs'] = tail(df['最高'], 'highs')
+    state['lows'] = tail(df['最低'], 'lows')
+    state['turnovers'] = tail(df['换手率'], 'turnovers')
+    state['vols'] = tail(df['成交量'], 'vols')
+    state['ma5'] = _window_mean(state['closes'], 5)
+    state['last_date'] = str(df['日期'].iloc[-1])
+    return state
+
+def latest_from_state(state):
+    """不追加新 K 线，直接从状态给出最新一行指标 (用于当天没有新数据的股票)"""
+    closes = state['closes']
+    prev_closes = closes[:-1]
+    gain, loss = _window_mean(state['gains'], 6), _window_mean(state['losses'], 6)
+    rs = _div(gain, loss if loss != 0 else math.nan)
+    vols = state['vols']
+    vol_ma5 = _window_mean(vols[:-1], 5)
+    return {'日期': state['last_date'], 'rows': state['rows'], '收盘': closes[-1], '涨跌幅': state.get('last_pct', math.nan),
+            'rsi6': 100 - _div(100, 1 + rs), 'kdj_k': state['kdj_weighted'] if state['kdj_nobs'] else math.nan,
+            'ma5': state['ma5'], 'prev_ma5': _window_mean(prev_closes, 5), 'ma60': _window_mean(closes, 60),
+            'avg_turnover_30': _window_mean(state['turnovers'], 30), 'vol_ma5': vol_ma5,
+            'vol_ratio': _div(vols[-1], vol_ma5)}
+
+class IndicatorStateStore:
+    """全市场指标状态的持久化容器 (单个 JSON 文件)"""
+
+    def __init__(self, path=STATE_PATH, data_dir=STOCK_DATA_DIR):
+        self.path = path
+        self.data_dir = data_dir
+        self.states = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                payload = json.load(f)
+            if payload.get('version') == STATE_VERSION:
+                self.states = payload['symbols']
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': STATE_VERSION, 'symbols': self.states}, f)
+        os.replace(tmp_path, self.path)
+
+    def rebuild(self, code):
+        csv_path = os.path.join(self.data_dir, f"{code}.csv")
+        file_size = os.path.getsize(csv_path)
+        df = load_stock(csv_path)
+        state = init_state(df)
+        if not df.empty:
+            state['last_pct'] = float(df['涨跌幅'].iloc[-1])
+        state['file_size'] = file_size
+        self.states[code] = state
+        return state
+
+    def refresh(self, code):
+        """读取 CSV 末尾的新 K 线并增量更新，返回最新指标；无状态或缺口过大时全量重建"""
+        state = self.states.get(code)
+        if state is None or not state['last_date']:
+            state = self.rebuild(code)
+            return latest_from_state(state) if state['rows'] else None
+        csv_path = os.path.join(self.data_dir, f"{code}.csv")
+        file_size = os.path.getsize(csv_path)
+        if file_size == state.get('file_size'):
+            return latest_from_state(state)  # 文件未追加，不必解析
+        tail = read_csv_tail(csv_path, TAIL_ROWS)
+        tail['日期'] = tail['日期'].astype(str)
+        new_bars = tail[tail['日期'] > state['last_date']]
+        if len(new_bars) == len(tail) and len(tail) == TAIL_ROWS:
+            state = self.rebuild(code)  # 新增行超过读取窗口，可能有缺口
+            return latest_from_state(state)
+        latest = None
+        for bar in new_bars.to_dict('records'):
+            latest = update(state, bar)
+            state['last_pct'] = latest['涨跌幅']
+        state['file_size'] = file_size
+        return latest if latest is not None else latest_from_state(state)
+
+    def refresh_all(self, codes=None):
+        """增量更新全市场，返回 select_signals 需要的按股票排列的数组字典"""
+        codes = codes if codes is not None else list_symbols(self.data_dir)
+        rows = {}
+        for code in codes:
+            try:
+                latest = self.refresh(code)
+            except Exception as e:
+                print(f"增量更新失败 {code}: {e}")
+                continue
+            if latest is not None:
+                rows[code] = latest
+        keys = ['日期', 'rows', '收盘', '涨跌幅', 'rsi6', 'kdj_k', 'ma5', 'prev_ma5', 'ma60',
+                'avg_turnover_30', 'vol_ratio']
+        out = {'代码': list(rows)}
+        for k in keys:
+            values = [r[k] for r in rows.values()]
+            out[k] = values if k == '日期' else np.array(values, dtype=np.float64)
+        return out
+
+def validate(codes=None, replay_bars=5, data_dir=STOCK_DATA_DIR):
+    """校验模式：用前 n-replay_bars 行建状态，再逐根增量更新最后 replay_bars 行，
+    与 calculate_indicators 全量重算的最后一行比较。KDJ 要求逐位一致，其余允许 1e-8 相对误差。"""
+    from stock_scanner_go_mini import calculate_indicators
+
+    codes = codes if codes is not None else list_symbols(data_dir)
+    names = ['rsi6', 'kdj_k', 'ma5', 'ma60', 'avg_turnover_30', 'vol_ma5', 'vol_ratio']
+    failures = []
+    for code in codes:
+        df = load_stock(os.path.join(data_dir, f"{code}.csv"))
+        if len(df) <= replay_bars:
+            continue
+        state = init_state(df.iloc[:-replay_bars])
+        for bar in df.iloc[-replay_bars:].to_dict('records'):
+            latest = update(state, bar)
+        expected = calculate_indicators(df).iloc[-1]
+        for name in names:
+            a, b = latest[name], expected[name]
+            if name == 'kdj_k':
+                ok = (a == b) or (a != a and b != b)
+            else:
+                ok = (a != a and b != b) or math.isclose(a, b, rel_tol=VALIDATE_TOLERANCE, abs_tol=1e-12)
+            if not ok:
+                failures.append((code, name, a, b))
+    print(f"🔎 校验 {len(codes)} 只股票: {'增量结果与全量重算一致' if not failures else f'{len(failures)} 处不一致'}")
+    for code, name, a, b in failures[:20]:
+        print(f"  {code} {name}: 增量 {a} / 全量 {b}")
+    return failures
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="增量指标状态：构建 / 更新 / 校验")
+    parser.add_argument("command", choices=["build", "update", "validate"])
+    parser.add_argument("--limit", type=int, default=None, help="只处理前 N 只股票")
+    args = parser.parse_args(argv)
+    codes = list_symbols()[:args.limit] if args.limit else None
+
+    if args.command == "validate":
+        if validate(codes):
+            sys.exit(1)
+        return
+    store = IndicatorStateStore()
+    if args.command == "build":
+        for code in codes or list_symbols():
+            store.rebuild(code)
+    else:
+        store.refresh_all(codes)
+    store.save()
+    print(f"✅ 指标状态已保存: {len(store.states)} 只股票 -> {store.path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from stock_storage import STOCK_DATA_DIR, load_stock, list_symbols, read_csv_tail, dates_to_int
+from universe_history import UNIVERSE_DIR, load_universe
+from parallel_utils import run_parallel
+
+# ==========================================
+# 涨跌停价格表
+# 按板块 (主板 10% / 创业板与科创板 20% / 北交所 30%)、ST 状态 (主板 5%) 与交易所参考前收，
+# 逐日算出涨停价、跌停价 (四舍五入到分) 以及收盘涨停/跌停、盘中触及涨停标记。
+# 每只股票一个 stock_data/limits/<代码>.csv，每日只追加新交易日，各战法直接读取而不必自行推算。
+# 同一次更新顺带维护全市场涨跌停事件索引 limits/events.csv，“最近 N 日有涨停的股票”无需打开单只文件。
+# ==========================================
+
+LIMIT_DIR = os.path.join(STOCK_DATA_DIR, "limits")
+LIMIT_COLUMNS = ['日期', '前收', '涨停价', '跌停价', '涨停', '跌停', '触及涨停']
+GEM_REFORM_DATE = 20200824       # 创业板注册制改革，此后涨跌幅 20%，ST 也不再是 5%
+FREE_LISTING_DAYS = 5            # 科创板 / 注册制创业板新股上市前 5 个交易日不设涨跌幅
+PRICE_EPS = 1e-6                 # 两位小数价格比较的容差
+
+# 全市场涨跌停事件索引：每个涨停/跌停日一行，按日期追加；元数据记录各股行数与数据文件大小
+EVENTS_FILE = "events.csv"
+EVENTS_META_FILE = "events_meta.json"
+EVENTS_VERSION = 1
+EVENT_COLUMNS = ['日期', '代码', '类型', '行号', '成交量', '最低', '收盘']
+EVENT_SOURCE_COLUMNS = ['日期', '收盘', '最高', '最低', '成交量', '涨跌额']
+
+def board_of(code):
+    """按代码前缀判断板块：star 科创板 / gem 创业板 / bj 北交所 / main 主板"""
+    code = str(code).zfill(6)
+    if code.startswith(('688', '689')):
+        return 'star'
+    if code.startswith(('300', '301')):
+        return 'gem'
+    if code.startswith(('4', '8', '92')):
+        return 'bj'
+    return 'main'
+
+def limit_ratio(code, days, is_st):
+    """逐日涨跌幅限制比例 (days 为 YYYYMMDD 整数数组，is_st 为同长布尔数组)"""
+    board = board_of(code)
+    days = np.asarray(days)
+    is_st = np.asarray(is_st, dtype=bool)
+    if board == 'star':
+        return np.full(len(days), 0.20)
+    if board == 'bj':
+        return np.full(len(days), 0.30)
+    main_ratio = np.where(is_st, 0.05, 0.10)
+    if board == 'gem':
+        return np.where(days >= GEM_REFORM_DATE, 0.20, main_ratio)
+    return main_ratio
+
+def round_price(values):
+    """交易所规则的四舍五入到分 (避免二进制浮点把 x.xx5 舍掉)"""
+    return np.floor(np.asarray(values) * 100 + 0.5 + PRICE_EPS) / 100
+
+def st_flags(code, dates, current_st=False, history=None, root=UNIVERSE_DIR):
+    """逐日 ST 状态：有 st 股票池快照的日期按快照判定，更早的日期沿用当前名称是否带 ST
+
+    history 为调用方预先读取的 st 股票池 (批量更新时每个进程只读一次)，缺省时读取进程内缓存。
+    """
+    if history is None:
+        history = load_universe('st', root)
+    if history is None:
+        return np.full(len(dates), bool(current_st))
+    return history.eligible(str(code).zfill(6), dates, default=bool(current_st))
+
+def compute_limits(df, code, is_st=None, start=0):
+    """由日线 (需 日期/收盘/最高，最好含 涨跌额) 计算涨跌停表
+
+    前收优先用 收盘 - 涨跌额 (即交易所除权除息后的参考价)，缺失时退回上一行收盘。
+    上市首日以及科创板/注册制创业板上市前 5 日没有涨跌幅限制，价格与标记为空/False。
+    start > 0 时只计算第 start 行起的新行 (第 start-1 行提供前收)，返回表只含这些行；
+    is_st 与 df 等长，或与 df.iloc[start-1:] 等长。
+    """
+    listing_day = dates_to_int(df['日期'].values[:1])[0] if len(df) else 0
+    base = max(start - 1, 0)
+    if is_st is not None and len(is_st) == len(df):
+        is_st = np.asarray(is_st)[base:]
+    df = df.iloc[base:]
+    n = len(df)
+    close = df['收盘'].values.astype(float)
+    high = df['最高'].values.astype(float)
+    days = dates_to_int(df['日期'].values) if n else np.empty(0, dtype=np.int32)
+    if is_st is None:
+        is_st = np.zeros(n, dtype=bool)
+
+    prev_close = np.full(n, np.nan)
+    prev_close[1:] = close[:-1]
+    if '涨跌额' in df.columns:
+        ref = round_price(close - df['涨跌额'].values.astype(float))
+        prev_close = np.where(np.isnan(ref) | (ref <= 0), prev_close, ref)
+    prev_close[:1] = np.nan
+
+    board = board_of(code)
+    if board == 'star' or (board == 'gem' and listing_day >= GEM_REFORM_DATE):
+        prev_close[:max(FREE_LISTING_DAYS - base, 0)] = np.nan
+
+    ratio = limit_ratio(code, days, is_st)
+    up = round_price(prev_close * (1 + ratio))
+    down = round_price(prev_close * (1 - ratio))
+    with np.errstate(invalid='ignore'):
+        return pd.DataFrame({
+            '日期': df['日期'].values, '前收': prev_close, '涨停价': up, '跌停价': down,
+            '涨停': close >= up - PRICE_EPS, '跌停': close <= down + PRICE_EPS,
+            '触及涨停': high >= up - PRICE_EPS,
+        })[LIMIT_COLUMNS].iloc[start - base:].reset_index(drop=True)
+
+def limit_path(code, out_dir=LIMIT_DIR):
+    return os.path.join(out_dir, f"{str(code).zfill(6)}.csv")
+
+def update_symbol(code, current_st=False, data_dir=STOCK_DATA_DIR, out_dir=LIMIT_DIR, all_events=False,
+                  st_history=None):
+    """增量更新一只股票的涨跌停表，返回 {added, rebuilt, events, rows, size}
+
+    表的最后日期仍在日线中时只计算并追加其后的新行；日线被重写 (找不到该日期) 时整表重算。
+    events 为本次新增行中的涨停/跌停事件 (all_events=True 时为整张表的事件，用于重建索引)。
+    """
+    csv_path = os.path.join(data_dir, f"{code}.csv")
+    size = os.path.getsize(csv_path)
+    df = load_stock(csv_path, columns=EVENT_SOURCE_COLUMNS)
+    result = {'added': 0, 'rebuilt': False, 'events': None, 'rows': len(df), 'size': size}
+    if df.empty:
+        return result
+    path = limit_path(code, out_dir)
+    start = 0
+    if os.path.exists(path):
+        tail = read_csv_tail(path, 1)
+        if len(tail):
+            last = str(tail['日期'].iloc[-1])
+            pos = np.searchsorted(df['日期'].values, last, side='right')
+            if pos > 0 and df['日期'].iloc[pos - 1] == last:
+                start = pos
+    if start >= len(df) and not all_events:
+        return result
+
+    # 只为需要的行计算：增量时从 start 起，重建索引时整表
+    first = 0 if all_events else start
+    dates = df['日期'].values[max(first - 1, 0):]
+    table = compute_limits(df, code, st_flags(code, dates, current_st, st_history), first)
+    os.makedirs(out_dir, exist_ok=True)
+    if start == 0:
+        table.to_csv(path, index=False, encoding='utf-8')
+    elif start < len(df):
+        table.iloc[start - first:].to_csv(path, mode='a', header=False, index=False, encoding='utf-8')
+    result.update(added=len(df) - start, rebuilt=start == 0, events=_extract_events(code, df, table, first))
+    return result
+
+def _extract_events(code, df, table, first):
+    """涨跌停表 (对应日线第 first 行起) 中的涨停/跌停行 -> 事件索引行"""
+    hit = np.flatnonzero(table['涨停'].values | table['跌停'].values)
+    rows = hit + first
+    return pd.DataFrame({
+        '日期': df['日期'].values[rows], '代码': code,
+        '类型': np.where(table['涨停'].values[hit], '涨停', '跌停'), '行号': rows,
+        '成交量': df['成交量'].values[rows], '最低': df['最低'].values[rows], '收盘': df['收盘'].values[rows],
+    })[EVENT_COLUMNS]
+
+def _update_task(code, name_map, data_dir, out_dir, all_events, st_history):
+    try:
+        current_st = "ST" in name_map.get(code, "").upper()
+        return code, update_symbol(code, current_st, data_dir, out_dir, all_events, st_history), None
+    except Exception as e:
+        return code, None, e
+
+def events_path(out_dir=LIMIT_DIR):
+    return os.path.join(out_dir, EVENTS_FILE)
+
+def load_events_meta(out_dir=LIMIT_DIR):
+    path = os.path.join(out_dir, EVENTS_META_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    return meta if meta.get('version') == EVENTS_VERSION else None
+
+def _save_events_meta(symbols, out_dir):
+    path = os.path.join(out_dir, EVENTS_META_FILE)
+    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump({'version': EVENTS_VERSION, 'symbols': symbols}, f)
+    os.replace(path + ".tmp", path)
+
+def load_events(out_dir=LIMIT_DIR):
+    """读取全市场涨跌停事件索引，不存在时返回 None"""
+    path = events_path(out_dir)
+    if not os.path.exists(path):
+        return None
+    return pd.read_csv(path, dtype={'日期': str, '代码': str})
+
+def update_all(name_map=None, data_dir=STOCK_DATA_DIR, out_dir=LIMIT_DIR, processes=None):
+    """全市场增量更新涨跌停表与事件索引，返回 {代码: 新增行数}
+
+    事件索引按日期追加；有股票整表重算或索引尚不存在时整体重写索引。
+    """
+    name_map = name_map or {}
+    t0 = time.perf_counter()
+    meta = load_events_meta(out_dir)
+    all_events = meta is None or not os.path.exists(events_path(out_dir))
+    results = run_parallel(_update_task, list_symbols(data_dir), shared=(name_map, data_dir, out_dir, all_events, load_universe('st')),
+                           processes=processes, verbose=False)
+    errors = [(c, e) for c, _, e in results if e is not None]
+    done = {c: r for c, r, e in results if e is None}
+
+    symbols = {} if all_events else meta['symbols']
+    for code, r in done.items():
+        symbols[code] = {'rows': r['rows'], 'size': r['size']}
+    new_events = [r['events'] for r in done.values() if r['events'] is not None and len(r['events'])]
+    new_events = pd.concat(new_events, ignore_index=True) if new_events else pd.DataFrame(columns=EVENT_COLUMNS)
+    rebuilt = {c for c, r in done.items() if r['rebuilt']}
+
+    os.makedirs(out_dir, exist_ok=True)
+    if all_events or rebuilt:
+        old = None if all_events else load_events(out_dir)
+        if old is not None:
+            new_events = pd.concat([old[~old['代码'].isin(rebuilt)], new_events], ignore_index=True)
+        new_events.sort_values(['日期', '代码'], kind='stable').to_csv(events_path(out_dir), index=False, encoding='utf-8')
+    elif len(new_events):
+        new_events.sort_values(['日期', '代码'], kind='stable').to_csv(
+            events_path(out_dir), mode='a', header=False, index=False, encoding='utf-8')
+    _save_events_meta(symbols, out_dir)
+
+    added = {c: r['added'] for c, r in done.items()}
+    mode = "重建" if all_events or rebuilt else "追加"
+    print(f"✅ 涨跌停表更新完成: {len(added)} 只股票，新增 {sum(added.values())} 行；"
+          f"事件索引{mode} {len(new_events)} 条，失败 {len(errors)}，耗时 {time.perf_counter() - t0:.1f}s")
+    for code, e in errors[:10]:
+        print(f"  ❌ {code}: {e}")
+    return added
+
+def recent_limit_symbols(window, kind='涨停', data_dir=STOCK_DATA_DIR, out_dir=LIMIT_DIR):
+    """最近 window 个交易日 (按各股自己的行数计，不含最新一行) 内出现过 kind 事件的股票代码集合
+
+    只读事件索引与各数据文件的大小 (os.stat)，不打开任何单只股票文件。
+    数据文件在索引之后有变化或尚未入索引的股票一并返回，由调用方自行判定。
+    索引不存在时返回 None。
+    """
+    meta = load_events_meta(out_dir)
+    events = load_events(out_dir)
+    if meta is None or events is None:
+        return None
+    symbols = meta['symbols']
+    stale = set()
+    for code in list_symbols(data_dir):
+        info = symbols.get(code)
+        if info is None or os.path.getsize(os.path.join(data_dir, f"{code}.csv")) != info['size']:
+            stale.add(code)
+    events = events[events['类型'] == kind]
+    rows_now = events['代码'].map(lambda c: symbols.get(c, {}).get('rows', 0)).values
+    age = rows_now - 1 - events['行号'].values
+    recent = set(events['代码'].values[(age >= 1) & (age < window)])
+    return recent | stale
+
+def load_limits(code, out_dir=LIMIT_DIR):
+    """读取一只股票的涨跌停表，不存在时返回 None"""
+    path = limit_path(code, out_dir)
+    if not os.path.exists(path):
+        return None
+    return pd.read_csv(path, dtype={'日期': str})
+
+def limit_up_flags(df, code, current_st=False, out_dir=LIMIT_DIR):
+    """与 df 按日期对齐的收盘涨停标记；表缺失或未覆盖的日期现场计算"""
+    table = load_limits(code, out_dir)
+    if table is not None:
+        flags = df[['日期']].astype(str).merge(table[['日期', '涨停']], on='日期', how='left')['涨停']
+        if flags.notna().all():
+            return flags.values.astype(bool)
+    if '最高' not in df.columns:
+        return np.zeros(len(df), dtype=bool)
+    return compute_limits(df, code, st_flags(code, df['日期'].values, current_st))['涨停'].values
+
+def load_name_map(path="stock_names.csv"):
+    if not os.path.exists(path):
+        return {}
+    names_df = pd.read_csv(path, dtype={'code': str})
+    return dict(zip(names_df['code'].str.zfill(6), names_df['name']))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="按板块/ST/参考前收计算的涨跌停价格表")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_update = sub.add_parser("update", help="全市场增量更新 (首次运行即全量构建)")
+    p_update.add_argument("--processes", type=int, default=None)
+    p_recent = sub.add_parser("recent", help="列出最近 N 个交易日内有涨停的股票 (只读事件索引)")
+    p_recent.add_argument("--window", type=int, default=15)
+    p_recent.add_argument("--kind", choices=['涨停', '跌停'], default='涨停')
+    p_show = sub.add_parser("show", help="打印一只股票最近的涨跌停记录")
+    p_show.add_argument("code")
+    p_show.add_argument("--rows", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    if args.command == "update":
+        update_all(load_name_map(), processes=args.processes)
+        return
+    if args.command == "recent":
+        codes = recent_limit_symbols(args.window, args.kind)
+        if codes is None:
+            print("❌ 尚未建立事件索引，请先执行 update。")
+            sys.exit(1)
+        print(f"最近 {args.window} 个交易日内有{args.kind}的股票 {len(codes)} 只: {', '.join(sorted(codes))}")
+        return
+    table = load_limits(args.code.zfill(6))
+    if table is None:
+        print("❌ 该股票还没有涨跌停表，请先执行 update。")
+        sys.exit(1)
+    print(table.tail(args.rows).to_string(index=False))
+
+if __name__ == "__main__":
+    main()
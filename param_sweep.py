@@ -0,0 +1,355 @@
+import os
+import sys
+import time
+import shutil
+import hashlib
+import argparse
+import itertools
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from parallel_utils import DEFAULT_CHUNKSIZE, run_parallel
+
+# ==========================================
+# 战法参数扫描引擎
+# 指标与远期收益只算一次；每个 (参数, 取值) 的过滤条件是一张布尔掩码，
+# 只保留与参数无关的恒定条件为真的格子 (日期 × 股票)，并 packbits 压缩。
+# 一个参数组合的命中集合就是各参数掩码按位与，成千上万个组合只需位运算和少量聚合，按进程并行。
+# 掩码按数据指纹缓存到磁盘，同一份数据再次扫描只计算新出现的取值。
+# 支持网格 / 随机 / 逐次减半 (successive halving) 搜索，按命中数、胜率与远期收益排名。
+# ==========================================
+
+SWEEP_CACHE_DIR = ".sweep_cache"
+SWEEP_RESULTS_DIR = os.path.join("results", "sweep")
+SWEEP_CACHE_KEEP = 3           # 每个战法保留最近几份数据指纹的掩码缓存
+DEFAULT_HORIZON = 20           # 排名所用的持有周期 (交易日)
+MIN_SAMPLES = 30               # 样本数不足的组合不参与排名
+RANDOM_SAMPLES = 200           # 随机搜索 / 逐次减半的候选组合数
+HALVING_ETA = 3                # 逐次减半每轮保留 1/eta，同时股票样本扩大 eta 倍
+HALVING_MIN_FRACTION = 1 / 9   # 逐次减半第一轮使用的股票比例
+SEED = 20240101
+
+def st_mask(market, name_map):
+    """行 × 股票：当日是否为 ST (按 st 股票池快照逐日判定，早于快照的日期沿用当前名称)"""
+    from universe_history import load_universe
+
+    current = np.array(["ST" in name_map.get(c, "").upper() for c in market.symbols], dtype=bool)
+    st_universe = load_universe('st')
+    if st_universe is None:
+        return np.broadcast_to(current[None, :], market.valid.shape)
+    codes = np.array(market.symbols, dtype=object)[None, :]
+    return st_universe.eligible(codes, market.dates, default=current[None, :])
+
+class ScanTarget:
+    """温和进取版扫描 (stock_scanner_go_mini) 的过滤链，条件与 signal_mask 逐项相同"""
+    name = 'scan'
+    space = {
+        'RSI6_MAX': [25, 30, 35, 40, 45],
+        'KDJ_K_MAX': [30, 35, 40, 45, 50],
+        'MIN_VOLUME_RATIO': [0.1, 0.2, 0.3, 0.4],
+        'MAX_VOLUME_RATIO': [0.8, 1.0, 1.15, 1.3, 1.5],
+        'MIN_PROFIT_POTENTIAL': [5, 10, 15, 20],
+        'MAX_TODAY_CHANGE': [3.0, 5.0, 7.0],
+    }
+
+    @staticmethod
+    def load(lookback=None):
+        """返回 (market, 构造参数)：指标带预热前缀一次算好，随 market 一起交给构造函数"""
+        from stock_scanner_go_mini import load_replay
+
+        market, inputs = load_replay(lookback)
+        return market, {'inputs': inputs}
+
+    def __init__(self, market, name_map, inputs=None):
+        import stock_scanner_go_mini as scanner
+
+        self.scanner = scanner
+        self.params = scanner.scan_params()
+        self.horizons = list(scanner.REPLAY_HORIZONS)
+        self.inputs = inputs if inputs is not None else scanner.replay_inputs(market)
+        self.potential = scanner.potential_of(self.inputs)
+        self.base = market.valid & scanner.base_condition(self.inputs) & ~st_mask(market, name_map)
+        self.returns = scanner.forward_returns(self.inputs['收盘'], self.horizons)
+
+    def condition(self, name, value):
+        return self.scanner.param_condition(self.inputs, self.potential, name, value)
+
+class ReversalTarget:
+    """极度缩量反包 (volume_reversal_strategy)：扫描放量 / 缩量倍数
+
+    恒定条件为反包确认、历史满 20 行、当日在时点股票池内、非 ST、非创业板且当日价格在 5~20 元。
+    """
+    name = 'reversal'
+    space = {
+        'SPIKE_VOL_MULT': [1.2, 1.5, 1.8, 2.0, 2.5, 3.0],
+        'SHRINK_VOL_MULT': [0.5, 0.6, 0.75, 0.9, 1.0],
+    }
+
+    @staticmethod
+    def load(lookback=None):
+        from indicator_engine import load_market
+        return load_market(lookback=lookback, fields=['开盘', '收盘', '最高', '成交量']), {}
+
+    def __init__(self, market, name_map):
+        import volume_reversal_strategy as reversal
+        from stock_scanner_go_mini import forward_returns
+        from universe_history import load_universe
+
+        self.reversal = reversal
+        self.params = {'SPIKE_VOL_MULT': reversal.SPIKE_VOL_MULT, 'SHRINK_VOL_MULT': reversal.SHRINK_VOL_MULT}
+        self.horizons = list(reversal.HOLD_DAYS)
+        f = market.fields
+        close = f['收盘']
+        self.vol = f['成交量']
+        self.ma20_vol = pd.DataFrame(self.vol).rolling(20).mean().values
+        rows = np.cumsum(market.valid, axis=0)
+        codes = np.array(market.symbols, dtype=object)
+        not_gem = np.array([not c.startswith("30") for c in market.symbols], dtype=bool)
+        universe = load_universe()
+        eligible = universe.eligible(codes[None, :], market.dates) if universe is not None else True
+        with np.errstate(invalid='ignore'):
+            in_band = (close >= 5.0) & (close <= 20.0)
+        self.base = market.valid & (rows > 20) & reversal.reversal_mask(close, f['开盘'], f['最高']) \
+            & in_band & not_gem[None, :] & eligible & ~st_mask(market, name_map)
+        self.returns = forward_returns(close, self.horizons)
+
+    def condition(self, name, value):
+        if name == 'SPIKE_VOL_MULT':
+            return self.reversal.active_mask(self.vol, self.ma20_vol, value)
+        if name == 'SHRINK_VOL_MULT':
+            return self.reversal.shrink_mask(self.vol, self.ma20_vol, value)
+        raise KeyError(f"未知参数: {name}")
+
+TARGETS = {'scan': ScanTarget, 'reversal': ReversalTarget}
+
+class MaskSet:
+    """压缩后的扫描输入：恒定条件 (含未参与扫描的参数) 为真的格子按打乱后的股票顺序排列，
+    任意前缀都是一个随机股票子集 (逐次减半的低预算轮次只看前缀)"""
+
+    def __init__(self, target, market, space, start=None, end=None, seed=SEED):
+        base = target.base.copy()
+        fixed = {name: value for name, value in target.params.items() if name not in space}
+        for name, value in fixed.items():
+            base &= target.condition(name, value)
+        if start:
+            base &= market.dates >= int(str(start).replace("-", ""))
+        if end:
+            base &= market.dates <= int(str(end).replace("-", ""))
+        n_symbols = base.shape[1]
+        rank = np.argsort(np.random.default_rng(seed).permutation(n_symbols))
+        rows, cols = np.nonzero(base)
+        order = np.lexsort((rows, rank[cols]))
+        self.rows, self.cols = rows[order], cols[order]
+        self.cell_rank = rank[self.cols]
+        self.n_symbols = n_symbols
+        self.target = target
+        self.returns = target.returns[:, self.rows, self.cols]
+        self.masks = {}
+
+        digest = hashlib.sha1()
+        digest.update(target.name.encode())
+        digest.update(f"{seed}|{start}|{end}|{sorted(fixed.items())}|".encode())
+        digest.update("|".join(market.symbols).encode())
+        digest.update(np.ascontiguousarray(market.dates).tobytes())
+        digest.update(np.packbits(base).tobytes())
+        digest.update(np.ascontiguousarray(target.returns).tobytes())
+        self.fingerprint = digest.hexdigest()[:16]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def cells_for_fraction(self, fraction):
+        """前 fraction 比例的股票对应的格子数"""
+        k = int(np.ceil(self.n_symbols * min(fraction, 1.0)))
+        return int(np.searchsorted(self.cell_rank, k, side='left'))
+
+    def build(self, space, cache_dir=SWEEP_CACHE_DIR):
+        """计算 (或从磁盘缓存读取) 搜索空间中每个取值的掩码，返回 (新算, 命中缓存) 个数"""
+        folder = os.path.join(cache_dir, self.target.name, self.fingerprint) if cache_dir else None
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+            os.utime(folder)
+            _prune_cache(os.path.dirname(folder))
+        computed, cached = 0, 0
+        for name, values in space.items():
+            bucket = self.masks.setdefault(name, {})
+            for value in values:
+                value = float(value)
+                if value in bucket:
+                    continue
+                path = os.path.join(folder, f"{name}={value!r}.npy") if folder else None
+                if path and os.path.exists(path):
+                    bucket[value] = np.load(path)
+                    cached += 1
+                    continue
+                packed = np.packbits(self.target.condition(name, value)[self.rows, self.cols])
+                if path:
+                    np.save(path + ".tmp.npy", packed)
+                    os.replace(path + ".tmp.npy", path)
+                bucket[value] = packed
+                computed += 1
+        return computed, cached
+
+def _prune_cache(target_dir, keep=SWEEP_CACHE_KEEP):
+    folders = [os.path.join(target_dir, d) for d in os.listdir(target_dir)]
+    folders = sorted((d for d in folders if os.path.isdir(d)), key=os.path.getmtime, reverse=True)
+    for old in folders[keep:]:
+        shutil.rmtree(old, ignore_errors=True)
+
+def evaluate_combo(item, masks, returns, horizons):
+    """一个参数组合在前 limit 个格子上的表现：{命中数, 各周期样本数/胜率/均益}"""
+    combo, limit = item
+    nbytes = (limit + 7) // 8
+    hit = None
+    for name, value in combo:
+        packed = masks[name][value][:nbytes]
+        hit = packed.copy() if hit is None else np.bitwise_and(hit, packed, out=hit)
+    if hit is None:
+        idx = np.arange(limit)
+    else:
+        idx = np.flatnonzero(np.unpackbits(hit, count=limit))
+    stats = {'命中数': len(idx)}
+    picked = returns[:, idx]
+    for k, h in enumerate(horizons):
+        rets = picked[k][~np.isnan(picked[k])]
+        stats[f"{h}日样本"] = rets.size
+        stats[f"{h}日胜率"] = (rets > 0).mean() if rets.size else np.nan
+        stats[f"{h}日均益"] = rets.mean() if rets.size else np.nan
+    return stats
+
+def grid_combos(space):
+    names = list(space)
+    return [tuple(zip(names, (float(v) for v in values))) for values in itertools.product(*space.values())]
+
+def random_combos(space, n, seed=SEED):
+    """从网格中无放回抽取 n 个组合 (网格不大于 n 时返回整个网格)"""
+    sizes = [len(v) for v in space.values()]
+    total = int(np.prod(sizes)) if sizes else 1
+    if total <= n:
+        return grid_combos(space)
+    picks = np.random.default_rng(seed).choice(total, size=n, replace=False)
+    names, values = list(space), list(space.values())
+    combos = []
+    for flat in sorted(picks.tolist()):
+        combo = []
+        for name, vals, size in zip(reversed(names), reversed(values), reversed(sizes)):
+            flat, k = divmod(flat, size)
+            combo.append((name, float(vals[k])))
+        combos.append(tuple(reversed(combo)))
+    return combos
+
+def rank_results(results, horizon, metric='ret', min_samples=MIN_SAMPLES):
+    """按 horizon 日均益 (ret) 或胜率 (win) 排名，样本数不足的排在最后"""
+    df = pd.DataFrame(results)
+    if df.empty:
+        return df
+    ret, win = f"{horizon}日均益", f"{horizon}日胜率"
+    primary, secondary = (ret, win) if metric == 'ret' else (win, ret)
+    df['_ok'] = df[f"{horizon}日样本"] >= min_samples
+    df = df.sort_values(['_ok', primary, secondary], ascending=False, na_position='last', kind='stable')
+    return df.drop(columns='_ok').reset_index(drop=True)
+
+def run_rung(maskset, combos, limit, processes, chunksize):
+    items = [(combo, limit) for combo in combos]
+    stats = run_parallel(evaluate_combo, items, shared=(maskset.masks, maskset.returns, maskset.target.horizons),
+                         processes=processes, chunksize=chunksize, verbose=False)
+    return [dict(combo, **s) for combo, s in zip(combos, stats)]
+
+def sweep(maskset, space, search='grid', samples=RANDOM_SAMPLES, horizon=DEFAULT_HORIZON, metric='ret',
+          min_samples=MIN_SAMPLES, eta=HALVING_ETA, processes=None, chunksize=DEFAULT_CHUNKSIZE, seed=SEED):
+    """执行搜索，返回排名后的 DataFrame (逐次减半只返回最后一轮的全量评估)"""
+    combos = grid_combos(space) if search == 'grid' else random_combos(space, samples, seed)
+    if search != 'halving':
+        return rank_results(run_rung(maskset, combos, len(maskset), processes, chunksize), horizon, metric, min_samples)
+
+    fraction = HALVING_MIN_FRACTION
+    while True:
+        limit = maskset.cells_for_fraction(fraction)
+        ranked = rank_results(run_rung(maskset, combos, limit, processes, chunksize), horizon, metric,
+                              max(1, int(min_samples * min(fraction, 1.0))))
+        print(f"   ✂️ 股票比例 {min(fraction, 1.0):.0%}: 评估 {len(combos)} 个组合 ({limit} 个格子)")
+        if fraction >= 1.0 or len(combos) <= 1:
+            return ranked
+        keep = max(1, int(np.ceil(len(combos) / eta)))
+        combos = [tuple((name, float(row[name])) for name in space) for _, row in ranked.head(keep).iterrows()]
+        fraction *= eta
+
+def parse_space(target, overrides):
+    """默认搜索空间，--param NAME=v1,v2,... 可替换或新增某个参数的取值"""
+    space = {k: list(v) for k, v in target.space.items()}
+    for item in overrides or []:
+        name, _, values = item.partition("=")
+        if name not in target.params:
+            raise SystemExit(f"❌ {target.name} 没有参数 {name}，可选: {', '.join(target.params)}")
+        space[name] = [float(x) for x in values.split(",") if x.strip()]
+    return space
+
+def load_name_map(path="stock_names.csv"):
+    if not os.path.exists(path):
+        return {}
+    names_df = pd.read_csv(path, dtype={'code': str})
+    return dict(zip(names_df['code'].str.zfill(6), names_df['name']))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="战法参数扫描 (网格 / 随机 / 逐次减半)")
+    parser.add_argument("target", choices=list(TARGETS))
+    parser.add_argument("--search", choices=["grid", "random", "halving"], default="grid")
+    parser.add_argument("--param", action="append", metavar="NAME=v1,v2,...", help="替换某个参数的候选取值，可重复")
+    parser.add_argument("--samples", type=int, default=RANDOM_SAMPLES, help="随机搜索 / 逐次减半的候选组合数")
+    parser.add_argument("--eta", type=int, default=HALVING_ETA)
+    parser.add_argument("--horizon", type=int, default=DEFAULT_HORIZON, help="排名所用的持有周期")
+    parser.add_argument("--metric", choices=["ret", "win"], default="ret", help="ret: 按均益排名; win: 按胜率排名")
+    parser.add_argument("--min-samples", type=int, default=MIN_SAMPLES)
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--start", default=None, help="只统计该日期 (YYYY-MM-DD) 之后的信号")
+    parser.add_argument("--end", default=None, help="只统计该日期之前的信号")
+    parser.add_argument("--lookback", type=int, default=None, help="只取最近 N 行历史，默认全部")
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE)
+    parser.add_argument("--no-cache", action="store_true", help="不读写磁盘掩码缓存")
+    args = parser.parse_args(argv)
+
+    target_cls = TARGETS[args.target]
+    t0 = time.perf_counter()
+    market, extra = target_cls.load(args.lookback)
+    if not market.symbols:
+        print("❌ 没有可扫描的数据。")
+        sys.exit(1)
+    target = target_cls(market, load_name_map(), **extra)
+    if args.horizon not in target.horizons:
+        sys.exit(f"❌ {args.target} 的持有周期只有 {target.horizons}")
+    space = parse_space(target, args.param)
+    t1 = time.perf_counter()
+
+    maskset = MaskSet(target, market, space, args.start, args.end)
+    computed, cached = maskset.build(space, None if args.no_cache else SWEEP_CACHE_DIR)
+    # 当前参数也补上掩码，作为排名的参照
+    current = tuple((name, float(target.params[name])) for name in space)
+    maskset.build({name: [value] for name, value in current}, None if args.no_cache else SWEEP_CACHE_DIR)
+    t2 = time.perf_counter()
+    print(f"📐 {args.target}: {len(market.symbols)} 只股票 × {market.valid.shape[0]} 行，候选格子 {len(maskset)}；"
+          f"特征 {t1 - t0:.1f}s，掩码 {t2 - t1:.1f}s (新算 {computed}，缓存 {cached})")
+
+    ranked = sweep(maskset, space, args.search, args.samples, args.horizon, args.metric, args.min_samples,
+                   args.eta, args.processes, args.chunksize)
+    t3 = time.perf_counter()
+    print(f"🔍 {args.search} 搜索完成: 评估 {len(ranked)} 个组合，耗时 {t3 - t2:.1f}s")
+
+    baseline = dict(current, **evaluate_combo((current, len(maskset)), maskset.masks, maskset.returns, target.horizons))
+    show = list(space) + ['命中数', f"{args.horizon}日样本", f"{args.horizon}日胜率", f"{args.horizon}日均益"]
+    print(f"\n当前参数: " + "  ".join(f"{k}={baseline[k]:g}" for k in space)
+          + f"  命中 {baseline['命中数']}  {args.horizon}日胜率 {baseline[f'{args.horizon}日胜率'] * 100:.1f}%"
+          f"  均益 {baseline[f'{args.horizon}日均益'] * 100:.2f}%")
+    if ranked.empty:
+        return ranked
+    print(f"\n🏆 前 {min(args.top, len(ranked))} 名 (按 {args.horizon} 日{'均益' if args.metric == 'ret' else '胜率'}):")
+    print(ranked[show].head(args.top).to_string(index=False))
+
+    os.makedirs(SWEEP_RESULTS_DIR, exist_ok=True)
+    path = os.path.join(SWEEP_RESULTS_DIR, f"{args.target}_{args.search}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
+    ranked.to_csv(path, index=False, encoding='utf_8_sig')
+    print(f"\n✅ 完整排名已保存至 {path}")
+    return ranked
+
+if __name__ == "__main__":
+    main()
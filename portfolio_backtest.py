@@ -0,0 +1,373 @@
+import os
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from stock_storage import dates_to_int, int_to_dates
+
+# ==========================================
+# 组合级事件驱动回测
+# 输入任一战法的逐日信号集 (日期, 代码[, 优先级])，按 A 股规则模拟一个资金账户：
+#   信号日收盘后出信号，次一交易日开盘买入；次日停牌或开盘即涨停 (买不进) 则放弃；
+#   整手 (100 股) 买入，佣金 (最低 5 元) + 过户费，卖出另收印花税 (2023-08-28 起减半)；
+#   T+1：持有满 N 个交易日后收盘卖出，遇停牌或收盘跌停 (卖不出) 顺延；
+#   同时最多 MAX_POSITIONS 只，每只按上一日总资产等权分配，现金不足或不够一手则跳过。
+# 所有与资金无关的判定 (买入日、能否买入、卖出日、成交价、涨跌停价) 先在 日期 × 股票 面板上整体向量化算好，
+# 逐日循环只做资金分配与记账，5 年全市场的模拟在秒级完成。
+# 输出净值曲线、换手率与逐笔成交。
+# ==========================================
+
+INITIAL_CAPITAL = 1_000_000.0
+MAX_POSITIONS = 10
+HOLD_DAYS = 5                    # 持有交易日数 (>= 1，满足 T+1)
+LOT_SIZE = 100
+COMMISSION_RATE = 0.00025        # 佣金，双向
+MIN_COMMISSION = 5.0
+TRANSFER_FEE_RATE = 0.00001      # 过户费，双向
+STAMP_DUTY_RATE = 0.0005         # 印花税，仅卖出
+STAMP_DUTY_OLD_RATE = 0.001
+STAMP_DUTY_CUT_DATE = 20230828
+SLIPPAGE = 0.0                   # 买入价上浮 / 卖出价下浮比例
+TRADING_DAYS_PER_YEAR = 244
+PRICE_EPS = 1e-6
+PORTFOLIO_DIR = os.path.join("results", "portfolio")
+LOAD_FIELDS = ['开盘', '收盘', '最高', '最低', '成交量', '换手率', '涨跌幅', '涨跌额']
+STRATEGIES = ('scan', 'reversal', 'zhangting')
+
+class CalendarPanel:
+    """交易日历对齐的 (日期 × 股票) 面板：fields[字段] 无数据 (停牌/未上市) 处为 NaN"""
+
+    def __init__(self, market):
+        valid = market.valid
+        self.symbols = list(market.symbols)
+        self.dates = np.unique(market.dates[valid])
+        self._rows = np.searchsorted(self.dates, market.dates[valid])
+        self._cols = np.nonzero(valid)[1]
+        self._valid = valid
+        self.fields = {f: self.scatter(v) for f, v in market.fields.items()}
+        self.has = ~np.isnan(self.fields['收盘'])
+
+    def scatter(self, values):
+        """底部对齐的 (行 × 股票) 数组 -> 日历面板"""
+        out = np.full((len(self.dates), len(self.symbols)), np.nan)
+        out[self._rows, self._cols] = np.asarray(values)[self._valid]
+        return out
+
+def limit_prices(market, name_map):
+    """逐股用 limit_table 的规则算出 (行 × 股票) 涨停价、跌停价 (底部对齐)"""
+    from limit_table import compute_limits
+    from universe_history import load_universe
+
+    up = np.full(market.valid.shape, np.nan)
+    down = np.full(market.valid.shape, np.nan)
+    st_universe = load_universe('st')
+    f = market.fields
+    for j, code in enumerate(market.symbols):
+        n = int(market.valid[:, j].sum())
+        if not n:
+            continue
+        days = market.dates[-n:, j]
+        current_st = "ST" in name_map.get(code, "").upper()
+        is_st = st_universe.eligible(code, days, default=current_st) if st_universe is not None \
+            else np.full(n, current_st)
+        df = pd.DataFrame({'日期': int_to_dates(days), '收盘': f['收盘'][-n:, j], '最高': f['最高'][-n:, j],
+                           '涨跌额': f['涨跌额'][-n:, j]})
+        table = compute_limits(df, code, is_st)
+        up[-n:, j] = table['涨停价'].values
+        down[-n:, j] = table['跌停价'].values
+    return up, down
+
+def strategy_signals(name, market, name_map):
+    """三个战法在全历史上的逐日信号：DataFrame(日期, 代码, 优先级)，优先级小的先买"""
+    if name == 'scan':
+        from stock_scanner_go_mini import replay_signals
+
+        signals = replay_signals(market, name_map, horizons=[])
+        # 与扫描结果的排序一致：量比低、RSI6 低的优先
+        signals = signals.sort_values(['日期', '量比', 'RSI6'], kind='stable')
+        signals['优先级'] = signals.groupby('日期').cumcount()
+        return signals[['日期', '代码', '优先级']]
+    if name == 'reversal':
+        from param_sweep import ReversalTarget
+
+        target = ReversalTarget(market, name_map)
+        hits = target.base.copy()
+        for param, value in target.params.items():
+            hits &= target.condition(param, value)
+        rows, cols = np.nonzero(hits)
+        return pd.DataFrame({'日期': int_to_dates(market.dates[rows, cols]),
+                             '代码': np.array(market.symbols, dtype=object)[cols], '优先级': 0})
+    if name == 'zhangting':
+        from limit_table import limit_up_flags
+        from zhangting_huimaqiang import MIN_PRICE, MAX_PRICE, zhangting_signals
+
+        f = market.fields
+        parts = []
+        for j, code in enumerate(market.symbols):
+            n = int(market.valid[:, j].sum())
+            if n < 30 or code.startswith(('30', '688')):
+                continue
+            close, low, vol = f['收盘'][-n:, j], f['最低'][-n:, j], f['成交量'][-n:, j]
+            df = pd.DataFrame({'日期': int_to_dates(market.dates[-n:, j]), '收盘': close, '最高': f['最高'][-n:, j],
+                               '涨跌额': f['涨跌额'][-n:, j]})
+            is_zt = limit_up_flags(df, code, "ST" in name_map.get(code, "").upper())
+            signal, last_zt = zhangting_signals(close, low, vol, is_zt)
+            idx = np.flatnonzero(signal & (close >= MIN_PRICE) & (close <= MAX_PRICE))
+            if len(idx):
+                # 缩量越明显越优先
+                parts.append(pd.DataFrame({'日期': df['日期'].values[idx], '代码': code,
+                                           '优先级': vol[idx] / vol[last_zt[idx]]}))
+        if not parts:
+            return pd.DataFrame(columns=['日期', '代码', '优先级'])
+        return pd.concat(parts, ignore_index=True)
+    raise KeyError(f"未知战法: {name}")
+
+def plan_trades(panel, up, down, signals, hold_days=HOLD_DAYS):
+    """与资金无关的成交计划 (全部向量化)：每个信号的买入日/买入价/卖出日/卖出价与放弃原因
+
+    返回 DataFrame，列: 信号日序, 列号, 优先级, 买入日序, 买入价, 卖出日序 (-1 表示到回测结束仍未卖出), 卖出价, 放弃原因
+    """
+    n_dates, n_symbols = panel.has.shape
+    col_of = {c: j for j, c in enumerate(panel.symbols)}
+    days = dates_to_int(signals['日期'].values) if len(signals) else np.empty(0, dtype=np.int32)
+    d = np.searchsorted(panel.dates, days)
+    j = np.array([col_of.get(str(c).zfill(6), -1) for c in signals['代码']], dtype=np.int64)
+    known = (j >= 0) & (d < n_dates)
+    known[known] &= panel.dates[d[known]] == days[known]
+    d, j = d[known], j[known]
+    priority = np.asarray(signals['优先级'], dtype=float)[known] if '优先级' in signals else np.zeros(len(d))
+
+    opens, close = panel.fields['开盘'], panel.fields['收盘']
+    entry = d + 1
+    reason = np.full(len(d), '', dtype=object)
+    reason[entry >= n_dates] = '无后续数据'
+    e = np.minimum(entry, n_dates - 1)
+    reason[(reason == '') & ~panel.has[e, j]] = '次日停牌'
+    with np.errstate(invalid='ignore'):
+        limit_up_open = opens[e, j] >= up[e, j] - PRICE_EPS
+    reason[(reason == '') & limit_up_open] = '开盘涨停'
+
+    # 持有满 hold_days 个 (该股自己的) 交易日后收盘卖出：交易格按 (股票, 日期) 排序后向后数 hold_days 个
+    keys = np.flatnonzero(panel.has.T)                # = 列号 * n_dates + 日序
+    pos = np.searchsorted(keys, j * n_dates + e)
+    target = pos + hold_days
+    has_target = target < len(keys)
+    target_key = keys[np.minimum(target, len(keys) - 1)]
+    has_target &= target_key // n_dates == j
+    exit0 = np.where(has_target, target_key % n_dates, n_dates)
+
+    # 收盘跌停卖不出、停牌卖不了：顺延到下一个可卖日
+    with np.errstate(invalid='ignore'):
+        sellable = panel.has & ~(close <= down + PRICE_EPS)
+    next_sellable = np.where(sellable, np.arange(n_dates)[:, None], n_dates)
+    next_sellable = np.minimum.accumulate(next_sellable[::-1], axis=0)[::-1]
+    exit_day = np.where(exit0 < n_dates, next_sellable[np.minimum(exit0, n_dates - 1), j], n_dates)
+
+    return pd.DataFrame({
+        '信号日序': d, '列号': j, '优先级': priority, '买入日序': entry,
+        '买入价': np.where(reason == '', opens[e, j] * (1 + SLIPPAGE), np.nan),
+        '卖出日序': np.where(exit_day < n_dates, exit_day, -1),
+        '卖出价': np.where(exit_day < n_dates, close[np.minimum(exit_day, n_dates - 1), j] * (1 - SLIPPAGE), np.nan),
+        '放弃原因': reason,
+    })
+
+def buy_fee(value):
+    return max(value * COMMISSION_RATE, MIN_COMMISSION) + value * TRANSFER_FEE_RATE
+
+def sell_fee(value, day):
+    stamp = STAMP_DUTY_RATE if day >= STAMP_DUTY_CUT_DATE else STAMP_DUTY_OLD_RATE
+    return max(value * COMMISSION_RATE, MIN_COMMISSION) + value * TRANSFER_FEE_RATE + value * stamp
+
+def simulate(panel, plan, capital=INITIAL_CAPITAL, max_positions=MAX_POSITIONS, start=None, end=None):
+    """逐日资金记账：开盘先买 (按优先级)，收盘再卖；返回 (净值曲线, 逐笔成交, 放弃统计)"""
+    n_dates = len(panel.dates)
+    first = np.searchsorted(panel.dates, int(str(start).replace("-", ""))) if start else 0
+    last = np.searchsorted(panel.dates, int(str(end).replace("-", "")), side='right') if end else n_dates
+    close_ff = pd.DataFrame(panel.fields['收盘']).ffill().values
+
+    skipped = plan['放弃原因'].value_counts().to_dict()
+    plan = plan[(plan['放弃原因'] == '') & (plan['买入日序'] >= first) & (plan['买入日序'] < last)]
+    plan = plan.sort_values(['买入日序', '优先级', '列号'], kind='stable')
+    buys_by_day = {day: grp for day, grp in plan.groupby('买入日序')}
+
+    cash = capital
+    held = {}          # 列号 -> 持仓记录
+    exits = {}         # 卖出日序 -> [列号]
+    trades = []
+    records = []
+    equity_prev = capital
+    for day in range(first, last):
+        date = int(panel.dates[day])
+        bought = sold = 0.0
+        grp = buys_by_day.get(day)
+        if grp is not None:
+            slot_value = equity_prev / max_positions
+            for j, price, exit_day, exit_price in zip(grp['列号'].values, grp['买入价'].values,
+                                                     grp['卖出日序'].values, grp['卖出价'].values):
+                if len(held) >= max_positions:
+                    skipped['仓位已满'] = skipped.get('仓位已满', 0) + 1
+                    continue
+                if j in held:
+                    skipped['已持有'] = skipped.get('已持有', 0) + 1
+                    continue
+                budget = min(slot_value, cash)
+                shares = int(budget / (price * (1 + COMMISSION_RATE + TRANSFER_FEE_RATE)) // LOT_SIZE) * LOT_SIZE
+                while shares > 0 and shares * price + buy_fee(shares * price) > cash:
+                    shares -= LOT_SIZE
+                if shares <= 0:
+                    skipped['资金不足'] = skipped.get('资金不足', 0) + 1
+                    continue
+                value = shares * price
+                fee = buy_fee(value)
+                cash -= value + fee
+                bought += value
+                exit_day = exit_day if 0 <= exit_day < last else -1
+                held[j] = {'列号': j, '买入日序': day, '买入价': price, '股数': shares, '买入费用': fee,
+                           '卖出日序': exit_day, '卖出价': exit_price}
+                if exit_day >= 0:
+                    exits.setdefault(exit_day, []).append(j)
+
+        for j in exits.pop(day, []):
+            pos = held.pop(j)
+            value = pos['股数'] * pos['卖出价']
+            fee = sell_fee(value, date)
+            cash += value - fee
+            sold += value
+            trades.append(dict(pos, 卖出费用=fee))
+
+        market_value = sum(p['股数'] * close_ff[day, p['列号']] for p in held.values())
+        equity = cash + market_value
+        records.append((date, cash, market_value, equity, len(held), bought, sold))
+        equity_prev = equity
+
+    # 回测结束仍持有的按最后收盘价估值，记为未平仓
+    for pos in held.values():
+        trades.append(dict(pos, 卖出日序=-1, 卖出价=close_ff[last - 1, pos['列号']], 卖出费用=0.0))
+
+    curve = pd.DataFrame(records, columns=['日期', '现金', '持仓市值', '总资产', '持仓数', '买入额', '卖出额'])
+    curve['日期'] = int_to_dates(curve['日期'].values)
+    curve['净值'] = curve['总资产'] / capital
+    prev_equity = curve['总资产'].shift(1).fillna(capital)
+    curve['换手率'] = (curve['买入额'] + curve['卖出额']) / 2 / prev_equity
+
+    trades = pd.DataFrame(trades, columns=['列号', '买入日序', '买入价', '股数', '买入费用', '卖出日序', '卖出价', '卖出费用'])
+    if len(trades):
+        trades.insert(0, '代码', np.array(panel.symbols, dtype=object)[trades['列号'].values])
+        trades['买入日'] = int_to_dates(panel.dates[trades['买入日序'].values])
+        closed = trades['卖出日序'] >= 0
+        trades['卖出日'] = np.where(closed, int_to_dates(panel.dates[np.maximum(trades['卖出日序'].values, 0)]), '未平仓')
+        trades['持有天数'] = np.where(closed, trades['卖出日序'] - trades['买入日序'], last - 1 - trades['买入日序'])
+        cost = trades['股数'] * trades['买入价'] + trades['买入费用']
+        trades['收益率'] = (trades['股数'] * trades['卖出价'] - trades['卖出费用']) / cost - 1
+        trades = trades[['代码', '买入日', '买入价', '股数', '卖出日', '卖出价', '持有天数', '买入费用', '卖出费用', '收益率']]
+    return curve, trades, skipped
+
+def summarize(curve, trades, capital=INITIAL_CAPITAL):
+    if curve.empty:
+        return {}
+    equity = curve['总资产'].values
+    daily = np.diff(np.concatenate(([capital], equity))) / np.concatenate(([capital], equity[:-1]))
+    years = len(curve) / TRADING_DAYS_PER_YEAR
+    peak = np.maximum.accumulate(equity)
+    fees = trades['买入费用'].sum() + trades['卖出费用'].sum() if len(trades) else 0.0
+    return {
+        '交易日数': len(curve),
+        '期末总资产': equity[-1],
+        '总收益': equity[-1] / capital - 1,
+        '年化收益': (equity[-1] / capital) ** (1 / years) - 1 if years > 0 and equity[-1] > 0 else np.nan,
+        '最大回撤': (equity / peak - 1).min(),
+        '夏普': daily.mean() / daily.std() * np.sqrt(TRADING_DAYS_PER_YEAR) if daily.std() > 0 else np.nan,
+        '年化换手率': curve['换手率'].sum() / years if years > 0 else np.nan,
+        '平均持仓数': curve['持仓数'].mean(),
+        '成交笔数': len(trades),
+        '胜率': (trades['收益率'] > 0).mean() if len(trades) else np.nan,
+        '平均每笔收益': trades['收益率'].mean() if len(trades) else np.nan,
+        '平均持有天数': trades['持有天数'].mean() if len(trades) else np.nan,
+        '总费用': fees,
+    }
+
+def load_signals_file(path):
+    """读取外部信号 CSV (至少含 日期、代码 两列，可选 优先级)，如回放 / 选股表达式保存的结果"""
+    signals = pd.read_csv(path, dtype={'代码': str, '日期': str})
+    signals['代码'] = signals['代码'].str.zfill(6)
+    if '优先级' not in signals:
+        signals['优先级'] = 0
+    return signals[['日期', '代码', '优先级']]
+
+def load_name_map(path="stock_names.csv"):
+    if not os.path.exists(path):
+        return {}
+    names_df = pd.read_csv(path, dtype={'code': str})
+    return dict(zip(names_df['code'].str.zfill(6), names_df['name']))
+
+def run_backtest(strategy=None, signals_path=None, lookback=None, start=None, end=None, capital=INITIAL_CAPITAL,
+                 max_positions=MAX_POSITIONS, hold_days=HOLD_DAYS, save=True):
+    from indicator_engine import load_market
+    from stock_scanner_go_mini import REPLAY_WARMUP
+
+    t0 = time.perf_counter()
+    name_map = load_name_map()
+    # 战法信号在预热前缀上算好指标后再截到 lookback，窗口首日的信号与全量历史一致
+    warmup = 0 if signals_path or lookback is None else REPLAY_WARMUP
+    market = load_market(lookback=None if lookback is None else lookback + warmup, fields=LOAD_FIELDS)
+    if not market.symbols:
+        print("❌ 没有可回测的数据。")
+        return None
+    t1 = time.perf_counter()
+    signals = load_signals_file(signals_path) if signals_path else strategy_signals(strategy, market, name_map)
+    if warmup:
+        market = market.tail(lookback)
+        signals = signals[dates_to_int(signals['日期'].values) >= market.dates[market.valid].min()]
+    t2 = time.perf_counter()
+    up, down = limit_prices(market, name_map)
+    panel = CalendarPanel(market)
+    plan = plan_trades(panel, panel.scatter(up), panel.scatter(down), signals, hold_days)
+    t3 = time.perf_counter()
+    curve, trades, skipped = simulate(panel, plan, capital, max_positions, start, end)
+    t4 = time.perf_counter()
+    stats = summarize(curve, trades, capital)
+
+    label = strategy or os.path.splitext(os.path.basename(signals_path))[0]
+    print(f"📈 组合回测 [{label}]: {len(panel.symbols)} 只股票 × {len(panel.dates)} 个交易日，信号 {len(signals)} 个")
+    print(f"   读取 {t1 - t0:.1f}s，信号 {t2 - t1:.1f}s，成交计划 {t3 - t2:.2f}s，资金模拟 {t4 - t3:.2f}s")
+    if skipped:
+        print("   未成交: " + "，".join(f"{k} {v}" for k, v in skipped.items() if k))
+    for key, value in stats.items():
+        if key in ('总收益', '年化收益', '最大回撤', '胜率', '平均每笔收益', '年化换手率'):
+            print(f"   {key}: {value * 100:.2f}%")
+        elif isinstance(value, float):
+            print(f"   {key}: {value:,.2f}")
+        else:
+            print(f"   {key}: {value}")
+
+    if save and len(curve):
+        os.makedirs(PORTFOLIO_DIR, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        curve.to_csv(os.path.join(PORTFOLIO_DIR, f"{label}_净值_{stamp}.csv"), index=False, encoding='utf_8_sig')
+        trades.to_csv(os.path.join(PORTFOLIO_DIR, f"{label}_成交_{stamp}.csv"), index=False, encoding='utf_8_sig')
+        print(f"\n✅ 净值曲线与逐笔成交已保存至 {PORTFOLIO_DIR}")
+    return curve, trades, stats
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="组合级事件驱动回测 (T+1 / 涨跌停 / 费用 / 整手)")
+    parser.add_argument("strategy", nargs="?", choices=STRATEGIES, help="用哪个战法的历史信号")
+    parser.add_argument("--signals", default=None, help="改用外部信号 CSV (日期, 代码[, 优先级])")
+    parser.add_argument("--capital", type=float, default=INITIAL_CAPITAL)
+    parser.add_argument("--max-positions", type=int, default=MAX_POSITIONS)
+    parser.add_argument("--hold", type=int, default=HOLD_DAYS, help="持有交易日数 (>= 1)")
+    parser.add_argument("--start", default=None, help="回测起始日期 YYYY-MM-DD")
+    parser.add_argument("--end", default=None, help="回测结束日期 YYYY-MM-DD")
+    parser.add_argument("--lookback", type=int, default=None, help="只读取最近 N 行历史，默认全部")
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args(argv)
+
+    if not args.strategy and not args.signals:
+        parser.error("需要指定战法或 --signals")
+    if args.hold < 1:
+        parser.error("A 股 T+1，--hold 至少为 1")
+    run_backtest(args.strategy, args.signals, args.lookback, args.start, args.end, args.capital,
+                 args.max_positions, args.hold, not args.no_save)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+import os
+import sys
+import json
+import argparse
+import numpy as np
+import pandas as pd
+from stock_storage import STOCK_DATA_DIR, load_stock
+
+# ==========================================
+# 按战法持久化的信号库
+# 每个战法一个目录 stock_data/signals/<战法>/：
+#   signals.csv  只追加，(日期, 代码) 一行，记录行号 (该股历史中的位置) 与信号当天的特征；
+#   returns.csv  只追加，(日期, 代码, 周期, 收益)，远期收益到期后再补写；
+#   meta.json    持有周期与每只股票的处理水位 (已处理到的行数与日期)。
+# 读取时两张表按 (日期, 代码) 合并成宽表；夜间任务只需追加最新一天的信号并补写刚到期的收益。
+# 水位假设日线只追加；整体改写历史 (如重新下载复权数据) 后删除该战法目录即可全量重建。
+# ==========================================
+
+SIGNAL_DIR = os.path.join(STOCK_DATA_DIR, "signals")
+SIGNAL_VERSION = 1
+KEY_COLUMNS = ['日期', '代码', '行号']
+RETURN_COLUMNS = ['日期', '代码', '周期', '收益']
+
+class SignalStore:
+    """一个战法的信号库；写入先缓冲，flush() 时一次性追加到文件并原子更新 meta"""
+
+    def __init__(self, strategy, horizons=None, root=SIGNAL_DIR):
+        self.strategy = strategy
+        self.folder = os.path.join(root, strategy)
+        self.signals_path = os.path.join(self.folder, "signals.csv")
+        self.returns_path = os.path.join(self.folder, "returns.csv")
+        self.meta_path = os.path.join(self.folder, "meta.json")
+        self.symbols = {}
+        self.horizons = list(horizons or [])
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get('version') == SIGNAL_VERSION:
+                self.symbols = meta['symbols']
+                self.horizons = meta['horizons'] or self.horizons
+        self._signals = None
+        self._returns = None
+        self._new_signals = []
+        self._new_returns = []
+        self._rebuilt = set()
+
+    def __len__(self):
+        return len(self.signals())
+
+    def signals(self):
+        """全部已落盘的信号 (不含未 flush 的缓冲)"""
+        if self._signals is None:
+            if os.path.exists(self.signals_path):
+                self._signals = pd.read_csv(self.signals_path, dtype={'日期': str, '代码': str})
+            else:
+                self._signals = pd.DataFrame(columns=KEY_COLUMNS)
+        return self._signals
+
+    def returns(self):
+        if self._returns is None:
+            if os.path.exists(self.returns_path):
+                self._returns = pd.read_csv(self.returns_path, dtype={'日期': str, '代码': str})
+            else:
+                self._returns = pd.DataFrame(columns=RETURN_COLUMNS)
+        return self._returns
+
+    def frame(self):
+        """信号宽表：每个持有周期一列 "<N>日收益"，未到期为 NaN"""
+        signals = self.signals().drop_duplicates(['日期', '代码'], keep='last')
+        returns = self.returns().drop_duplicates(['日期', '代码', '周期'], keep='last')
+        wide = returns.pivot(index=['日期', '代码'], columns='周期', values='收益') if len(returns) else None
+        out = signals.set_index(['日期', '代码'])
+        for h in self.horizons:
+            col = f"{h}日收益"
+            out[col] = wide[h].reindex(out.index).values if wide is not None and h in wide.columns else np.nan
+        return out.reset_index()
+
+    def pending(self):
+        """仍有周期未补写收益的信号"""
+        frame = self.frame()
+        cols = [f"{h}日收益" for h in self.horizons]
+        return frame[frame[cols].isna().any(axis=1)] if cols else frame.iloc[:0]
+
+    def add_signals(self, rows):
+        """rows: 含 日期/代码/行号 及任意特征列的 dict 列表或 DataFrame"""
+        rows = pd.DataFrame(rows)
+        if len(rows):
+            rows['代码'] = rows['代码'].astype(str).str.zfill(6)
+            self._new_signals.append(rows)
+
+    def add_returns(self, rows):
+        """rows: (日期, 代码, 周期, 收益) 元组列表"""
+        if len(rows):
+            self._new_returns.append(pd.DataFrame(rows, columns=RETURN_COLUMNS))
+
+    def set_watermark(self, code, rows, last_date):
+        self.symbols[code] = {'rows': int(rows), 'last_date': last_date}
+
+    def rebuild_symbol(self, code):
+        """该股历史被改写：丢弃它的全部旧信号与收益，随后重新写入"""
+        self._rebuilt.add(code)
+
+    def flush(self):
+        """把缓冲写入磁盘：有重建的股票时重写两张表，否则只追加；返回 (新信号数, 新收益数)"""
+        os.makedirs(self.folder, exist_ok=True)
+        new_signals = pd.concat(self._new_signals, ignore_index=True) if self._new_signals else None
+        new_returns = pd.concat(self._new_returns, ignore_index=True) if self._new_returns else None
+        counts = (0 if new_signals is None else len(new_signals), 0 if new_returns is None else len(new_returns))
+
+        if self._rebuilt:
+            signals = self.signals()
+            returns = self.returns()
+            signals = pd.concat([signals[~signals['代码'].isin(self._rebuilt)], new_signals], ignore_index=True)
+            returns = pd.concat([returns[~returns['代码'].isin(self._rebuilt)], new_returns], ignore_index=True)
+            self._write(signals, self.signals_path)
+            self._write(returns, self.returns_path)
+        else:
+            if new_signals is not None:
+                self._append(new_signals, self.signals_path)
+            if new_returns is not None:
+                self._append(new_returns, self.returns_path)
+
+        tmp_path = self.meta_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': SIGNAL_VERSION, 'strategy': self.strategy, 'horizons': self.horizons,
+                       'symbols': self.symbols}, f)
+        os.replace(tmp_path, self.meta_path)
+        self._signals = self._returns = None
+        self._new_signals, self._new_returns, self._rebuilt = [], [], set()
+        return counts
+
+    def _write(self, df, path):
+        df.to_csv(path + ".tmp", index=False, encoding='utf-8')
+        os.replace(path + ".tmp", path)
+
+    def _append(self, df, path):
+        if os.path.exists(path):
+            # 追加时按已有表头对齐列，新增的特征列丢弃
+            header = pd.read_csv(path, nrows=0).columns
+            df.reindex(columns=header).to_csv(path, mode='a', header=False, index=False, encoding='utf-8')
+        else:
+            df.to_csv(path, index=False, encoding='utf-8')
+
+    def fill_pending(self, data_dir=STOCK_DATA_DIR):
+        """为到期的信号补写远期收益 (只读取有待补信号的股票)，返回补写条数"""
+        pending = self.pending()
+        done = self.returns()
+        have = set(zip(done['日期'], done['代码'], done['周期']))
+        rows = []
+        for code, group in pending.groupby('代码'):
+            path = os.path.join(data_dir, f"{code}.csv")
+            if not os.path.exists(path):
+                continue
+            df = load_stock(path, columns=['日期', '收盘'])
+            dates, close = df['日期'].values, df['收盘'].values
+            pos = np.searchsorted(dates, group['日期'].values)
+            for date, p in zip(group['日期'].values, pos):
+                if p >= len(dates) or dates[p] != date:
+                    continue
+                for h in self.horizons:
+                    if p + h < len(close) and (date, code, h) not in have:
+                        rows.append((date, code, h, (close[p + h] - close[p]) / close[p]))
+        self.add_returns(rows)
+        return len(rows)
+
+def record_results(strategy, results, horizons, date_key='日期', code_key='代码', data_dir=STOCK_DATA_DIR):
+    """每日扫描结果入库 (同一天重复运行不会重复写入)，并补写到期收益；返回 (新信号数, 补写收益数)"""
+    store = SignalStore(strategy, horizons)
+    frame = pd.DataFrame(results)
+    if len(frame):
+        frame = frame.rename(columns={date_key: '日期', code_key: '代码'})
+        frame['代码'] = frame['代码'].astype(str).str.zfill(6)
+        existing = store.signals()
+        seen = set(zip(existing['日期'], existing['代码']))
+        frame = frame[[(d, c) not in seen for d, c in zip(frame['日期'], frame['代码'])]]
+        if '行号' not in frame:
+            frame.insert(2, '行号', -1)
+        store.add_signals(frame[['日期', '代码', '行号'] + [c for c in frame.columns if c not in KEY_COLUMNS]])
+    filled = store.fill_pending(data_dir)
+    return store.flush()[0], filled
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="按战法持久化的信号库")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_info = sub.add_parser("info", help="各战法信号数、待补收益数与各周期胜率")
+    p_fill = sub.add_parser("fill", help="为到期信号补写远期收益")
+    p_fill.add_argument("strategy")
+    p_show = sub.add_parser("show", help="打印某战法最近的信号")
+    p_show.add_argument("strategy")
+    p_show.add_argument("--code", default=None)
+    p_show.add_argument("--rows", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    if args.command == "info":
+        names = sorted(os.listdir(SIGNAL_DIR)) if os.path.isdir(SIGNAL_DIR) else []
+        if not names:
+            print("暂无信号库。")
+            return
+        for name in names:
+            store = SignalStore(name)
+            frame = store.frame()
+            line = f"{name}: {len(frame)} 个信号，待补收益 {len(store.pending())} 个"
+            for h in store.horizons:
+                rets = frame[f"{h}日收益"].dropna()
+                if len(rets):
+                    line += f"；{h}日 胜率 {(rets > 0).mean() * 100:.1f}% 均益 {rets.mean() * 100:.2f}%"
+            print(line)
+        return
+    if args.command == "fill":
+        store = SignalStore(args.strategy)
+        filled = store.fill_pending()
+        store.flush()
+        print(f"✅ {args.strategy}: 补写 {filled} 条到期收益")
+        return
+    frame = SignalStore(args.strategy).frame()
+    if args.code:
+        frame = frame[frame['代码'] == args.code.zfill(6)]
+    if frame.empty:
+        print("❌ 没有信号。")
+        sys.exit(1)
+    print(frame.sort_values(['日期', '代码']).tail(args.rows).to_string(index=False))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import os
+import sys
+import json
+import time
+import argparse
+import importlib
+import subprocess
+
+# ==========================================
+# 统一命令行入口
+# 子命令在执行时才导入对应脚本，--help 与 sync 等轻量命令不会加载 pandas / akshare。
+# startup 子命令在全新解释器中测量每个子命令的冷启动耗时与加载的重型依赖。
+# ==========================================
+
+# 子命令 -> (模块, 入口函数, 说明, 入口是否接受 argv)
+COMMANDS = {
+    "list": ("stock_list_manager", "main", "获取全市场实时名单并过滤出下载名单", False),
+    "download": ("stock_data_downloader", "main", "日线增量下载 (并发 + 令牌桶频控)", True),
+    "sync": ("sync_stock_data", "main", "把源仓库的 stock_data 增量同步到主仓库", True),
+    "scan": ("stock_scanner_go_mini", "main", "温和进取版超跌反弹扫描", True),
+    "reversal": ("volume_reversal_strategy", "main", "极度缩量反包战法回测", False),
+    "zhangting": ("zhangting_huimaqiang", "run", "涨停回马枪战法回测", False),
+    "limits": ("limit_table", "main", "涨跌停价格表增量更新/查看", True),
+    "pipeline": ("strategy_pipeline", "main", "一次读取、多战法共享的扫描流水线", True),
+    "portfolio": ("portfolio_backtest", "main", "组合级事件驱动回测 (T+1/涨跌停/费用/整手)", True),
+    "screen": ("stock_screen", "main", "声明式选股表达式 (编译为向量化掩码)", True),
+    "signals": ("signal_store", "main", "按战法持久化的信号库 (查看/补写到期收益)", True),
+    "sweep": ("param_sweep", "main", "战法参数扫描 (网格/随机/逐次减半)", True),
+    "bench": ("benchmark", "main", "合成行情基准测试", True),
+}
+HEAVY_MODULES = ['akshare', 'pandas', 'numpy', 'joblib', 'pytz']
+STARTUP_REPEAT = 3
+
+def run_command(name, argv):
+    module_name, entry, help_text, takes_argv = COMMANDS[name]
+    if not takes_argv:
+        if argv in (["-h"], ["--help"]):
+            print(f"usage: stock_cli.py {name}\n\n{help_text} (无参数)")
+            return
+        if argv:
+            sys.exit(f"stock_cli.py {name}: 不接受参数 {' '.join(argv)}")
+    module = importlib.import_module(module_name)
+    func = getattr(module, entry)
+    return func(argv) if takes_argv else func()
+
+def _measure(module_name, repeat):
+    """在全新解释器中导入模块，返回 (最短墙钟耗时, 最短导入耗时, 加载的重型依赖)"""
+    code = ("import sys, time, json; t = time.perf_counter(); "
+            f"import {module_name}; cost = time.perf_counter() - t; "
+            f"print(json.dumps([cost, [m for m in {HEAVY_MODULES!r} if m in sys.modules]]))")
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    best_wall, best_import, heavy = None, None, []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, cwd=cwd)
+        wall = time.perf_counter() - t0
+        if out.returncode != 0:
+            return None, None, out.stderr.strip().splitlines()[-1] if out.stderr.strip() else "导入失败"
+        import_cost, heavy = json.loads(out.stdout.strip().splitlines()[-1])
+        best_wall = wall if best_wall is None else min(best_wall, wall)
+        best_import = import_cost if best_import is None else min(best_import, import_cost)
+    return best_wall, best_import, heavy
+
+def startup_report(repeat=STARTUP_REPEAT, json_path=None):
+    """测量 stock_cli 本身与各子命令的冷启动耗时"""
+    report = {}
+    baseline, _, _ = _measure("os", repeat)
+    report["(python)"] = {"wall": baseline, "import": 0.0, "heavy": []}
+    cli_wall, cli_import, cli_heavy = _measure("stock_cli", repeat)
+    report["(stock_cli --help)"] = {"wall": cli_wall, "import": cli_import, "heavy": cli_heavy}
+    for name, (module_name, _, _, _) in COMMANDS.items():
+        wall, import_cost, heavy = _measure(module_name, repeat)
+        report[name] = {"wall": wall, "import": import_cost, "heavy": heavy}
+
+    print(f"{'子命令':<20}{'冷启动':>10}{'导入':>10}  重型依赖")
+    for name, r in report.items():
+        if r["wall"] is None:
+            print(f"{name:<20}{'失败':>10}{'':>10}  {r['heavy']}")
+            continue
+        print(f"{name:<20}{r['wall']:>9.3f}s{r['import']:>9.3f}s  {', '.join(r['heavy']) or '-'}")
+    if json_path:
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n✅ 冷启动报告已保存至 {json_path}")
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="stock_cli.py", description="A 股数据与战法统一入口",
+        epilog="子命令:\n" + "\n".join(f"  {n:<10} {c[2]}" for n, c in COMMANDS.items())
+               + "\n  startup    测量各子命令的冷启动耗时",
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=list(COMMANDS) + ["startup"], metavar="command")
+    parser.add_argument("args", nargs=argparse.REMAINDER, help="传给子命令的参数")
+    args = parser.parse_args(argv)
+
+    if args.command == "startup":
+        p_startup = argparse.ArgumentParser(prog="stock_cli.py startup", description="测量各子命令的冷启动耗时")
+        p_startup.add_argument("--repeat", type=int, default=STARTUP_REPEAT, help="每项重复次数，取最短耗时")
+        p_startup.add_argument("--json", default=None, help="把结果另存为 JSON")
+        opts = p_startup.parse_args(args.args)
+        startup_report(opts.repeat, opts.json)
+        return
+    run_command(args.command, args.args)
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,35 @@
 import os
 import pandas as pd
-import akshare as ak
+import re
 import time
+import json
+import heapq
+import threading
+import argparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
 import sys
+from data_provider import PROVIDERS, DATA_PROVIDER, SHANGHAI_TZ, CachingProvider, get_provider, set_provider
 
 # 配置路径
 DATA_DIR = "stock_data"
 FILTERED_LIST_PATH = os.path.join(DATA_DIR, "filtered_stock_list.csv")
-CHECKPOINT_PATH = os.path.join(DATA_DIR, "checkpoint.txt") 
+STATE_PATH = os.path.join(DATA_DIR, "download_state.json")
+
+# 并发与频控配置 (所有线程共享同一个令牌桶，保证整体请求速率不超过接口配额)
+MAX_WORKERS = 8              # 并发下载线程数
+RATE_LIMIT_PER_SEC = 5.0     # 令牌桶每秒补充的请求数
+RATE_LIMIT_BURST = 10        # 令牌桶容量 (允许的瞬时突发请求数)
+
+# 失败重试配置 (指数退避：RETRY_BASE_DELAY * 2^(失败次数-1)，上限 RETRY_MAX_DELAY)
+MAX_RETRIES = 3              # 单轮运行内每只股票最多尝试次数
+MAX_ERROR_COUNT = 6          # 当日累计连续失败达到此数后不再重试，等第二天
+RETRY_BASE_DELAY = 2.0
+RETRY_MAX_DELAY = 60.0
+STATE_SAVE_EVERY = 50        # 每处理多少只股票落盘一次状态表
+
+TAIL_BLOCK_SIZE = 4096       # 读取 CSV 末尾的字节数 (一行日线约 80 字节)
+DATE_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}$")
 
 COLUMN_MAPPING = {
     "日期": "日期", "开盘": "开盘", "收盘": "收盘", "最高": "最高",
@@ -17,62 +38,279 @@ COLUMN_MAPPING = {
 }
 TARGET_COLUMNS = ['日期', '股票代码', '开盘', '收盘', '最高', '最低', '成交量', '成交额', '振幅', '涨跌幅', '涨跌额', '换手率']
 
-def download_item(symbol_short):
-    """处理单个股票的增量下载"""
+# 全市场实时快照 (stock_zh_a_spot_em) 列名 -> 日线列名，收盘后“最新价”即当日收盘价
+SPOT_COLUMN_MAPPING = {
+    "代码": "股票代码", "今开": "开盘", "最新价": "收盘", "最高": "最高",
+    "最低": "最低", "成交量": "成交量", "成交额": "成交额",
+    "振幅": "振幅", "涨跌幅": "涨跌幅", "涨跌额": "涨跌额", "换手率": "换手率"
+}
+MARKET_CLOSE_HOUR = 15       # 收盘时间 (北京时间)，之后的快照才可作为当日日线
+
+class TokenBucket:
+    """线程安全的令牌桶限速器：rate 为每秒补充令牌数，burst 为桶容量"""
+
+    def __init__(self, rate, burst):
+        if rate <= 0 or burst < 1:
+            raise ValueError(f"令牌桶参数非法: rate={rate}, burst={burst}")
+        self.rate = float(rate)
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """取走一个令牌，桶空时阻塞等待到下一个令牌生成"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class DownloadState:
+    """按股票代码记录的下载状态表 (最后数据日期、最后尝试时间、状态、连续失败次数)
+
+    以代码为键而不是名单下标，名单增删或重排后依然能正确断点续传。
+    """
+
+    def __init__(self, path=STATE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.records = {}
+        self.dirty = 0
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.records = json.load(f)
+            except Exception as e:
+                print(f"⚠️ 状态表读取失败，将从头开始: {e}")
+
+    def get(self, symbol):
+        return self.records.get(symbol, {})
+
+    def is_done(self, symbol, run_date):
+        """当天已成功下载过的股票直接跳过"""
+        rec = self.get(symbol)
+        return rec.get('status') == 'done' and rec.get('last_attempt', '')[:10] == run_date
+
+    def error_count(self, symbol, run_date):
+        """当天累计的连续失败次数 (跨天自动清零)"""
+        rec = self.get(symbol)
+        if rec.get('last_attempt', '')[:10] != run_date:
+            return 0
+        return rec.get('error_count', 0)
+
+    def mark_success(self, symbol, last_date):
+        with self.lock:
+            rec = self.records.setdefault(symbol, {})
+            if last_date:
+                rec['last_date'] = last_date
+            rec['last_attempt'] = datetime.now(SHANGHAI_TZ).strftime('%Y-%m-%d %H:%M:%S')
+            rec['status'] = 'done'
+            rec['error_count'] = 0
+            rec.pop('last_error', None)
+            self._touch()
+
+    def mark_failure(self, symbol, error):
+        """记录一次失败并返回当天累计的连续失败次数"""
+        run_date = datetime.now(SHANGHAI_TZ).strftime('%Y-%m-%d')
+        with self.lock:
+            count = self.error_count(symbol, run_date) + 1
+            rec = self.records.setdefault(symbol, {})
+            rec['last_attempt'] = datetime.now(SHANGHAI_TZ).strftime('%Y-%m-%d %H:%M:%S')
+            rec['status'] = 'failed'
+            rec['error_count'] = count
+            rec['last_error'] = str(error)[:200]
+            self._touch()
+            return count
+
+    def _touch(self):
+        self.dirty += 1
+        if self.dirty >= STATE_SAVE_EVERY:
+            self._save_locked()
+
+    def save(self):
+        with self.lock:
+            self._save_locked()
+
+    def _save_locked(self):
+        # 先写临时文件再原子替换，防止中途被杀导致状态表损坏
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.records, f, ensure_ascii=False, indent=0, sort_keys=True)
+        os.replace(tmp_path, self.path)
+        self.dirty = 0
+
+def read_last_date(file_path):
+    """只读取 CSV 末尾若干字节解析最后一行的日期，耗时与历史长度无关
+
+    文件只有表头或为空时返回 None；最后一行无法解析时抛出 ValueError。
+    """
+    with open(file_path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        block = TAIL_BLOCK_SIZE
+        while True:
+            start = max(0, size - block)
+            f.seek(start)
+            lines = f.read(size - start).splitlines()
+            # 末尾块内至少要有一行完整数据 (或已读到文件开头)
+            if len([l for l in lines if l.strip()]) >= 2 or start == 0:
+                break
+            block *= 2
+
+    lines = [l for l in lines if l.strip()]
+    if not lines:
+        return None
+    last_field = lines[-1].decode('utf-8-sig').split(',', 1)[0].strip()
+    if DATE_PATTERN.match(last_field):
+        return last_field
+    if start == 0 and len(lines) == 1:
+        return None  # 只有表头
+    raise ValueError(f"无法解析末行日期: {lines[-1][:80]!r}")
+
+def retry_delay(error_count):
+    """指数退避等待秒数"""
+    return min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (error_count - 1))
+
+def format_rows(df):
+    """统一格式化为 TARGET_COLUMNS 的列顺序与精度"""
+    df = df.copy()
+    df['成交额'] = pd.to_numeric(df['成交额'], errors='coerce').round(1)
+    for col in ['开盘', '收盘', '最高', '最低', '振幅', '涨跌幅', '涨跌额', '换手率']:
+        df[col] = pd.to_numeric(df[col], errors='coerce').round(2)
+    df['成交量'] = df['成交量'].astype(int)
+    return df[TARGET_COLUMNS]
+
+def append_rows(file_path, df):
+    """格式化后以追加模式写入 CSV，新文件带表头"""
+    df = format_rows(df)
+    header = not os.path.exists(file_path)
+    df.to_csv(file_path, mode='a', index=False, header=header, encoding='utf-8')
+
+def spot_to_daily_rows(spot_df, trade_date):
+    """把一次全市场快照转换成每只股票一行的当日日线 (TARGET_COLUMNS 格式)
+
+    停牌股 (无成交或无最新价) 在日线接口中没有当日数据，这里同样剔除。
+    """
+    df = spot_df[list(SPOT_COLUMN_MAPPING)].rename(columns=SPOT_COLUMN_MAPPING)
+    df['股票代码'] = df['股票代码'].astype(str).str.zfill(6)
+    df['日期'] = trade_date
+    for col in ['收盘', '开盘', '成交量']:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    df = df[df['收盘'].notna() & df['开盘'].notna() & (df['成交量'].fillna(0) > 0)]
+    return format_rows(df).set_index('股票代码', drop=False)
+
+def recent_trade_dates(today):
+    """返回 (今天是否交易日, 上一个交易日)，日期格式 YYYY-MM-DD"""
+    cal = get_provider().tool_trade_date_hist_sina()
+    dates = sorted(pd.to_datetime(cal['trade_date']).dt.strftime('%Y-%m-%d'))
+    prev = [d for d in dates if d < today]
+    return today in dates, (prev[-1] if prev else None)
+
+def update_from_spot(symbols, state):
+    """收盘后用一次全市场快照给每只股票追加当日一行
+
+    只有本地最后日期恰好是上一交易日的股票才直接追加；缺口或新股留给逐只历史接口补齐。
+    返回 False 表示当前不满足快照更新条件 (非交易日或尚未收盘)。
+    """
+    now = datetime.now(SHANGHAI_TZ)
+    today = now.strftime('%Y-%m-%d')
+    is_trading_day, prev_trade_date = recent_trade_dates(today)
+    if not is_trading_day:
+        print(f"📅 {today} 非交易日，无需快照更新。")
+        return False
+    if now.hour < MARKET_CLOSE_HOUR:
+        print(f"⏳ 尚未收盘 (北京时间 {now.strftime('%H:%M')})，快照不能作为当日日线。")
+        return False
+
+    print("📸 正在获取全市场收盘快照...")
+    rows = spot_to_daily_rows(get_provider().stock_zh_a_spot_em(), today)
+
+    appended, gaps = 0, 0
+    for symbol in symbols:
+        if symbol not in rows.index:
+            continue  # 停牌或快照缺失，交给逐只接口确认
+        file_path = os.path.join(DATA_DIR, f"{symbol}.csv")
+        try:
+            last_date = read_last_date(file_path) if os.path.exists(file_path) else None
+        except Exception:
+            last_date = None
+        if last_date == today:
+            state.mark_success(symbol, today)
+        elif last_date is not None and last_date == prev_trade_date:
+            append_rows(file_path, rows.loc[[symbol]])
+            state.mark_success(symbol, today)
+            appended += 1
+        else:
+            gaps += 1
+    print(f"✅ 快照追加 {appended} 只，{gaps} 只存在缺口需逐只补齐。")
+    return True
+
+def download_item(symbol_short, limiter=None):
+    """处理单个股票的增量下载，返回 (是否成功, 本地最后数据日期, 异常信息)"""
     file_path = os.path.join(DATA_DIR, f"{symbol_short}.csv")
     try:
-        existing_dates = set()
         start_date = "19900101"
+        last_date = None
         
-        # 1. 检查本地数据，获取增量起始点
+        # 1. 检查本地数据，只读文件末尾获取最后日期作为增量起始点
         if os.path.exists(file_path):
             try:
-                existing_df = pd.read_csv(file_path)
-                if not existing_df.empty:
-                    existing_dates = set(existing_df['日期'].astype(str).tolist())
-                    # 取最后一行日期，去除横杠作为接口起始时间
-                    last_date = str(existing_df.iloc[-1]['日期']).replace("-", "")
-                    start_date = last_date
+                last_date = read_last_date(file_path)
+                if last_date:
+                    # 去除横杠作为接口起始时间
+                    start_date = last_date.replace("-", "")
             except Exception as e:
                 print(f"读取旧文件失败 {symbol_short}, 重新全量下载: {e}")
 
-        # 2. 调用 akshare 接口
-        df = ak.stock_zh_a_hist(symbol=symbol_short, period="daily", start_date=start_date, adjust="")
+        # 2. 调用数据源接口 (先从令牌桶取令牌，接口保护频控)
+        if limiter is not None:
+            limiter.acquire()
+        df = get_provider().stock_zh_a_hist(symbol=symbol_short, period="daily", start_date=start_date, adjust="")
         
         if df is not None and not df.empty:
             df = df.rename(columns=COLUMN_MAPPING)
             df['股票代码'] = symbol_short
             df['日期'] = df['日期'].astype(str)
             
-            # 3. 严格去重：只保留本地不存在的日期
-            df = df[~df['日期'].isin(existing_dates)]
+            # 3. 严格去重：文件按日期追加有序，只保留晚于本地最后日期的行
+            if last_date:
+                df = df[df['日期'] > last_date]
             
             if not df.empty:
-                # 格式化数据
-                df['成交额'] = df['成交额'].round(1)
-                for col in ['开盘', '收盘', '最高', '最低', '振幅', '涨跌幅', '涨跌额', '换手率']:
-                    df[col] = pd.to_numeric(df[col], errors='coerce').round(2)
-                df['成交量'] = df['成交量'].astype(int)
-                
-                df = df[TARGET_COLUMNS]
-                header = not os.path.exists(file_path)
-                # 追加模式写入 CSV
-                df.to_csv(file_path, mode='a', index=False, header=header, encoding='utf-8')
+                append_rows(file_path, df)
+                last_date = df['日期'].iloc[-1]
         
-        time.sleep(0.2) # 接口保护频控
-        return True
+        return True, last_date, None
     except Exception as e:
         print(f"下载异常 {symbol_short}: {e}")
-        return False
+        return False, None, e
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="A 股日线增量下载 (并发 + 令牌桶频控)")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="并发下载线程数")
+    parser.add_argument("--rate", type=float, default=RATE_LIMIT_PER_SEC, help="每秒请求数上限")
+    parser.add_argument("--burst", type=int, default=RATE_LIMIT_BURST, help="令牌桶容量")
+    parser.add_argument("--mode", choices=["hist", "spot"], default="hist",
+                        help="hist: 逐只历史接口增量; spot: 收盘后用一次全市场快照追加当日行，仅缺口逐只补齐")
+    parser.add_argument("--provider", choices=list(PROVIDERS), default=None,
+                        help=f"数据源，默认环境变量 STOCK_DATA_PROVIDER ({DATA_PROVIDER})")
+    parser.add_argument("--no-cache", action="store_true", help="不使用磁盘响应缓存，所有请求都访问网络")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.provider or args.no_cache:
+        set_provider(args.provider or DATA_PROVIDER, cache=False if args.no_cache else None)
 
-def main():
     # 确保目录存在
     if not os.path.exists(DATA_DIR): 
         os.makedirs(DATA_DIR)
-    
-    # 初始化断点文件（防止 Git 提交报错）
-    if not os.path.exists(CHECKPOINT_PATH):
-        with open(CHECKPOINT_PATH, 'w') as f: f.write('0')
 
     if not os.path.exists(FILTERED_LIST_PATH):
         print("错误: 找不到名单文件 filtered_stock_list.csv")
@@ -82,31 +320,86 @@ def main():
     df_list = pd.read_csv(FILTERED_LIST_PATH)
     symbols = df_list['代码'].astype(str).str.zfill(6).tolist()
 
-    # 读取进度断点
-    try:
-        with open(CHECKPOINT_PATH, 'r') as f:
-            start_index = int(f.read().strip())
-    except:
-        start_index = 0
+    state = DownloadState()
+
+    # 快照模式：一次请求覆盖所有无缺口的股票，剩余的由下面的逐只下载补齐
+    if args.mode == "spot" and not update_from_spot(symbols, state):
+        state.save()
+        return
+
+    # 读取按代码记录的状态表，跳过今天已完成和今天已放弃的股票
+    run_date = datetime.now(SHANGHAI_TZ).strftime('%Y-%m-%d')
+    pending = [s for s in symbols
+               if not state.is_done(s, run_date) and state.error_count(s, run_date) < MAX_ERROR_COUNT]
+    given_up = [s for s in symbols
+                if not state.is_done(s, run_date) and state.error_count(s, run_date) >= MAX_ERROR_COUNT]
 
-    print(f"📊 当前下载进度: {start_index}/{len(symbols)}")
+    print(f"📊 当前下载进度: {len(symbols) - len(pending)}/{len(symbols)}")
 
-    if start_index >= len(symbols):
-        print("✅ 所有数据已下载完成，重置进度。")
-        with open(CHECKPOINT_PATH, 'w') as f: f.write('0')
+    # 初始化状态表文件（防止 Git 提交报错）
+    state.save()
+
+    if not pending:
+        print("✅ 所有数据已下载完成。")
         return
 
-    # 按顺序执行下载
-    for i in range(start_index, len(symbols)):
-        success = download_item(symbols[i])
-        if success:
-            # 每成功一只，实时更新断点
-            with open(CHECKPOINT_PATH, 'w') as f:
-                f.write(str(i + 1))
-        else:
-            # 失败则打印当前代码并退出，由 Workflow 触发重试
-            print(f"🛑 任务中断于 index {i} (代码: {symbols[i]})")
-            sys.exit(1)
+    # 并发执行下载：所有线程共享一个令牌桶
+    limiter = TokenBucket(args.rate, args.burst)
+    print(f"⚙️ 并发线程: {args.workers}, 频控: {args.rate}/s (突发 {args.burst})")
+
+    # 重试队列：按到期时间排序的小顶堆，失败的股票按指数退避重新入队，不阻塞其他股票
+    queue = [(0.0, s) for s in pending]
+    heapq.heapify(queue)
+    attempts = {}
+    failed = []
+    workers = max(1, args.workers)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            inflight = {}
+            while queue or inflight:
+                now = time.monotonic()
+                while queue and queue[0][0] <= now and len(inflight) < workers * 2:
+                    _, symbol = heapq.heappop(queue)
+                    inflight[executor.submit(download_item, symbol, limiter)] = symbol
+                if not inflight:
+                    time.sleep(max(0.0, queue[0][0] - now))
+                    continue
+
+                # 只有在还有空闲名额、且队首尚未到期时才需要按时醒来提交重试；
+                # 名额已满或队首已到期 (只能等名额) 时阻塞到有任务完成，避免主线程空转抢 GIL
+                has_room = len(inflight) < workers * 2
+                timeout = queue[0][0] - now if queue and has_room and queue[0][0] > now else None
+                finished, _ = wait(inflight, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    symbol = inflight.pop(future)
+                    ok, last_date, error = future.result()
+                    if ok:
+                        state.mark_success(symbol, last_date)
+                        continue
+                    count = state.mark_failure(symbol, error)
+                    attempts[symbol] = attempts.get(symbol, 0) + 1
+                    if attempts[symbol] < MAX_RETRIES and count < MAX_ERROR_COUNT:
+                        delay = retry_delay(count)
+                        print(f"🔁 {symbol} 第 {count} 次失败，{delay:.0f}s 后重试")
+                        heapq.heappush(queue, (time.monotonic() + delay, symbol))
+                    elif count >= MAX_ERROR_COUNT:
+                        given_up.append(symbol)
+                    else:
+                        failed.append(symbol)
+    finally:
+        state.save()
+
+    provider = get_provider()
+    if isinstance(provider, CachingProvider):
+        print(f"🗄️ 响应缓存命中 {provider.hits} 次，网络请求 {provider.misses} 次")
+
+    if given_up:
+        print(f"⚠️ 以下 {len(given_up)} 只股票今日连续失败 {MAX_ERROR_COUNT} 次，已放弃: {', '.join(given_up)}")
+
+    if failed:
+        # 仍有可重试的失败代码则退出，由 Workflow 触发重试 (已完成的股票不会重复下载)
+        print(f"🛑 本轮有 {len(failed)} 只股票下载失败，等待重试: {', '.join(failed)}")
+        sys.exit(1)
 
     print("🎉 本轮下载任务顺利执行完毕。")
 
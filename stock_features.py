@@ -0,0 +1,33 @@
+# ==========================================
+# 单只股票的共享特征缓存
+# 多个战法在同一次运行中需要的均线、量均线、涨跌幅只计算一次。
+# 各脚本单独运行时每只股票新建一个缓存，行为与直接调用 rolling 完全相同。
+# ==========================================
+
+class StockFeatures:
+    """按 (特征, 参数) 缓存的 pandas Series，df 需已按日期排序且为 RangeIndex"""
+
+    def __init__(self, df):
+        self.df = df
+        self._cache = {}
+
+    def _get(self, key, compute):
+        if key not in self._cache:
+            self._cache[key] = compute()
+        return self._cache[key]
+
+    def ma(self, window, col='收盘'):
+        """window 日简单移动平均"""
+        return self._get(('ma', col, window), lambda: self.df[col].rolling(window).mean())
+
+    def vol_ma(self, window):
+        """window 日成交量均值 (含当日)"""
+        return self.ma(window, '成交量')
+
+    def prev_vol_ma(self, window):
+        """前 window 日成交量均值 (不含当日，用于量比)"""
+        return self._get(('prev_vol_ma', window), lambda: self.df['成交量'].shift(1).rolling(window).mean())
+
+    def pct_change(self, col='收盘'):
+        """逐日涨跌幅 (%)"""
+        return self._get(('pct', col), lambda: self.df[col].pct_change() * 100)
@@ -1,20 +1,16 @@
 import os
-import akshare as ak
 import pandas as pd
+from datetime import datetime
+from data_provider import SHANGHAI_TZ, get_provider
+from universe_history import record_snapshot
 
 DATA_DIR = "stock_data"
-if not os.path.exists(DATA_DIR):
-    os.makedirs(DATA_DIR)
 
 RAW_LIST_PATH = os.path.join(DATA_DIR, "raw_stock_list.csv")
 FILTERED_LIST_PATH = os.path.join(DATA_DIR, "filtered_stock_list.csv")
 
-def main():
-    print("正在获取 A 股实时名单...")
-    # 获取全量行情
-    df = ak.stock_zh_a_spot_em()
-    df.to_csv(RAW_LIST_PATH, index=False, encoding='utf-8-sig')
-    
+def filter_stock_list(df):
+    """对实时行情名单执行过滤并生成下载代码，返回精简名单"""
     # --- 过滤逻辑升级 ---
     # 1. 排除 ST (包含 *ST)
     df = df[~df['名称'].str.contains("ST", na=False)]
@@ -35,6 +31,20 @@ def main():
         return f"{c_str}.SS" if c_str.startswith('6') else f"{c_str}.SZ"
     
     df['yf_code'] = df['代码'].apply(format_code)
+    return df
+
+def main():
+    if not os.path.exists(DATA_DIR):
+        os.makedirs(DATA_DIR)
+
+    print("正在获取 A 股实时名单...")
+    # 获取全量行情
+    df = get_provider().stock_zh_a_spot_em()
+    df.to_csv(RAW_LIST_PATH, index=False, encoding='utf-8-sig')
+    
+    listed_codes = df['代码'].astype(str).str.zfill(6)
+    st_codes = listed_codes[df['名称'].str.contains("ST", na=False)]
+    df = filter_stock_list(df)
     
     # 保存精简名单
     df.to_csv(FILTERED_LIST_PATH, index=False, encoding='utf-8-sig')
@@ -43,5 +53,10 @@ def main():
     print(f"- 精简后股数: {len(df)}")
     print(f"精简名单已保存至: {FILTERED_LIST_PATH}")
 
+    # 追加当天的时点股票池快照，供回测按历史名单判定
+    today = datetime.now(SHANGHAI_TZ).strftime('%Y-%m-%d')
+    counts = record_snapshot(today, listed_codes, df['代码'].astype(str).str.zfill(6), st_codes)
+    print(f"- 股票池快照 {today}: 全市场 {counts['listed']} 只，入池 {counts['eligible']} 只")
+
 if __name__ == "__main__":
     main()
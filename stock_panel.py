@@ -0,0 +1,202 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import numpy as np
+import pandas as pd
+from stock_storage import STOCK_DATA_DIR, BinBackend, CsvBackend, frame_to_arrays, list_symbols
+
+# ==========================================
+# 全市场内存映射价格面板
+# 把 stock_data 下所有股票打包成一个对齐的 (交易日 × 股票 × 字段) float32 数组，
+# 非交易日 (停牌/未上市) 为 NaN。扫描脚本用 np.memmap 零拷贝打开，一次切出全市场最近 N 天。
+# 按日期为最外层存储，新交易日只需在文件末尾追加。
+# indicator_engine.load_market 在面板不比日线旧时直接从面板切片 (向量化扫描、回放、参数扫描、组合回测)。
+# ==========================================
+
+PANEL_DIR = "stock_panel"
+PANEL_FILE = "panel.f32"
+META_FILE = "meta.json"
+PANEL_FIELDS = ['开盘', '收盘', '最高', '最低', '成交量', '换手率', '涨跌幅', '涨跌额']
+
+def _load_symbol_arrays(code, data_dir=STOCK_DATA_DIR):
+    """优先读取不比 CSV 旧的二进制列存文件，否则解析 CSV"""
+    csv_store, bin_store = CsvBackend(data_dir), BinBackend()
+    bin_path, csv_path = bin_store.path(code), csv_store.path(code)
+    if os.path.exists(bin_path) and os.path.getmtime(bin_path) >= os.path.getmtime(csv_path):
+        return bin_store.read_arrays(code)
+    df = pd.read_csv(csv_path)
+    return frame_to_arrays(df) if not df.empty else None
+
+def _stack_fields(arrays, mask=None):
+    """取出面板字段，缺失字段填 NaN，返回 (行数, 字段数) float32"""
+    n = len(arrays['日期'])
+    out = np.full((n, len(PANEL_FIELDS)), np.nan, dtype=np.float32)
+    for k, field in enumerate(PANEL_FIELDS):
+        if field in arrays:
+            out[:, k] = arrays[field]
+    return out if mask is None else out[mask]
+
+def build_panel(data_dir=STOCK_DATA_DIR, out_dir=PANEL_DIR, start_date=None):
+    """全量构建面板；start_date (YYYYMMDD 整数) 用于只保留近年数据以控制体积"""
+    t0 = time.perf_counter()
+    symbols = list_symbols(data_dir)
+    loaded = {}
+    all_dates = set()
+    for code in symbols:
+        try:
+            arrays = _load_symbol_arrays(code, data_dir)
+        except Exception as e:
+            print(f"读取失败 {code}: {e}")
+            continue
+        if arrays is None:
+            continue
+        if start_date:
+            keep = arrays['日期'] >= start_date
+            arrays = {k: v[keep] for k, v in arrays.items()}
+        if len(arrays['日期']):
+            loaded[code] = arrays
+            all_dates.update(arrays['日期'].tolist())
+
+    symbols = sorted(loaded)
+    dates = np.array(sorted(all_dates), dtype=np.int32)
+    shape = (len(dates), len(symbols), len(PANEL_FIELDS))
+
+    # 先写到临时目录，完成后整体替换，读者不会看到写了一半的面板
+    tmp_dir = out_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    data = np.memmap(os.path.join(tmp_dir, PANEL_FILE), dtype=np.float32, mode='w+', shape=shape)
+    data[:] = np.nan
+    for j, code in enumerate(symbols):
+        arrays = loaded.pop(code)
+        rows = np.searchsorted(dates, arrays['日期'])
+        data[rows, j, :] = _stack_fields(arrays)
+    data.flush()
+    del data
+
+    _write_meta(tmp_dir, dates, symbols, data_dir, start_date)
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(tmp_dir, out_dir)
+    size_mb = np.prod(shape) * 4 / 1e6
+    print(f"✅ 面板构建完成: {shape[0]} 个交易日 × {shape[1]} 只股票 × {shape[2]} 个字段 "
+          f"({size_mb:.0f}MB, 耗时 {time.perf_counter() - t0:.1f}s)")
+    return shape
+
+def _write_meta(out_dir, dates, symbols, data_dir=STOCK_DATA_DIR, start_date=None):
+    meta = {"dates": dates.tolist(), "symbols": symbols, "fields": PANEL_FIELDS,
+            "data_dir": os.path.abspath(data_dir), "start_date": start_date}
+    tmp_path = os.path.join(out_dir, META_FILE + ".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, os.path.join(out_dir, META_FILE))
+
+def update_panel(data_dir=STOCK_DATA_DIR, out_dir=PANEL_DIR):
+    """每日增量：只把面板最后日期之后的新交易日追加到文件末尾；股票列表变化时全量重建"""
+    if not os.path.exists(os.path.join(out_dir, META_FILE)):
+        return build_panel(data_dir, out_dir)
+    panel = PricePanel(out_dir)
+    if set(list_symbols(data_dir)) - set(panel.symbols) or panel.fields != PANEL_FIELDS:
+        print("ℹ️ 出现新股票代码或字段变化，全量重建面板。")
+        return build_panel(data_dir, out_dir, start_date=panel.start_date)
+
+    last_date = int(panel.dates[-1])
+    built = os.path.getmtime(os.path.join(out_dir, META_FILE))
+    new_rows = {}
+    for j, code in enumerate(panel.symbols):
+        csv_path = CsvBackend(data_dir).path(code)
+        if not os.path.exists(csv_path):
+            continue
+        arrays = _load_symbol_arrays(code, data_dir)
+        if arrays is None:
+            continue
+        mask = arrays['日期'] > last_date
+        if mask.any():
+            new_rows[j] = (arrays['日期'][mask], _stack_fields(arrays, mask))
+        elif os.path.getmtime(csv_path) > built:
+            # 文件比面板新却没有新交易日，说明历史被原地修改，追加无法反映
+            print(f"ℹ️ {code} 的历史有修改，全量重建面板。")
+            return build_panel(data_dir, out_dir, start_date=panel.start_date)
+
+    new_dates = np.unique(np.concatenate([d for d, _ in new_rows.values()])) if new_rows else []
+    if not len(new_dates):
+        print("✅ 面板已是最新。")
+        return panel.shape
+    block = np.full((len(new_dates), len(panel.symbols), len(PANEL_FIELDS)), np.nan, dtype=np.float32)
+    for j, (d, values) in new_rows.items():
+        block[np.searchsorted(new_dates, d), j, :] = values
+
+    dates = np.concatenate([panel.dates, new_dates]).astype(np.int32)
+    symbols, panel_start = panel.symbols, panel.start_date
+    del panel
+    with open(os.path.join(out_dir, PANEL_FILE), 'ab') as f:
+        f.write(block.tobytes())
+    _write_meta(out_dir, dates, symbols, data_dir, panel_start)
+    print(f"✅ 面板追加 {len(new_dates)} 个交易日，最新日期 {dates[-1]}")
+    return (len(dates), len(symbols), len(PANEL_FIELDS))
+
+class PricePanel:
+    """只读打开的面板，所有切片都是 memmap 视图，不复制数据"""
+
+    def __init__(self, path=PANEL_DIR):
+        with open(os.path.join(path, META_FILE), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.dates = np.array(meta['dates'], dtype=np.int32)
+        self.symbols = meta['symbols']
+        self.fields = meta['fields']
+        self.data_dir = meta.get('data_dir')
+        self.start_date = meta.get('start_date')  # 构建时截掉了更早的历史则非空
+        self.shape = (len(self.dates), len(self.symbols), len(self.fields))
+        self.symbol_index = {s: j for j, s in enumerate(self.symbols)}
+        self.field_index = {f: k for k, f in enumerate(self.fields)}
+        self.data = np.memmap(os.path.join(path, PANEL_FILE), dtype=np.float32, mode='r', shape=self.shape)
+
+    def field(self, name, data=None):
+        """某个字段的 (交易日 × 股票) 二维视图"""
+        return (self.data if data is None else data)[:, :, self.field_index[name]]
+
+    def tail(self, n):
+        """最近 n 个交易日的全市场数据 (n × 股票 × 字段)"""
+        return self.data[-n:]
+
+    def tail_field(self, name, n):
+        return self.data[-n:, :, self.field_index[name]]
+
+    def between(self, start_date, end_date):
+        """[start_date, end_date] 区间 (YYYYMMDD 整数) 的视图与对应日期"""
+        lo = np.searchsorted(self.dates, start_date, side='left')
+        hi = np.searchsorted(self.dates, end_date, side='right')
+        return self.dates[lo:hi], self.data[lo:hi]
+
+    def symbol(self, code):
+        """单只股票的 (交易日 × 字段) 视图"""
+        return self.data[:, self.symbol_index[code], :]
+
+def open_panel(path=PANEL_DIR):
+    return PricePanel(path)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="全市场内存映射价格面板 (交易日 × 股票 × 字段)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_build = sub.add_parser("build", help="全量构建面板")
+    p_build.add_argument("--start", type=int, default=None, help="起始日期 YYYYMMDD，默认全部历史")
+    sub.add_parser("update", help="增量追加新交易日")
+    sub.add_parser("info", help="打印面板信息")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        build_panel(start_date=args.start)
+    elif args.command == "update":
+        update_panel()
+    else:
+        if not os.path.exists(os.path.join(PANEL_DIR, META_FILE)):
+            print("❌ 未找到面板，请先执行 build。")
+            sys.exit(1)
+        panel = open_panel()
+        print(f"交易日 {panel.shape[0]} ({panel.dates[0]} ~ {panel.dates[-1]})，"
+              f"股票 {panel.shape[1]}，字段 {', '.join(panel.fields)}")
+
+if __name__ == "__main__":
+    main()
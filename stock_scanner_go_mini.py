@@ -1,10 +1,12 @@
 import pandas as pd
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 import os
-import pytz
 import glob
-from multiprocessing import Pool, cpu_count
+import argparse
 import numpy as np
+from stock_storage import load_stock, int_to_dates
+from stock_features import StockFeatures
+from parallel_utils import DEFAULT_CHUNKSIZE, run_parallel
 
 # ==================== 2026“温和进取版”精选参数 ===================
 MIN_PRICE = 5.0              # 股价门槛
@@ -23,13 +25,18 @@ MIN_PROFIT_POTENTIAL = 10    # 离60日线空间要求降至10%
 MAX_TODAY_CHANGE = 5.0       # 允许最高5%的涨幅，不错过中阳线止跌
 # =============================================================
 
-SHANGHAI_TZ = pytz.timezone('Asia/Shanghai')
+SHANGHAI_TZ = timezone(timedelta(hours=8))  # 北京时间无夏令时，固定偏移即可，免去导入 pytz
 STOCK_DATA_DIR = 'stock_data'
 NAME_MAP_FILE = 'stock_names.csv' 
+REPLAY_HORIZONS = [1, 3, 5, 10, 20]   # 历史回放统计的持有周期 (交易日)
+REPLAY_DIR = os.path.join('results', 'replay')
+REPLAY_WARMUP = 120                    # 回放指定 lookback 时多读的预热行数，使窗口首日的 ma60/RSI/KDJ 已收敛
 
-def calculate_indicators(df):
-    """计算核心指标"""
+def calculate_indicators(df, features=None):
+    """计算核心指标 (features 为共享特征缓存，需基于同一份已重置索引的 df)"""
     df = df.reset_index(drop=True)
+    if features is None:
+        features = StockFeatures(df)
     close = df['收盘']
     
     # 1. RSI6
@@ -46,18 +53,17 @@ def calculate_indicators(df):
     df['kdj_k'] = rsv.ewm(com=2).mean()
     
     # 3. MA5 & MA60
-    df['ma5'] = close.rolling(window=5).mean()
-    df['ma60'] = close.rolling(window=60).mean()
+    df['ma5'] = features.ma(5)
+    df['ma60'] = features.ma(60)
     
     # 4. 换手率均值与量比
     df['avg_turnover_30'] = df['换手率'].rolling(window=30).mean()
-    df['vol_ma5'] = df['成交量'].shift(1).rolling(window=5).mean()
+    df['vol_ma5'] = features.prev_vol_ma(5)
     df['vol_ratio'] = df['成交量'] / df['vol_ma5']
     
     return df
 
-def process_single_stock(args):
-    file_path, name_map = args
+def process_single_stock(file_path, name_map):
     stock_code = os.path.basename(file_path).split('.')[0]
     stock_name = name_map.get(stock_code, "未知")
     
@@ -65,10 +71,19 @@ def process_single_stock(args):
         return None
 
     try:
-        df_raw = pd.read_csv(file_path)
+        return analyze_frame(load_stock(file_path), stock_code, stock_name)
+    except:
+        return None
+
+def analyze_frame(df_raw, stock_code, stock_name, features=None):
+    """对已加载的日线执行完整过滤链，命中返回结果行，否则返回 None"""
+    if "ST" in stock_name.upper():
+        return None
+
+    try:
         if len(df_raw) < 60: return None
         
-        df = calculate_indicators(df_raw)
+        df = calculate_indicators(df_raw, features)
         latest = df.iloc[-1]
         prev = df.iloc[-2]  # 获取前一日数据
         
@@ -114,48 +129,311 @@ def process_single_stock(args):
     except:
         return None
 
-def main():
-    now_shanghai = datetime.now(SHANGHAI_TZ)
-    print(f"🚀 【温和进取版】扫描开始... 目标：寻找超跌反弹先锋")
+def scan_vectorized(name_map, lookback=None):
+    """向量化全市场扫描：一次算出所有股票的指标，再对最后两行做与 process_single_stock 相同的过滤
 
-    name_map = {}
-    if os.path.exists(NAME_MAP_FILE):
-        try:
-            n_df = pd.read_csv(NAME_MAP_FILE, dtype={'code': str})
-            name_map = dict(zip(n_df['code'].str.zfill(6), n_df['name']))
-        except:
-            print(f"⚠️ 警告: {NAME_MAP_FILE} 读取失败，将不显示股票名称。")
+    lookback 限制参与计算的最近行数 (滚动均值/EWM 的末位可能与全量历史有 1e-12 量级差异)。
+    """
+    latest = latest_indicators(lookback)
+    if latest is None:
+        return []
+    return select_signals(latest, name_map)
 
-    file_list = glob.glob(os.path.join(STOCK_DATA_DIR, '*.csv'))
-    if not file_list:
-        print(f"❌ 错误: 在 {STOCK_DATA_DIR} 文件夹下未找到CSV数据。")
-        return
+def latest_indicators(lookback=None):
+    """向量化引擎算出的全市场最新一行指标 (每个键一个按股票排列的数组)，没有数据时返回 None"""
+    from indicator_engine import DEFAULT_LOOKBACK, load_market, compute_indicators
 
-    tasks = [(file_path, name_map) for file_path in file_list]
+    market = load_market(lookback=lookback or DEFAULT_LOOKBACK)
+    if not market.symbols:
+        return None
+    ind = compute_indicators(market)
+    f = market.fields
+    return {
+        '代码': market.symbols, '日期': market.last_dates, 'rows': market.lengths,
+        '收盘': f['收盘'][-1], '涨跌幅': f['涨跌幅'][-1],
+        'ma5': ind['ma5'][-1], 'prev_ma5': ind['ma5'][-2], 'ma60': ind['ma60'][-1],
+        'rsi6': ind['rsi6'][-1], 'kdj_k': ind['kdj_k'][-1], 'vol_ratio': ind['vol_ratio'][-1],
+        'avg_turnover_30': ind['avg_turnover_30'][-1],
+    }
 
-    with Pool(processes=cpu_count()) as pool:
-        raw_results = pool.map(process_single_stock, tasks)
+def scan_params():
+    """文件顶部的过滤参数 (每次调用时读取，回放前可直接修改模块常量)"""
+    return {'MIN_PRICE': MIN_PRICE, 'MAX_AVG_TURNOVER_30': MAX_AVG_TURNOVER_30,
+            'MIN_VOLUME_RATIO': MIN_VOLUME_RATIO, 'MAX_VOLUME_RATIO': MAX_VOLUME_RATIO,
+            'RSI6_MAX': RSI6_MAX, 'KDJ_K_MAX': KDJ_K_MAX,
+            'MIN_PROFIT_POTENTIAL': MIN_PROFIT_POTENTIAL, 'MAX_TODAY_CHANGE': MAX_TODAY_CHANGE}
 
-    results = [r for r in raw_results if r is not None]
-        
+def potential_of(v):
+    """距60日线空间 (%)"""
+    close = np.asarray(v['收盘'])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (np.asarray(v['ma60']) - close) / close * 100
+
+def base_condition(v):
+    """过滤链中与参数无关的部分：历史满 60 行，且收在5日线上或5日线拐头向上"""
+    close, ma5, prev_ma5 = np.asarray(v['收盘']), np.asarray(v['ma5']), np.asarray(v['prev_ma5'])
+    with np.errstate(invalid='ignore'):
+        return ~(np.asarray(v['rows']) < 60) & ((close >= ma5) | (ma5 >= prev_ma5))
+
+def param_condition(v, potential, name, value):
+    """单个参数取 value 时通过的格子；写成“非拒绝”，NaN 的处理与逐只版本的 if 判断一致"""
+    with np.errstate(invalid='ignore'):
+        if name == 'MIN_PRICE':
+            return ~(np.asarray(v['收盘']) < value)
+        if name == 'MAX_AVG_TURNOVER_30':
+            return ~(np.asarray(v['avg_turnover_30']) > value)
+        if name == 'MIN_PROFIT_POTENTIAL':
+            return ~(potential < value)
+        if name == 'MAX_TODAY_CHANGE':
+            return ~(np.asarray(v['涨跌幅']) > value)
+        if name == 'RSI6_MAX':
+            return ~(np.asarray(v['rsi6']) > value)
+        if name == 'KDJ_K_MAX':
+            return ~(np.asarray(v['kdj_k']) > value)
+        if name == 'MIN_VOLUME_RATIO':
+            return np.asarray(v['vol_ratio']) >= value
+        if name == 'MAX_VOLUME_RATIO':
+            return np.asarray(v['vol_ratio']) <= value
+    raise KeyError(f"未知参数: {name}")
+
+def signal_mask(v, params=None):
+    """完整过滤链的向量化版本：v 中各数组形状相同 (按股票的一维，或 行 × 股票 的二维)
+
+    params 覆盖 scan_params() 中的部分参数。返回 (命中布尔数组, 距60日线空间%)。
+    """
+    p = scan_params()
+    p.update(params or {})
+    potential = potential_of(v)
+    hit = base_condition(v)
+    for name, value in p.items():
+        hit &= param_condition(v, potential, name, value)
+    return hit, potential
+
+def select_signals(latest, name_map):
+    """对全市场最新一行指标 (每个键一个按股票排列的数组) 做与 analyze_frame 相同的过滤"""
+    hit, potential = signal_mask(latest)
+    close, change = np.asarray(latest['收盘']), np.asarray(latest['涨跌幅'])
+    rsi6, kdj_k, vol_ratio = np.asarray(latest['rsi6']), np.asarray(latest['kdj_k']), np.asarray(latest['vol_ratio'])
+
+    results = []
+    for j in np.flatnonzero(hit):
+        stock_code = latest['代码'][j]
+        stock_name = name_map.get(stock_code, "未知")
+        if "ST" in stock_name.upper():
+            continue
+        results.append({
+            '代码': stock_code,
+            '名称': stock_name,
+            '最新日期': latest['日期'][j],
+            '现价': round(close[j], 2),
+            '今日量比': round(vol_ratio[j], 2),
+            'RSI6': round(rsi6[j], 1),
+            'K值': round(kdj_k[j], 1),
+            '距60日线空间': f"{round(potential[j], 1)}%",
+            '今日涨跌': f"{round(change[j], 1)}%"
+        })
+    return results
+
+def replay_inputs(market):
+    """历史回放的输入：一次算出全部指标，每一行都当作当天的“最新一行”，前一行即“前一日”"""
+    from indicator_engine import compute_indicators
+
+    ind = compute_indicators(market)
+    prev_ma5 = np.full_like(ind['ma5'], np.nan)
+    prev_ma5[1:] = ind['ma5'][:-1]
+    # lookback 只载入了末尾若干行，加上窗口之前的真实行数 (文件总行数 - 载入行数)
+    skipped = np.asarray(market.lengths) - market.valid.sum(axis=0)
+    rows = np.where(market.valid, np.cumsum(market.valid, axis=0) + skipped, 0)
+    return {
+        '收盘': market.fields['收盘'], '涨跌幅': market.fields['涨跌幅'],
+        'ma5': ind['ma5'], 'prev_ma5': prev_ma5, 'ma60': ind['ma60'],
+        'rsi6': ind['rsi6'], 'kdj_k': ind['kdj_k'], 'vol_ratio': ind['vol_ratio'],
+        'avg_turnover_30': ind['avg_turnover_30'],
+        # 截至当天的历史行数，对应逐只版本的 len(df) < 60 门槛
+        'rows': rows,
+    }
+
+def load_replay(lookback=None, fields=None):
+    """回放用的行情与指标，返回 (market, inputs)
+
+    lookback 时在窗口前多读 REPLAY_WARMUP 行，用完整的前缀算出指标后再丢弃，
+    窗口首日起的每一格都与按日截断的全量历史一致，不会因指标尚在预热 (NaN) 而误判。
+    """
+    from indicator_engine import INDICATOR_FIELDS, load_market
+
+    market = load_market(lookback=None if lookback is None else lookback + REPLAY_WARMUP,
+                         fields=fields or INDICATOR_FIELDS)
+    inputs = replay_inputs(market)
+    if lookback is not None and lookback < market.valid.shape[0]:
+        market = market.tail(lookback)
+        inputs = {k: v[-lookback:] for k, v in inputs.items()}
+    return market, inputs
+
+def forward_returns(close, horizons=REPLAY_HORIZONS):
+    """(周期, 行, 股票)：当天收盘买入、持有 h 个交易日后收盘的收益，超出数据末尾为 NaN"""
+    out = np.full((len(horizons),) + close.shape, np.nan)
+    for k, h in enumerate(horizons):
+        if 0 < h < len(close):
+            out[k, :-h] = close[h:] / close[:-h] - 1
+    return out
+
+def replay_signals(market, name_map, params=None, start=None, end=None, horizons=REPLAY_HORIZONS, inputs=None):
+    """按历史每一天回放完整过滤链，返回 (日期, 代码) 一行的信号明细及各周期远期收益
+
+    ST 按 st 股票池快照逐日判定，早于第一次快照的日期沿用当前名称；
+    inputs 为 replay_inputs(market) 的结果，反复调参时传入可省去指标计算。
+    """
+    from universe_history import load_universe
+
+    v = inputs if inputs is not None else replay_inputs(market)
+    hit, potential = signal_mask(v, params)
+    hit &= market.valid
+    dates = market.dates
+    if start:
+        hit &= dates >= int(str(start).replace("-", ""))
+    if end:
+        hit &= dates <= int(str(end).replace("-", ""))
+
+    rows, cols = np.nonzero(hit)
+    codes = np.array(market.symbols, dtype=object)
+    current_st = np.array(["ST" in name_map.get(c, "未知").upper() for c in market.symbols], dtype=bool)
+    st_universe = load_universe('st')
+    if st_universe is None or not len(rows):
+        is_st = current_st[cols]
+    else:
+        is_st = st_universe.eligible(codes[cols], dates[rows, cols], default=current_st[cols])
+    rows, cols = rows[~is_st], cols[~is_st]
+
+    signals = pd.DataFrame({
+        '日期': int_to_dates(dates[rows, cols]),
+        '代码': codes[cols],
+        '名称': [name_map.get(c, "未知") for c in codes[cols]],
+        '收盘': np.round(v['收盘'][rows, cols], 2),
+        '量比': np.round(v['vol_ratio'][rows, cols], 2),
+        'RSI6': np.round(v['rsi6'][rows, cols], 1),
+        'K值': np.round(v['kdj_k'][rows, cols], 1),
+        '距60日线空间': np.round(potential[rows, cols], 1),
+        '涨跌幅': np.round(v['涨跌幅'][rows, cols], 1),
+    })
+    fwd = forward_returns(v['收盘'], horizons)
+    for k, h in enumerate(horizons):
+        signals[f"{h}日收益"] = fwd[k, rows, cols]
+    return signals.sort_values(['日期', '代码'], kind='stable').reset_index(drop=True)
+
+def replay_frame(df, code, name_map=None, params=None, horizons=REPLAY_HORIZONS):
+    """单只股票的历史回放 (一次向量化遍历整段历史)"""
+    from indicator_engine import align_frames
+
+    df = df.sort_values('日期').reset_index(drop=True)
+    return replay_signals(align_frames({code: df}, None), name_map or {}, params, horizons=horizons)
+
+def summarize_replay(signals, horizons=REPLAY_HORIZONS):
+    """回放汇总：{周期: (样本数, 胜率, 均益, 中位数)}，另附按日信号数"""
+    stats = {}
+    for h in horizons:
+        rets = signals[f"{h}日收益"].dropna().values
+        stats[h] = (rets.size, (rets > 0).mean() if rets.size else 0.0,
+                    rets.mean() if rets.size else 0.0, np.median(rets) if rets.size else 0.0)
+    return stats, signals.groupby('日期').size()
+
+def run_replay(name_map, lookback=None, start=None, end=None, horizons=REPLAY_HORIZONS, now_shanghai=None):
+    """读取全市场历史，回放并打印/保存结果"""
+    t0 = datetime.now()
+    market, inputs = load_replay(lookback)
+    if not market.symbols:
+        print("❌ 没有可回放的数据。")
+        return None
+    signals = replay_signals(market, name_map, start=start, end=end, horizons=horizons, inputs=inputs)
+    cost = (datetime.now() - t0).total_seconds()
+    stats, per_day = summarize_replay(signals, horizons)
+
+    rows = market.valid.shape[0]
+    print(f"\n⏪ 历史回放完成: {len(market.symbols)} 只股票 × {rows} 行，耗时 {cost:.1f}s")
+    print(f"   共 {len(signals)} 个信号，分布在 {len(per_day)} 个交易日 (日均 {per_day.mean() if len(per_day) else 0:.1f} 只)")
+    for h, (n, win, avg, med) in stats.items():
+        print(f"   持有 {h:>2} 日: 样本 {n:>6}  胜率 {win*100:5.1f}%  均益 {avg*100:6.2f}%  中位数 {med*100:6.2f}%")
+
+    if len(signals):
+        now_shanghai = now_shanghai or datetime.now(SHANGHAI_TZ)
+        os.makedirs(REPLAY_DIR, exist_ok=True)
+        path = os.path.join(REPLAY_DIR, f"温和精选_回放_{now_shanghai.strftime('%Y%m%d_%H%M%S')}.csv")
+        signals.to_csv(path, index=False, encoding='utf_8_sig')
+        print(f"\n✅ 回放信号明细已保存至 {path}")
+    return signals
+
+def save_results(results, now_shanghai):
+    """排序、打印并按 results/YYYY/MM 保存扫描结果"""
     if results:
         df_result = pd.DataFrame(results)
         # 排序：综合量比和超跌程度排序
         df_result = df_result.sort_values(by=['今日量比', 'RSI6'], ascending=[True, True])
-        
+    
         print(f"\n🎯 扫描完成，筛选出 {len(results)} 只温和超跌标的:")
         print(df_result.to_string(index=False)) 
-        
+    
         date_str = now_shanghai.strftime('%Y%m%d_%H%M%S')
         year_month = now_shanghai.strftime('%Y/%m')
         save_path = f"results/{year_month}"
         os.makedirs(save_path, exist_ok=True)
-        
+    
         file_name = f"温和精选_反弹_{date_str}.csv"
         df_result.to_csv(os.path.join(save_path, file_name), index=False, encoding='utf_8_sig')
         print(f"\n✅ 温和版精选报告已保存至 {save_path}。")
     else:
         print("\n🤔 即使在温和模式下也未找到标的，市场可能处于普跌行情，建议观望。")
 
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="温和进取版超跌反弹扫描")
+    parser.add_argument("--engine", choices=["pool", "vectorized", "incremental"], default="pool",
+                        help="pool: 多进程逐只计算; vectorized: 横截面向量化指标引擎一次算完全市场; "
+                             "incremental: 基于持久化指标状态，每只股票只处理新增 K 线")
+    parser.add_argument("--lookback", type=int, default=None, help="向量化/回放模式参与计算的最近行数")
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE, help="pool 模式每批派发给进程的任务数")
+    parser.add_argument("--replay", action="store_true",
+                        help="历史回放：对每个历史交易日执行完整过滤链，输出逐日信号与远期收益")
+    parser.add_argument("--start", default=None, help="回放起始日期 YYYY-MM-DD")
+    parser.add_argument("--end", default=None, help="回放结束日期 YYYY-MM-DD")
+    parser.add_argument("--horizons", type=int, nargs="+", default=REPLAY_HORIZONS, help="回放统计的持有周期")
+    parser.add_argument("--record", action="store_true", help="把今日信号追加到信号库并补写到期的远期收益")
+    args = parser.parse_args(argv)
+
+    now_shanghai = datetime.now(SHANGHAI_TZ)
+    print(f"🚀 【温和进取版】扫描开始... 目标：寻找超跌反弹先锋")
+
+    name_map = {}
+    if os.path.exists(NAME_MAP_FILE):
+        try:
+            n_df = pd.read_csv(NAME_MAP_FILE, dtype={'code': str})
+            name_map = dict(zip(n_df['code'].str.zfill(6), n_df['name']))
+        except:
+            print(f"⚠️ 警告: {NAME_MAP_FILE} 读取失败，将不显示股票名称。")
+
+    file_list = glob.glob(os.path.join(STOCK_DATA_DIR, '*.csv'))
+    if not file_list:
+        print(f"❌ 错误: 在 {STOCK_DATA_DIR} 文件夹下未找到CSV数据。")
+        return
+
+    if args.replay:
+        run_replay(name_map, args.lookback, args.start, args.end, args.horizons, now_shanghai)
+        return
+    if args.engine == "vectorized":
+        results = scan_vectorized(name_map, args.lookback)
+    elif args.engine == "incremental":
+        from indicator_state import IndicatorStateStore
+
+        store = IndicatorStateStore()
+        results = select_signals(store.refresh_all(), name_map)
+        store.save()
+    else:
+        raw_results = run_parallel(process_single_stock, file_list, shared=(name_map,), chunksize=args.chunksize)
+        results = [r for r in raw_results if r is not None]
+        
+    save_results(results, now_shanghai)
+    if args.record:
+        from signal_store import record_results
+
+        added, filled = record_results("scan", results, args.horizons, date_key='最新日期')
+        print(f"📒 信号库: 新增信号 {added} 个，补写收益 {filled} 条")
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,535 @@
+import os
+import re
+import sys
+import time
+import argparse
+import operator
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+from datetime import datetime
+
+# ==========================================
+# 声明式选股表达式
+# 例: close between 5 and 20 and rsi6 < 35 and vol_ratio in [0.2, 1.15] and not name contains "ST"
+# 表达式解析一次后编译成 numpy 布尔运算，直接作用在全市场特征数组上 (最新一行，或 --history 的 行 × 股票 全历史)。
+# 顶层 and 的各子句先在小样本上估计通过率，按选择性从强到弱依次执行，后面的子句只计算仍存活的格子；
+# explain 输出每个子句剔除了多少只股票。
+# 比较遇到 NaN 一律为 False，所以 "not rsi6 > 35" 会放过 NaN，而 "rsi6 <= 35" 不会 (与扫描脚本的 if 判断对应)。
+# 编译时做类型检查：代码/名称是文本，只能 contains / startswith；比较、算术、between / in 只接受数值，
+# 例如 'name > 5' 或 'close > "a"' 在执行前就报错并指出出错子句的位置。
+# ==========================================
+
+SAMPLE_SIZE = 512               # 估计子句通过率的样本格子数
+SEED = 20240101
+SCREEN_RESULTS_DIR = os.path.join("results", "screen")
+
+# 英文字段名 -> 特征数组的键；未列出的名字按原样查找 (也可以直接写中文列名)
+FIELD_ALIASES = {
+    'code': '代码', 'name': '名称', 'close': '收盘', 'change': '涨跌幅', 'pct': '涨跌幅',
+}
+TEXT_FIELDS = ['代码', '名称']
+NUMERIC_FIELDS = ['收盘', '涨跌幅', 'rows', 'ma5', 'prev_ma5', 'ma60', 'rsi6', 'kdj_k',
+                  'vol_ratio', 'avg_turnover_30', 'potential']
+TOKEN_NAMES = {'num': '数值', 'str': '带引号的字符串', 'name': '字段名', 'op': '运算符'}
+
+# 常用筛选，mild_rebound 与温和进取版扫描的过滤链逐项等价
+PRESETS = {
+    'mild_rebound': ('rows >= 60 and close >= 5 and not avg_turnover_30 > 4.5 and not potential < 10 '
+                     'and not change > 5 and not rsi6 > 35 and not kdj_k > 45 '
+                     'and (close >= ma5 or ma5 >= prev_ma5) and vol_ratio in [0.2, 1.15] '
+                     'and not name contains "ST"'),
+    'deep_oversold': 'rows >= 60 and close between 5 and 20 and rsi6 < 20 and kdj_k < 20 and not name contains "ST"',
+}
+
+KEYWORDS = {'and', 'or', 'not', 'between', 'in', 'contains', 'startswith'}
+COMPARATORS = {'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge,
+               '==': operator.eq, '!=': operator.ne}
+ARITHMETIC = {'+': operator.add, '-': operator.sub, '*': operator.mul, '/': operator.truediv}
+BOOLEAN_NODES = ('or', 'and', 'not', 'cmp', 'range', 'text')
+
+TOKEN_RE = re.compile(r'''\s*(?:
+    (?P<num>(?:\d+(?:\.\d*)?|\.\d+))
+  | (?P<str>"[^"]*"|'[^']*')
+  | (?P<op><=|>=|==|!=|<|>|[-+*/(),\[\]])
+  | (?P<name>[^\W\d]\w*)
+)''', re.VERBOSE)
+
+class ScreenError(ValueError):
+    """表达式语法错误或引用了不存在的字段"""
+
+def _tokenize(source):
+    tokens, pos = [], 0
+    source = source.rstrip()
+    while pos < len(source):
+        m = TOKEN_RE.match(source, pos)
+        if not m:
+            pos += len(source[pos:]) - len(source[pos:].lstrip())
+            raise ScreenError(f"无法识别的字符 (位置 {pos}):\n  {source}\n  {' ' * pos}^")
+        kind = m.lastgroup
+        text, start = m.group(kind), m.start(kind)
+        if kind == 'name' and text.lower() in KEYWORDS:
+            kind, text = 'kw', text.lower()
+        tokens.append((kind, text, start, m.end()))
+        pos = m.end()
+    return tokens
+
+def _error_at(source, pos, message):
+    return ScreenError(f"{message} (位置 {pos}):\n  {source}\n  {' ' * pos}^")
+
+class _Parser:
+    """递归下降：or > and > not > 比较 > 加减 > 乘除 > 原子；节点为 (类型, (起, 止), 参数...)"""
+
+    def __init__(self, source):
+        self.source = source
+        self.tokens = _tokenize(source)
+        self.i = 0
+
+    def error(self, message):
+        pos = self.tokens[self.i][2] if self.i < len(self.tokens) else len(self.source.rstrip())
+        raise _error_at(self.source, pos, message)
+
+    def peek(self, kind, *texts):
+        if self.i >= len(self.tokens):
+            return False
+        k, t = self.tokens[self.i][:2]
+        return k == kind and (not texts or t in texts)
+
+    def take(self, kind, *texts):
+        if not self.peek(kind, *texts):
+            self.error(f"需要 {' / '.join(texts) or TOKEN_NAMES.get(kind, kind)}")
+        self.i += 1
+        return self.tokens[self.i - 1][1]
+
+    def span(self, start):
+        """第 start 个 token 到上一个已消费 token 的源码区间"""
+        return (self.tokens[start][2], self.tokens[self.i - 1][3])
+
+    def parse(self):
+        if not self.tokens:
+            raise ScreenError("表达式为空")
+        node = self.parse_or()
+        if self.i < len(self.tokens):
+            self.error("多余的内容")
+        if node[0] not in BOOLEAN_NODES:
+            raise ScreenError("表达式的结果必须是条件 (比较、between、in、contains 等)")
+        return node
+
+    def parse_or(self):
+        start = self.i
+        children = [self.parse_and()]
+        while self.peek('kw', 'or'):
+            self.take('kw')
+            children.append(self.parse_and())
+        return children[0] if len(children) == 1 else ('or', self.span(start), children)
+
+    def parse_and(self):
+        start = self.i
+        children = [self.parse_not()]
+        while self.peek('kw', 'and'):
+            self.take('kw')
+            children.append(self.parse_not())
+        return children[0] if len(children) == 1 else ('and', self.span(start), children)
+
+    def parse_not(self):
+        start = self.i
+        if self.peek('kw', 'not'):
+            self.take('kw')
+            child = self.parse_not()
+            return ('not', self.span(start), child)
+        if self.peek('op', '('):
+            # 括号既可能包住条件，也可能是算术分组 (如 (ma5 - ma60) / ma60 > 0.1)：先按条件解析，不成再回退
+            saved = self.i
+            try:
+                self.take('op')
+                node = self.parse_or()
+                self.take('op', ')')
+                if node[0] in BOOLEAN_NODES and not self.peek('op', *COMPARATORS, '+', '-', '*', '/'):
+                    return node
+            except ScreenError:
+                pass
+            self.i = saved
+        return self.parse_comparison()
+
+    def parse_comparison(self):
+        start = self.i
+        left = self.parse_sum()
+        if self.peek('op', *COMPARATORS):
+            op = self.take('op')
+            right = self.parse_sum()
+            return ('cmp', self.span(start), op, left, right)
+        if self.peek('kw', 'between'):
+            self.take('kw')
+            low = self.parse_sum()
+            self.take('kw', 'and')
+            high = self.parse_sum()
+            return ('range', self.span(start), left, low, high)
+        if self.peek('kw', 'in'):
+            self.take('kw')
+            self.take('op', '[')
+            low = self.parse_sum()
+            self.take('op', ',')
+            high = self.parse_sum()
+            self.take('op', ']')
+            return ('range', self.span(start), left, low, high)
+        if self.peek('kw', 'contains', 'startswith'):
+            op = self.take('kw')
+            text = self.take('str')[1:-1]
+            return ('text', self.span(start), op, left, text)
+        self.error("需要比较运算 (< <= > >= == != between in contains startswith)")
+
+    def parse_sum(self):
+        start = self.i
+        node = self.parse_product()
+        while self.peek('op', '+', '-'):
+            op = self.take('op')
+            right = self.parse_product()
+            node = ('arith', self.span(start), op, node, right)
+        return node
+
+    def parse_product(self):
+        start = self.i
+        node = self.parse_atom()
+        while self.peek('op', '*', '/'):
+            op = self.take('op')
+            right = self.parse_atom()
+            node = ('arith', self.span(start), op, node, right)
+        return node
+
+    def parse_atom(self):
+        start = self.i
+        if self.peek('num'):
+            value = float(self.take('num'))
+            return ('const', self.span(start), value)
+        if self.peek('str'):
+            value = self.take('str')[1:-1]
+            return ('const', self.span(start), value)
+        if self.peek('name'):
+            name = self.take('name')
+            return ('field', self.span(start), FIELD_ALIASES.get(name.lower(), name))
+        if self.peek('op', '-'):
+            self.take('op')
+            operand = self.parse_atom()
+            return ('neg', self.span(start), operand)
+        if self.peek('op', '('):
+            self.take('op')
+            node = self.parse_sum()
+            self.take('op', ')')
+            return node
+        self.error("需要数值、字符串或字段名")
+
+def _fields_of(node):
+    if node[0] == 'field':
+        return {node[2]}
+    out = set()
+    for arg in node[2:]:
+        for child in (arg if isinstance(arg, list) else [arg]):
+            if isinstance(child, tuple):
+                out |= _fields_of(child)
+    return out
+
+def _type_of(node, source):
+    """推断节点类型 ('num' / 'text' / 'bool')，类型不匹配时抛出指向该子句的 ScreenError"""
+    kind = node[0]
+    if kind == 'const':
+        return 'text' if isinstance(node[2], str) else 'num'
+    if kind == 'field':
+        return 'text' if node[2] in TEXT_FIELDS else 'num'
+
+    def expect(child, wanted, message):
+        if _type_of(child, source) != wanted:
+            raise _error_at(source, child[1][0], message)
+
+    if kind == 'neg':
+        expect(node[2], 'num', "取负只能用于数值")
+        return 'num'
+    if kind == 'arith':
+        for child in node[3:5]:
+            expect(child, 'num', f"算术运算 {node[2]} 只能用于数值")
+        return 'num'
+    if kind == 'cmp':
+        for child in node[3:5]:
+            expect(child, 'num', f"比较 {node[2]} 只能用于数值 (文本请用 contains / startswith)")
+        return 'bool'
+    if kind == 'range':
+        for child in node[2:5]:
+            expect(child, 'num', "between / in 只能用于数值")
+        return 'bool'
+    if kind == 'text':
+        expect(node[3], 'text', f"{node[2]} 只能用于文本字段 ({' / '.join(TEXT_FIELDS)})")
+        return 'bool'
+    for child in (node[2] if kind in ('and', 'or') else [node[2]]):
+        expect(child, 'bool', f"{kind} 的操作数必须是条件")
+    return 'bool'
+
+def _compile(node):
+    """节点 -> fn(env)，env[字段] 返回 (可能已按存活格子取子集的) 一维数组"""
+    kind = node[0]
+    if kind == 'const':
+        value = node[2]
+        return lambda env: value
+    if kind == 'field':
+        name = node[2]
+        return lambda env: env[name]
+    if kind == 'neg':
+        operand = _compile(node[2])
+        return lambda env: -operand(env)
+    if kind == 'arith':
+        fn, left, right = ARITHMETIC[node[2]], _compile(node[3]), _compile(node[4])
+
+        def arith(env):
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return fn(left(env), right(env))
+        return arith
+    if kind == 'cmp':
+        fn, left, right = COMPARATORS[node[2]], _compile(node[3]), _compile(node[4])
+
+        def compare(env):
+            with np.errstate(invalid='ignore'):
+                return fn(left(env), right(env))
+        return compare
+    if kind == 'range':
+        value, low, high = _compile(node[2]), _compile(node[3]), _compile(node[4])
+
+        def in_range(env):
+            x = value(env)
+            with np.errstate(invalid='ignore'):
+                return (x >= low(env)) & (x <= high(env))
+        return in_range
+    if kind == 'text':
+        op, value, text = node[2], _compile(node[3]), node[4]
+
+        def text_match(env):
+            x = np.asarray(value(env)).astype(str)
+            return np.char.find(x, text) >= 0 if op == 'contains' else np.char.startswith(x, text)
+        return text_match
+    if kind == 'not':
+        child = _compile(node[2])
+        return lambda env: ~np.asarray(child(env), dtype=bool)
+    children = [_compile(c) for c in node[2]]
+    combine = np.logical_and if kind == 'and' else np.logical_or
+
+    def reduce(env):
+        out = np.asarray(children[0](env), dtype=bool)
+        for child in children[1:]:
+            out = combine(out, child(env))
+        return out
+    return reduce
+
+class _Subset:
+    """按存活格子取子集的只读特征视图，每个字段只取一次"""
+
+    def __init__(self, columns, idx=None):
+        self.columns = columns
+        self.idx = idx
+        self.cache = {}
+
+    def __getitem__(self, name):
+        if name not in self.cache:
+            column = self.columns[name]
+            self.cache[name] = column if self.idx is None else column[self.idx]
+        return self.cache[name]
+
+class Screen:
+    """解析一次、可反复执行的筛选表达式：顶层 and 拆成子句，按样本通过率从低到高依次执行"""
+
+    def __init__(self, source):
+        self.source = source.strip()
+        tree = _Parser(self.source).parse()
+        _type_of(tree, self.source)
+        conjuncts = tree[2] if tree[0] == 'and' else [tree]
+        self.clauses = [(self.source[c[1][0]:c[1][1]], _compile(c)) for c in conjuncts]
+        self.fields = sorted(_fields_of(tree))
+
+    def _columns(self, features):
+        missing = [f for f in self.fields if f not in features]
+        if missing:
+            raise ScreenError(f"未知字段: {', '.join(missing)}；可用字段: "
+                              f"{', '.join(list(FIELD_ALIASES) + NUMERIC_FIELDS)}")
+        arrays = {f: np.asarray(features[f]) for f in self.fields}
+        shape = np.broadcast_shapes(np.shape(features['代码']), *(a.shape for a in arrays.values()))
+        return shape, {f: np.broadcast_to(a, shape).ravel() for f, a in arrays.items()}
+
+    def explain(self, features, seed=SEED, valid=None):
+        """执行筛选，返回 (与特征同形状的布尔掩码, 每个子句的执行记录)
+
+        valid 为与特征同形状的布尔掩码时只在其中为 True 的格子上执行 (如全历史模式剔除底部对齐的填充格)。
+        """
+        shape, columns = self._columns(features)
+        n = int(np.prod(shape))
+        idx = np.arange(n) if valid is None else np.flatnonzero(np.broadcast_to(valid, shape))
+        sample = np.sort(np.random.default_rng(seed).choice(idx, size=min(SAMPLE_SIZE, len(idx)), replace=False))
+        sample_view = _Subset(columns, sample)
+        rates = []
+        for text, fn in self.clauses:
+            passed = np.broadcast_to(fn(sample_view), sample.shape)
+            rates.append(passed.mean() if len(sample) else 1.0)
+        order = np.argsort(rates, kind='stable')
+
+        steps = []
+        for k in order:
+            text, fn = self.clauses[k]
+            before = len(idx)
+            t0 = time.perf_counter()
+            if before:
+                idx = idx[np.broadcast_to(fn(_Subset(columns, idx)), idx.shape)]
+            steps.append({'子句': text, '样本通过率': rates[k], '执行前': before, '剔除': before - len(idx),
+                          '剩余': len(idx), '耗时ms': (time.perf_counter() - t0) * 1000})
+        mask = np.zeros(n, dtype=bool)
+        mask[idx] = True
+        return mask.reshape(shape), steps
+
+    def run(self, features):
+        return self.explain(features)[0]
+
+@lru_cache(maxsize=64)
+def compile_screen(source):
+    """同一表达式只解析编译一次"""
+    return Screen(PRESETS.get(source, source))
+
+def print_explain(screen, steps, unit="只"):
+    total = steps[0]['执行前'] if steps else 0
+    left = steps[-1]['剩余'] if steps else 0
+    print(f"\n📋 执行计划 ({total} → {left} {unit}，按样本通过率从低到高):")
+    for k, step in enumerate(steps, 1):
+        print(f"  {k:>2}. {step['子句']:<40} 样本通过 {step['样本通过率'] * 100:5.1f}%  "
+              f"{step['执行前']:>8} → {step['剩余']:<8} 剔除 {step['剔除']:<8} {step['耗时ms']:.2f}ms")
+
+def latest_features(name_map, engine="incremental", lookback=None):
+    """全市场最新一行特征：incremental 读持久化指标状态 (毫秒级)，vectorized 用横截面引擎现算"""
+    import stock_scanner_go_mini as scanner
+
+    if engine == "incremental":
+        from indicator_state import IndicatorStateStore
+
+        store = IndicatorStateStore()
+        features = store.refresh_all()
+        store.save()
+    else:
+        features = scanner.latest_indicators(lookback)
+        if features is None:
+            return None
+    features = {k: np.asarray(v) if k != '代码' else np.array(v, dtype=object) for k, v in features.items()}
+    features['名称'] = np.array([name_map.get(c, "未知") for c in features['代码']], dtype=object)
+    features['potential'] = scanner.potential_of(features)
+    return features
+
+def history_features(name_map, lookback=None):
+    """(行 × 股票) 全历史特征，每一行当作当天的最新一行；另返回对齐后的市场数据"""
+    import stock_scanner_go_mini as scanner
+
+    market, features = scanner.load_replay(lookback)
+    if not market.symbols:
+        return None, None
+    features['代码'] = np.array(market.symbols, dtype=object)
+    features['名称'] = np.array([name_map.get(c, "未知") for c in market.symbols], dtype=object)
+    features['potential'] = scanner.potential_of(features)
+    return features, market
+
+def screen_latest(expression, name_map, engine="incremental", lookback=None, explain=True):
+    """对全市场最新一行执行筛选，返回命中的 DataFrame"""
+    t0 = time.perf_counter()
+    features = latest_features(name_map, engine, lookback)
+    if features is None or not len(features['代码']):
+        print("❌ 没有可筛选的数据。")
+        return pd.DataFrame()
+    screen = compile_screen(expression)
+    t1 = time.perf_counter()
+    mask, steps = screen.explain(features)
+    t2 = time.perf_counter()
+    if explain:
+        print_explain(screen, steps)
+    print(f"\n⚡ 特征准备 {(t1 - t0) * 1000:.0f}ms，筛选 {(t2 - t1) * 1000:.1f}ms，命中 {int(mask.sum())} / {len(mask)} 只")
+
+    hits = np.flatnonzero(mask)
+    out = pd.DataFrame({'代码': features['代码'][hits], '名称': features['名称'][hits],
+                        '日期': np.asarray(features['日期'], dtype=object)[hits]})
+    for f in NUMERIC_FIELDS:
+        if f in screen.fields or f == '收盘':
+            out[f] = np.round(np.asarray(features[f], dtype=float)[hits], 2)
+    return out
+
+def screen_history(expression, name_map, lookback=None, start=None, end=None, explain=True):
+    """对每个历史交易日执行筛选，返回 (日期, 代码) 命中明细及远期收益"""
+    from stock_scanner_go_mini import REPLAY_HORIZONS, forward_returns, summarize_replay
+    from stock_storage import int_to_dates
+
+    features, market = history_features(name_map, lookback)
+    if features is None:
+        print("❌ 没有可筛选的数据。")
+        return pd.DataFrame()
+    screen = compile_screen(expression)
+    t0 = time.perf_counter()
+    mask, steps = screen.explain(features, valid=market.valid)
+    if start:
+        mask &= market.dates >= int(str(start).replace("-", ""))
+    if end:
+        mask &= market.dates <= int(str(end).replace("-", ""))
+    cost = time.perf_counter() - t0
+    if explain:
+        print_explain(screen, steps, unit="格")
+
+    rows, cols = np.nonzero(mask)
+    out = pd.DataFrame({'日期': int_to_dates(market.dates[rows, cols]), '代码': features['代码'][cols],
+                        '名称': features['名称'][cols], '收盘': np.round(features['收盘'][rows, cols], 2)})
+    fwd = forward_returns(features['收盘'], REPLAY_HORIZONS)
+    for k, h in enumerate(REPLAY_HORIZONS):
+        out[f"{h}日收益"] = fwd[k, rows, cols]
+    out = out.sort_values(['日期', '代码'], kind='stable').reset_index(drop=True)
+
+    stats, per_day = summarize_replay(out)
+    print(f"\n⏪ {len(market.symbols)} 只股票 × {mask.shape[0]} 行，筛选 {cost * 1000:.0f}ms，"
+          f"命中 {len(out)} 个 (日期, 股票)，分布在 {len(per_day)} 个交易日")
+    for h, (n, win, avg, med) in stats.items():
+        print(f"   持有 {h:>2} 日: 样本 {n:>6}  胜率 {win*100:5.1f}%  均益 {avg*100:6.2f}%  中位数 {med*100:6.2f}%")
+    return out
+
+def load_name_map(path="stock_names.csv"):
+    if not os.path.exists(path):
+        return {}
+    names_df = pd.read_csv(path, dtype={'code': str})
+    return dict(zip(names_df['code'].str.zfill(6), names_df['name']))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="声明式选股表达式",
+        epilog="预设: " + "; ".join(f"{k} = {v}" for k, v in PRESETS.items()))
+    parser.add_argument("expression", help="筛选表达式，或预设名")
+    parser.add_argument("--engine", choices=["incremental", "vectorized"], default="incremental",
+                        help="最新一行特征的来源: incremental 持久化指标状态; vectorized 横截面引擎现算")
+    parser.add_argument("--lookback", type=int, default=None, help="vectorized / history 参与计算的最近行数")
+    parser.add_argument("--history", action="store_true", help="对每个历史交易日执行筛选并统计远期收益")
+    parser.add_argument("--start", default=None, help="history 起始日期 YYYY-MM-DD")
+    parser.add_argument("--end", default=None, help="history 结束日期 YYYY-MM-DD")
+    parser.add_argument("--quiet", action="store_true", help="不打印执行计划")
+    parser.add_argument("--save", action="store_true", help=f"结果另存到 {SCREEN_RESULTS_DIR}")
+    args = parser.parse_args(argv)
+
+    try:
+        compile_screen(args.expression)
+    except ScreenError as e:
+        print(f"❌ 表达式错误: {e}")
+        sys.exit(2)
+
+    name_map = load_name_map()
+    try:
+        if args.history:
+            result = screen_history(args.expression, name_map, args.lookback, args.start, args.end, not args.quiet)
+        else:
+            result = screen_latest(args.expression, name_map, args.engine, args.lookback, not args.quiet)
+            if len(result):
+                print(result.to_string(index=False))
+    except ScreenError as e:
+        print(f"❌ {e}")
+        sys.exit(2)
+
+    if args.save and len(result):
+        os.makedirs(SCREEN_RESULTS_DIR, exist_ok=True)
+        kind = "history" if args.history else "latest"
+        path = os.path.join(SCREEN_RESULTS_DIR, f"screen_{kind}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
+        result.to_csv(path, index=False, encoding='utf_8_sig')
+        print(f"\n✅ 结果已保存至 {path}")
+    return result
+
+if __name__ == "__main__":
+    main()
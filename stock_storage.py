@@ -0,0 +1,311 @@
+import os
+import re
+import sys
+import json
+import glob
+import io
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+# ==========================================
+# 日线数据存储后端
+# stock_data/*.csv 是下载脚本维护的原始数据；二进制后端按列存储同样的数据，
+# 扫描脚本通过 load_stock() 读取，二进制文件不存在或比 CSV 旧时自动回退到 CSV。
+# ==========================================
+
+STOCK_DATA_DIR = "stock_data"
+BIN_DATA_DIR = "stock_data_bin"
+STORAGE_BACKEND = os.environ.get("STOCK_STORAGE_BACKEND", "auto")  # auto / csv / bin / parquet
+
+TARGET_COLUMNS = ['日期', '股票代码', '开盘', '收盘', '最高', '最低', '成交量', '成交额', '振幅', '涨跌幅', '涨跌额', '换手率']
+# 两位小数的价格类字段用 float32 存储，读取时 round(2) 还原为与 CSV 解析完全相同的 float64
+PRICE_FIELDS = ['开盘', '收盘', '最高', '最低', '振幅', '涨跌幅', '涨跌额', '换手率']
+SYMBOL_PATTERN = re.compile(r"^\d{6}$")
+
+# 日期字符串缓存: 已排序的 int 日期与对应的 'YYYY-MM-DD' 字符串 (全市场只有几千个不同交易日)
+_date_keys = np.empty(0, dtype=np.int32)
+_date_strs = np.empty(0, dtype=object)
+
+def dates_to_int(dates):
+    """'YYYY-MM-DD' 字符串序列 -> int32 YYYYMMDD"""
+    s = pd.Series(dates).astype(str).str.replace("-", "", regex=False)
+    return s.astype(np.int32).values
+
+def int_to_dates(values):
+    """int32 YYYYMMDD -> 'YYYY-MM-DD' 字符串数组，通过缓存表二分查找向量化完成"""
+    global _date_keys, _date_strs
+    values = np.asarray(values, dtype=np.int32)
+    idx = np.searchsorted(_date_keys, values)
+    hit = (idx < len(_date_keys)) & (_date_keys[np.minimum(idx, len(_date_keys) - 1)] == values) \
+        if len(_date_keys) else np.zeros(len(values), dtype=bool)
+    if not hit.all():
+        keys = np.union1d(_date_keys, values[~hit]).astype(np.int32)
+        _date_strs = np.array([f"{v // 10000:04d}-{v // 100 % 100:02d}-{v % 100:02d}" for v in keys.tolist()],
+                              dtype=object)
+        _date_keys = keys
+        idx = np.searchsorted(_date_keys, values)
+    return _date_strs[idx]
+
+def symbol_of(path_or_code):
+    """从文件路径或代码中取出 6 位股票代码"""
+    return os.path.splitext(os.path.basename(str(path_or_code)))[0]
+
+def frame_to_arrays(df):
+    """DataFrame (TARGET_COLUMNS 格式) -> 按列的紧凑 numpy 数组
+
+    float32 无法无损还原的字段 (例如小数位异常的旧数据) 保留 float64。
+    """
+    arrays = {'日期': dates_to_int(df['日期'])}
+    for col in TARGET_COLUMNS[2:]:
+        if col not in df.columns:
+            continue
+        values = pd.to_numeric(df[col], errors='coerce').values.astype(np.float64)
+        if col in PRICE_FIELDS:
+            packed = values.astype(np.float32)
+            if np.array_equal(np.round(packed.astype(np.float64), 2), values, equal_nan=True):
+                values = packed
+        elif col == '成交量' and not np.isnan(values).any() and (values == np.round(values)).all():
+            values = values.astype(np.int32 if np.abs(values).max(initial=0) < 2 ** 31 else np.int64)
+        arrays[col] = values
+    return arrays
+
+def arrays_to_frame(code, arrays, columns=None):
+    """按列数组 -> 与 pd.read_csv 结果数值一致的 DataFrame"""
+    wanted = columns or TARGET_COLUMNS
+    data = {}
+    for col in wanted:
+        if col == '日期':
+            data[col] = int_to_dates(arrays['日期'])
+        elif col == '股票代码':
+            data[col] = np.full(len(arrays['日期']), code, dtype=object)
+        elif col in arrays:
+            values = arrays[col]
+            if values.dtype == np.float32:
+                values = np.round(values.astype(np.float64), 2)
+            elif values.dtype.kind == 'i':
+                values = values.astype(np.int64)
+            data[col] = values
+    return pd.DataFrame(data, columns=[c for c in wanted if c in data])
+
+class CsvBackend:
+    """原始 CSV 存储 (下载脚本直接写入)"""
+    name = "csv"
+    ext = ".csv"
+
+    def __init__(self, root=STOCK_DATA_DIR):
+        self.root = root
+
+    def path(self, code):
+        return os.path.join(self.root, f"{code}{self.ext}")
+
+    def read(self, code, columns=None):
+        return pd.read_csv(self.path(code), usecols=columns)
+
+    def write(self, code, df):
+        df.to_csv(self.path(code), index=False, encoding='utf-8')
+
+class BinBackend(CsvBackend):
+    """按列的 numpy 类型化数组：int32 日期 + float32 价格，连续存放在单个 .bin 文件中
+
+    文件结构: 魔数 + 4 字节头长度 + JSON 头 (列名/类型/偏移/行数) + 各列原始字节。
+    读取时一次 read，再用 np.frombuffer 零拷贝切出各列。
+    """
+    name = "bin"
+    ext = ".bin"
+    MAGIC = b"STKCOL1\n"
+
+    def __init__(self, root=BIN_DATA_DIR):
+        self.root = root
+
+    def read_arrays(self, code):
+        with open(self.path(code), 'rb') as f:
+            buf = f.read()
+        if not buf.startswith(self.MAGIC):
+            raise ValueError(f"{self.path(code)} 不是有效的列存文件")
+        pos = len(self.MAGIC)
+        header_len = int.from_bytes(buf[pos:pos + 4], 'little')
+        header = json.loads(buf[pos + 4:pos + 4 + header_len])
+        base = pos + 4 + header_len
+        n = header['rows']
+        return {c['name']: np.frombuffer(buf, dtype=c['dtype'], count=n, offset=base + c['offset'])
+                for c in header['columns']}
+
+    def read(self, code, columns=None):
+        return arrays_to_frame(code, self.read_arrays(code), columns)
+
+    def write(self, code, df):
+        os.makedirs(self.root, exist_ok=True)
+        arrays = frame_to_arrays(df)
+        columns, offset = [], 0
+        for name, values in arrays.items():
+            columns.append({'name': name, 'dtype': values.dtype.str, 'offset': offset})
+            offset += values.nbytes
+        header = json.dumps({'rows': len(arrays['日期']), 'columns': columns}).encode('utf-8')
+        tmp_path = self.path(code) + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(self.MAGIC)
+            f.write(len(header).to_bytes(4, 'little'))
+            f.write(header)
+            for values in arrays.values():
+                f.write(np.ascontiguousarray(values).tobytes())
+        os.replace(tmp_path, self.path(code))
+
+class ParquetBackend(CsvBackend):
+    """Parquet 列式存储 (需要安装 pyarrow)"""
+    name = "parquet"
+    ext = ".parquet"
+
+    def __init__(self, root=BIN_DATA_DIR):
+        self.root = root
+
+    def read(self, code, columns=None):
+        df = pd.read_parquet(self.path(code), columns=columns)
+        if '日期' in df.columns:
+            df['日期'] = int_to_dates(df['日期'].values)
+        return df
+
+    def write(self, code, df):
+        os.makedirs(self.root, exist_ok=True)
+        df = df[[c for c in TARGET_COLUMNS if c in df.columns]].copy()
+        df['日期'] = dates_to_int(df['日期'])
+        df['股票代码'] = code
+        for col in PRICE_FIELDS:
+            if col in df.columns:
+                df[col] = df[col].astype(np.float64)
+        tmp_path = self.path(code) + ".tmp"
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, self.path(code))
+
+BACKENDS = {"csv": CsvBackend, "bin": BinBackend, "parquet": ParquetBackend}
+
+def get_backend(name=None):
+    name = name or STORAGE_BACKEND
+    if name == "auto":
+        name = "bin"
+    if name not in BACKENDS:
+        raise ValueError(f"未知存储后端: {name} (可选 {', '.join(BACKENDS)})")
+    return BACKENDS[name]()
+
+def list_symbols(data_dir=STOCK_DATA_DIR):
+    """列出数据目录中的全部股票代码 (排除名单等非行情文件)"""
+    codes = [symbol_of(p) for p in glob.glob(os.path.join(data_dir, "*.csv"))]
+    return sorted(c for c in codes if SYMBOL_PATTERN.match(c))
+
+def load_stock(path_or_code, columns=None, backend=None):
+    """读取单只股票日线，所有扫描脚本的统一入口
+
+    auto 模式下二进制文件存在且不比 CSV 旧时读二进制，否则读 CSV；
+    传入的路径不是行情文件 (如名单 CSV) 时按原样读 CSV。
+    """
+    name = backend or STORAGE_BACKEND
+    code = symbol_of(path_or_code)
+    csv_path = path_or_code if str(path_or_code).endswith(".csv") else CsvBackend().path(code)
+    if name == "csv" or not SYMBOL_PATTERN.match(code):
+        return pd.read_csv(csv_path, usecols=columns)
+
+    store = get_backend(name)
+    bin_path = store.path(code)
+    if name == "auto":
+        if not os.path.exists(bin_path) or (
+                os.path.exists(csv_path) and os.path.getmtime(bin_path) < os.path.getmtime(csv_path)):
+            return pd.read_csv(csv_path, usecols=columns)
+    return store.read(code, columns)
+
+def read_csv_tail(csv_path, n_rows, block_size=8192):
+    """只读取 CSV 表头和末尾 n_rows 行，耗时与历史长度无关 (文件行数不足时返回全部)"""
+    with open(csv_path, 'rb') as f:
+        header = f.readline()
+        body_start = f.tell()
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        block = block_size
+        while True:
+            start = max(body_start, size - block)
+            f.seek(start)
+            chunk = f.read(size - start)
+            lines = chunk.splitlines()
+            if start == body_start:
+                break
+            lines = lines[1:]  # 第一行可能被截断
+            if len(lines) >= n_rows:
+                break
+            block *= 2
+    lines = [l for l in lines if l.strip()][-n_rows:]
+    return pd.read_csv(io.BytesIO(header + b"\n".join(lines) + b"\n"))
+
+def migrate_csv_dir(src_dir=STOCK_DATA_DIR, backend="bin", force=False):
+    """一次性把 stock_data/*.csv 转成二进制后端；默认只转换比二进制新的文件，可每日增量执行"""
+    src = CsvBackend(src_dir)
+    dst = get_backend(backend)
+    converted, skipped, failed = 0, 0, 0
+    for code in list_symbols(src_dir):
+        csv_path, bin_path = src.path(code), dst.path(code)
+        if not force and os.path.exists(bin_path) and os.path.getmtime(bin_path) >= os.path.getmtime(csv_path):
+            skipped += 1
+            continue
+        try:
+            df = src.read(code)
+            if df.empty:
+                skipped += 1
+                continue
+            dst.write(code, df)
+            converted += 1
+        except Exception as e:
+            print(f"转换失败 {code}: {e}")
+            failed += 1
+    print(f"✅ 迁移完成 ({dst.name}): 转换 {converted}，跳过 {skipped}，失败 {failed}")
+    return converted
+
+def benchmark(src_dir=STOCK_DATA_DIR, backend="bin", limit=500):
+    """对比 CSV 与二进制后端的读取耗时和磁盘占用"""
+    src = CsvBackend(src_dir)
+    dst = get_backend(backend)
+    codes = [c for c in list_symbols(src_dir) if os.path.exists(dst.path(c))][:limit]
+    if not codes:
+        print(f"❌ {dst.root} 中没有可对比的数据，请先执行 migrate。")
+        return None
+
+    t0 = time.perf_counter()
+    for code in codes:
+        src.read(code)
+    csv_time = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for code in codes:
+        dst.read(code)
+    bin_time = time.perf_counter() - t0
+
+    csv_size = sum(os.path.getsize(src.path(c)) for c in codes)
+    bin_size = sum(os.path.getsize(dst.path(c)) for c in codes)
+    result = {
+        "symbols": len(codes), "backend": dst.name,
+        "csv_load_s": round(csv_time, 4), "bin_load_s": round(bin_time, 4),
+        "load_speedup": round(csv_time / bin_time, 2) if bin_time else None,
+        "csv_mb": round(csv_size / 1e6, 2), "bin_mb": round(bin_size / 1e6, 2),
+        "size_ratio": round(bin_size / csv_size, 3) if csv_size else None,
+    }
+    print(f"📊 {len(codes)} 只股票: CSV 读取 {csv_time:.3f}s / {csv_size / 1e6:.1f}MB，"
+          f"{dst.name} 读取 {bin_time:.3f}s / {bin_size / 1e6:.1f}MB "
+          f"(提速 {result['load_speedup']}x，体积 {result['size_ratio'] * 100:.0f}%)")
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="日线数据存储后端：CSV -> 二进制迁移与读取基准")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_migrate = sub.add_parser("migrate", help="把 stock_data/*.csv 转换为二进制后端")
+    p_migrate.add_argument("--backend", default="bin", choices=["bin", "parquet"])
+    p_migrate.add_argument("--force", action="store_true", help="忽略修改时间，全部重新转换")
+    p_bench = sub.add_parser("bench", help="对比读取耗时与磁盘占用")
+    p_bench.add_argument("--backend", default="bin", choices=["bin", "parquet"])
+    p_bench.add_argument("--limit", type=int, default=500)
+    args = parser.parse_args(argv)
+
+    if args.command == "migrate":
+        migrate_csv_dir(backend=args.backend, force=args.force)
+    else:
+        if benchmark(backend=args.backend, limit=args.limit) is None:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+import os
+import abc
+import glob
+import argparse
+import pandas as pd
+from datetime import datetime
+from stock_storage import load_stock
+from stock_features import StockFeatures
+from parallel_utils import DEFAULT_CHUNKSIZE, run_parallel
+import stock_scanner_go_mini
+import volume_reversal_strategy
+import zhangting_huimaqiang
+from universe_history import load_universe
+
+# ==========================================
+# 多战法共享流水线
+# 每只股票只读取一次、共享特征 (均线/量均线/涨跌幅) 只计算一次，
+# 再分发给所有已注册的战法，各战法按原有格式写出自己的结果文件。
+# ==========================================
+
+STOCK_DATA_DIR = "stock_data"
+NAMES_FILE = "stock_names.csv"
+
+class SymbolData:
+    """一只股票在本次运行中的共享上下文"""
+
+    def __init__(self, code, name, df):
+        self.code = code
+        self.name = name
+        self.df = df
+        self.features = StockFeatures(df)
+        self.last_close = df['收盘'].iloc[-1] if len(df) else None
+
+class Strategy(abc.ABC):
+    """战法插件基类：声明前置过滤条件，实现 analyze 与 save"""
+    name = ""
+    min_rows = 0
+    min_price = None
+    max_price = None
+    exclude_prefixes = ()
+    exclude_st = False
+
+    def accepts_symbol(self, code, stock_name):
+        """不需要行情数据的过滤 (代码前缀、ST)，不通过则不必读取文件"""
+        if self.exclude_st and "ST" in stock_name.upper():
+            return False
+        return not code.startswith(self.exclude_prefixes) if self.exclude_prefixes else True
+
+    def accepts_data(self, data):
+        """基于最新收盘价与数据长度的过滤"""
+        if len(data.df) < self.min_rows:
+            return False
+        if self.min_price is not None and data.last_close < self.min_price:
+            return False
+        return self.max_price is None or data.last_close <= self.max_price
+
+    @abc.abstractmethod
+    def analyze(self, data):
+        """返回结果行 (dict) 或 None"""
+
+    @abc.abstractmethod
+    def save(self, results):
+        """写出本战法的全部结果行"""
+
+STRATEGIES = {}
+
+def register(cls):
+    """注册战法插件，名称用于命令行 --only 选择；未实现 analyze / save 的插件在注册时即报错"""
+    if cls.__abstractmethods__:
+        raise TypeError(f"战法 {cls.__name__} 未实现: {', '.join(sorted(cls.__abstractmethods__))}")
+    STRATEGIES[cls.name] = cls
+    return cls
+
+@register
+class MildReboundStrategy(Strategy):
+    """温和进取版超跌反弹 (stock_scanner_go_mini.py)"""
+    name = "scan"
+    min_rows = 60
+    min_price = stock_scanner_go_mini.MIN_PRICE
+    exclude_st = True
+
+    def analyze(self, data):
+        return stock_scanner_go_mini.analyze_frame(data.df, data.code, data.name, data.features)
+
+    def save(self, results):
+        stock_scanner_go_mini.save_results(results, datetime.now(stock_scanner_go_mini.SHANGHAI_TZ))
+
+@register
+class VolumeReversalStrategy(Strategy):
+    """极度缩量反包 (volume_reversal_strategy.py)"""
+    name = "reversal"
+    min_rows = 120
+    min_price = 5.0
+    max_price = 20.0
+    exclude_prefixes = ("30",)
+    exclude_st = True
+
+    def analyze(self, data):
+        return volume_reversal_strategy.analyze_frame(data.df, data.code, data.name, data.features, load_universe())
+
+    def save(self, results):
+        volume_reversal_strategy.save_results(results)
+
+@register
+class ZhangtingStrategy(Strategy):
+    """涨停回马枪 (zhangting_huimaqiang.py)"""
+    name = "zhangting"
+    min_rows = 30
+    min_price = zhangting_huimaqiang.MIN_PRICE
+    max_price = zhangting_huimaqiang.MAX_PRICE
+    exclude_prefixes = ("30", "688")
+
+    def analyze(self, data):
+        return zhangting_huimaqiang.analyze_frame(data.df, data.code, data.name, data.features)
+
+    def save(self, results):
+        zhangting_huimaqiang.save_results(results)
+
+def analyze_symbol(file_path, name_map, strategy_names):
+    """读取一只股票一次，依次交给所有接受它的战法，返回 {战法名: 结果行}"""
+    code = os.path.basename(file_path).split('.')[0]
+    stock_name = name_map.get(code, "未知")
+    strategies = [STRATEGIES[n]() for n in strategy_names]
+    strategies = [s for s in strategies if s.accepts_symbol(code, stock_name)]
+    if not strategies:
+        return {}
+    try:
+        df = load_stock(file_path)
+        if df.empty:
+            return {}
+        df = df.sort_values('日期').reset_index(drop=True)
+    except Exception:
+        return {}
+
+    data = SymbolData(code, stock_name, df)
+    hits = {}
+    for strategy in strategies:
+        if not strategy.accepts_data(data):
+            continue
+        result = strategy.analyze(data)
+        if result is not None:
+            hits[strategy.name] = result
+    return hits
+
+def load_names(path=NAMES_FILE):
+    if not os.path.exists(path):
+        return {}
+    names_df = pd.read_csv(path, dtype={'code': str})
+    return dict(zip(names_df['code'].str.zfill(6), names_df['name']))
+
+def run_pipeline(strategy_names=None, processes=None, chunksize=DEFAULT_CHUNKSIZE):
+    """一次遍历全市场运行所有 (或指定的) 战法，并写出各自的结果文件"""
+    strategy_names = strategy_names or list(STRATEGIES)
+    name_map = load_names()
+    files = glob.glob(os.path.join(STOCK_DATA_DIR, "*.csv"))
+    print(f"[{datetime.now()}] 共享流水线启动: {len(files)} 只标的 × 战法 {', '.join(strategy_names)}")
+
+    per_symbol = run_parallel(analyze_symbol, files, shared=(name_map, strategy_names),
+                              processes=processes, chunksize=chunksize)
+
+    results = {n: [] for n in strategy_names}
+    for hits in per_symbol:
+        for name, row in hits.items():
+            results[name].append(row)
+    for name in strategy_names:
+        print(f"\n===== {name}: {len(results[name])} 只 =====")
+        STRATEGIES[name]().save(results[name])
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="一次读取、多战法共享的扫描流水线")
+    parser.add_argument("--only", default=None, help=f"只运行指定战法，逗号分隔 (可选 {', '.join(STRATEGIES)})")
+    parser.add_argument("--processes", type=int, default=None, help="进程数，默认 CPU 核数")
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE, help="每批派发给进程的任务数")
+    args = parser.parse_args(argv)
+
+    names = args.only.split(",") if args.only else None
+    unknown = [n for n in names or [] if n not in STRATEGIES]
+    if unknown:
+        parser.error(f"未知战法: {', '.join(unknown)}")
+    run_pipeline(names, args.processes, args.chunksize)
+
+if __name__ == "__main__":
+    main()
@@ -1,30 +1,158 @@
 import os
-import shutil
+import sys
+import json
+import time
 import glob
+import shutil
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+# ==========================================
+# 清单驱动的增量同步
+# 清单记录目标目录中每个文件的 大小 / mtime / 行数 / 最新日期 / 末尾内容哈希 / 全文件哈希。
+# 源文件未变化直接跳过；旧内容 (前 size 字节) 的全文件哈希与清单一致、只是末尾追加了新行的文件只写入新增字节；
+# 其余文件 (原地修改、整体改写如复权数据重下) 整体复制。末尾哈希只用来快速排除明显不是追加的文件。
+# ==========================================
+
+# 这里的路径对应工作流中 checkout 设定的 path
+SOURCE_DIR = 'source_repo/stock_data'
+TARGET_DIR = 'main_repo/stock_data'
+MANIFEST_NAME = 'sync_manifest.json'
+MANIFEST_VERSION = 2
+TAIL_HASH_BYTES = 4096       # 旧内容末尾这段字节不一致时不必再算全文件哈希
+HASH_BLOCK_BYTES = 1 << 20
+SYNC_WORKERS = 8
+
+def _tail_hash(f, end):
+    """文件前 end 字节中最后 TAIL_HASH_BYTES 字节的 sha1"""
+    f.seek(max(0, end - TAIL_HASH_BYTES))
+    return hashlib.sha1(f.read(end - f.tell())).hexdigest()
+
+def _prefix_hash(f, end):
+    """文件前 end 字节的 sha1 对象 (可继续 update 追加内容)"""
+    h = hashlib.sha1()
+    f.seek(0)
+    remaining = end
+    while remaining > 0:
+        block = f.read(min(HASH_BLOCK_BYTES, remaining))
+        if not block:
+            break
+        h.update(block)
+        remaining -= len(block)
+    return h
+
+def _last_date(f, end):
+    """取前 end 字节中最后一个非空行的第一列 (日期)"""
+    f.seek(max(0, end - TAIL_HASH_BYTES))
+    lines = [line for line in f.read(end - f.tell()).splitlines() if line.strip()]
+    value = lines[-1].split(b',', 1)[0].decode('utf-8', 'ignore') if lines else None
+    return None if value == '日期' else value  # 只有表头
+
+def _entry(f, st, rows, digest):
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'rows': rows,
+            'last_date': _last_date(f, st.st_size), 'hash': _tail_hash(f, st.st_size), 'sha1': digest}
 
-def sync_csv_files():
-    # 这里的路径对应工作流中 checkout 设定的 path
-    source_dir = 'source_repo/stock_data' 
-    target_dir = 'main_repo/stock_data'
+def sync_file(src_path, dest_path, entry):
+    """同步一个文件，返回 (状态, 新清单条目, 写入字节数)；状态为 skipped/appended/copied"""
+    st = os.stat(src_path)
+    target_ok = entry is not None and os.path.exists(dest_path) and os.path.getsize(dest_path) == entry['size']
+    if target_ok:
+        if st.st_size == entry['size'] and st.st_mtime_ns == entry['mtime_ns']:
+            return 'skipped', entry, 0
+        with open(src_path, 'rb') as f:
+            if st.st_size >= entry['size'] and _tail_hash(f, entry['size']) == entry['hash']:
+                # 末尾一致后再核对旧长度内的全部内容，排除前面被改写、只是恰好变长的文件
+                h = _prefix_hash(f, entry['size'])
+                if h.hexdigest() == entry['sha1']:
+                    f.seek(entry['size'])
+                    new_bytes = f.read(st.st_size - entry['size'])
+                    if new_bytes:
+                        with open(dest_path, 'ab') as out:
+                            out.write(new_bytes)
+                    h.update(new_bytes)
+                    shutil.copystat(src_path, dest_path)
+                    status = 'appended' if new_bytes else 'skipped'  # 大小不变时只是刷新了 mtime
+                    return status, _entry(f, st, entry['rows'] + new_bytes.count(b'\n'), h.hexdigest()), len(new_bytes)
 
+    shutil.copy2(src_path, dest_path)
+    with open(src_path, 'rb') as f:
+        content = f.read()
+        rows = max(content.count(b'\n') - 1, 0)  # 不计表头
+        return 'copied', _entry(f, st, rows, hashlib.sha1(content).hexdigest()), st.st_size
+
+def load_manifest(target_dir):
+    path = os.path.join(target_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            payload = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return payload.get('files', {}) if payload.get('version') == MANIFEST_VERSION else {}
+
+def save_manifest(target_dir, files):
+    path = os.path.join(target_dir, MANIFEST_NAME)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': MANIFEST_VERSION, 'files': files}, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def sync_csv_files(source_dir=SOURCE_DIR, target_dir=TARGET_DIR, workers=SYNC_WORKERS, full=False):
     if not os.path.exists(target_dir):
         os.makedirs(target_dir)
 
     # 获取源目录下所有 csv
     csv_files = glob.glob(os.path.join(source_dir, '*.csv'))
-    
+
     if not csv_files:
         print(f"错误: 在 {source_dir} 未找到 CSV 文件。请检查源仓库路径是否正确。")
-        return
+        return None
 
-    for file_path in csv_files:
+    t0 = time.perf_counter()
+    manifest = {} if full else load_manifest(target_dir)
+
+    def task(file_path):
         file_name = os.path.basename(file_path)
-        dest_path = os.path.join(target_dir, file_name)
-        
-        shutil.copy2(file_path, dest_path)
-        print(f"已同步: {file_name}")
+        try:
+            return file_name, sync_file(file_path, os.path.join(target_dir, file_name), manifest.get(file_name)), None
+        except OSError as e:
+            return file_name, None, e
+
+    counts = {'skipped': 0, 'appended': 0, 'copied': 0}
+    written = 0
+    errors = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for file_name, result, error in executor.map(task, csv_files):
+            if error is not None:
+                errors.append((file_name, error))
+                manifest.pop(file_name, None)
+                continue
+            status, entry, n_bytes = result
+            counts[status] += 1
+            written += n_bytes
+            manifest[file_name] = entry
+
+    save_manifest(target_dir, manifest)
+    print(f"同步任务结束: 共 {len(csv_files)} 个文件，未变化 {counts['skipped']}，"
+          f"追加 {counts['appended']}，整体复制 {counts['copied']}，失败 {len(errors)}；"
+          f"写入 {written / 1e6:.1f}MB，耗时 {time.perf_counter() - t0:.1f}s")
+    for file_name, error in errors[:10]:
+        print(f"  ❌ {file_name}: {error}")
+    return counts, errors
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="把源仓库的 stock_data 增量同步到主仓库")
+    parser.add_argument("--source", default=SOURCE_DIR, help=f"源目录，默认 {SOURCE_DIR}")
+    parser.add_argument("--target", default=TARGET_DIR, help=f"目标目录，默认 {TARGET_DIR}")
+    parser.add_argument("--workers", type=int, default=SYNC_WORKERS, help=f"复制线程数，默认 {SYNC_WORKERS}")
+    parser.add_argument("--full", action="store_true", help="忽略清单，全部重新复制")
+    args = parser.parse_args(argv)
 
-    print(f"同步任务结束。")
+    result = sync_csv_files(args.source, args.target, args.workers, args.full)
+    if result is not None and result[1]:
+        sys.exit(1)
 
 if __name__ == "__main__":
-    sync_csv_files()
+    main()
@@ -0,0 +1,157 @@
+import os
+import sys
+import json
+import argparse
+import numpy as np
+from stock_storage import STOCK_DATA_DIR, dates_to_int
+
+# ==========================================
+# 时点股票池快照 (消除幸存者偏差)
+# stock_list_manager 每次运行把当天的全市场名单 (listed)、过滤后名单 (eligible) 与 ST 名单 (st)
+# 各追加一行位图：symbols 为只增不减的代码表，每个快照日一行 packbits 位图。
+# 回测可以向量化地查询“某股票在某日是否在池内”，按不晚于该日的最近一次快照判定。
+# ==========================================
+
+UNIVERSE_DIR = os.path.join(STOCK_DATA_DIR, "universe")
+UNIVERSE_VERSION = 1
+UNIVERSES = ('listed', 'eligible', 'st')
+
+class UniverseHistory:
+    """一个股票池的快照历史：<name>.json 记录代码表与每行的日期/位数/偏移，<name>.bits 顺序存放位图"""
+
+    def __init__(self, name='eligible', root=UNIVERSE_DIR):
+        self.name = name
+        self.root = root
+        self.meta_path = os.path.join(root, f"{name}.json")
+        self.bits_path = os.path.join(root, f"{name}.bits")
+        self.symbols, self.dates, self.nbits, self.offsets = [], [], [], []
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get('version') == UNIVERSE_VERSION:
+                self.symbols, self.dates = meta['symbols'], meta['dates']
+                self.nbits, self.offsets = meta['nbits'], meta['offsets']
+        self.symbol_index = {s: j for j, s in enumerate(self.symbols)}
+        self._matrix = None
+
+    def __len__(self):
+        return len(self.dates)
+
+    def _end(self):
+        return self.offsets[-1] + (self.nbits[-1] + 7) // 8 if self.offsets else 0
+
+    def append(self, date, codes):
+        """追加 date 当天的成员列表；同一天重复运行时替换当天的快照"""
+        day = int(str(date).replace("-", ""))
+        if self.dates and day < self.dates[-1]:
+            raise ValueError(f"快照只能按日期顺序追加: {day} 早于最后快照 {self.dates[-1]}")
+        if self.dates and day == self.dates[-1]:
+            for lst in (self.dates, self.nbits, self.offsets):
+                lst.pop()
+
+        codes = sorted({str(c).zfill(6) for c in codes})
+        for code in codes:
+            if code not in self.symbol_index:
+                self.symbol_index[code] = len(self.symbols)
+                self.symbols.append(code)
+        row = np.zeros(len(self.symbols), dtype=bool)
+        row[[self.symbol_index[c] for c in codes]] = True
+
+        os.makedirs(self.root, exist_ok=True)
+        end = self._end()
+        with open(self.bits_path, 'ab') as f:
+            f.truncate(end)  # 丢弃上次中断或被替换的尾部
+            f.write(np.packbits(row).tobytes())
+        self.dates.append(day)
+        self.nbits.append(len(self.symbols))
+        self.offsets.append(end)
+
+        tmp_path = self.meta_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': UNIVERSE_VERSION, 'symbols': self.symbols, 'dates': self.dates,
+                       'nbits': self.nbits, 'offsets': self.offsets}, f)
+        os.replace(tmp_path, self.meta_path)
+        self._matrix = None
+        return int(row.sum())
+
+    def matrix(self):
+        """(快照日 × 代码) 布尔成员矩阵，早期快照中尚未出现的代码为 False"""
+        if self._matrix is None:
+            matrix = np.zeros((len(self.dates), len(self.symbols)), dtype=bool)
+            if self.dates:
+                raw = np.fromfile(self.bits_path, dtype=np.uint8, count=self._end())
+                for k, (offset, n) in enumerate(zip(self.offsets, self.nbits)):
+                    matrix[k, :n] = np.unpackbits(raw[offset:offset + (n + 7) // 8], count=n).astype(bool)
+            self._matrix = matrix
+        return self._matrix
+
+    def eligible(self, codes, dates, default=True):
+        """向量化查询 codes 在 dates 是否在池内 (codes 可为单个代码，与 dates 广播)
+
+        日期早于第一次快照时没有信息，返回 default (默认 True，即沿用不过滤的旧行为；可传与 dates 等长的数组)；
+        有快照但从未出现过的代码视为不在池内。
+        """
+        dates = np.atleast_1d(np.asarray(dates))
+        days = dates if np.issubdtype(dates.dtype, np.integer) else dates_to_int(dates)
+        codes = np.atleast_1d(np.asarray(codes, dtype=object))
+        codes, days = np.broadcast_arrays(codes, days)
+        out = np.broadcast_to(np.asarray(default, dtype=bool), days.shape).copy()
+        if not self.dates:
+            return out
+        rows = np.searchsorted(np.asarray(self.dates, dtype=np.int64), days, side='right') - 1
+        cols = np.array([self.symbol_index.get(str(c), -1) for c in codes.ravel()]).reshape(codes.shape)
+        known = rows >= 0
+        matrix = self.matrix()
+        out[known] = (cols[known] >= 0) & matrix[rows[known], np.maximum(cols[known], 0)]
+        return out
+
+    def is_eligible(self, code, date, default=True):
+        return bool(self.eligible(code, [date], default)[0])
+
+_loaded = {}
+
+def load_universe(name='eligible', root=UNIVERSE_DIR):
+    """每个进程只读取一次；没有任何快照时返回 None (调用方按不过滤处理)"""
+    key = (name, root)
+    if key not in _loaded:
+        history = UniverseHistory(name, root)
+        _loaded[key] = history if len(history) else None
+    return _loaded[key]
+
+def record_snapshot(date, listed_codes, eligible_codes, st_codes=(), root=UNIVERSE_DIR):
+    """stock_list_manager 每次运行调用：同时追加 listed / eligible / st 三个股票池"""
+    counts = {}
+    for name, codes in zip(UNIVERSES, (listed_codes, eligible_codes, st_codes)):
+        counts[name] = UniverseHistory(name, root).append(date, codes)
+    return counts
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="时点股票池快照")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_info = sub.add_parser("info", help="打印各股票池的快照范围")
+    p_query = sub.add_parser("query", help="查询某股票在某日是否在池内")
+    p_query.add_argument("code")
+    p_query.add_argument("date", help="YYYY-MM-DD")
+    p_query.add_argument("--universe", choices=UNIVERSES, default='eligible')
+    args = parser.parse_args(argv)
+
+    if args.command == "info":
+        for name in UNIVERSES:
+            history = UniverseHistory(name)
+            if not len(history):
+                print(f"{name}: 暂无快照")
+                continue
+            sizes = history.matrix().sum(axis=1)
+            print(f"{name}: {len(history)} 个快照 ({history.dates[0]} ~ {history.dates[-1]})，"
+                  f"累计 {len(history.symbols)} 个代码，最新快照 {sizes[-1]} 只")
+        return
+
+    history = UniverseHistory(args.universe)
+    if not len(history):
+        print("❌ 暂无快照，请先运行 stock_list_manager.py。")
+        sys.exit(1)
+    ok = history.is_eligible(args.code.zfill(6), args.date)
+    print(f"{args.code} 在 {args.date} {'✅ 属于' if ok else '❌ 不属于'} {args.universe} 股票池")
+
+if __name__ == "__main__":
+    main()
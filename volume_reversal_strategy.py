@@ -3,7 +3,10 @@ import numpy as np
 import os
 import glob
 from datetime import datetime
-from joblib import Parallel, delayed
+from stock_storage import load_stock, read_csv_tail
+from stock_features import StockFeatures
+from parallel_utils import run_parallel
+from universe_history import load_universe
 
 # ==========================================
 # 战法：极度缩量反包 (带虚拟持仓账本回测)
@@ -13,15 +16,73 @@ from joblib import Parallel, delayed
 STRATEGY_NAME = "backtest_reversal_strategy"
 DATA_DIR = "stock_data"
 NAMES_FILE = "stock_names.csv"
+HOLD_DAYS = [7, 14, 20, 60]  # 虚拟持仓周期
+SPIKE_VOL_MULT = 1.5         # 放量：量 > 20日均量的倍数
+SHRINK_VOL_MULT = 0.75       # 缩量：量 < 20日均量的倍数
+
+def active_mask(vol, ma20_vol, mult=None):
+    """前期活跃：[t-10, t) 内有过放量 (量 > 20日均量 × mult)，用前缀和统计；沿第 0 轴，也接受 行 × 股票 二维"""
+    mult = SPIKE_VOL_MULT if mult is None else mult
+    with np.errstate(invalid='ignore'):
+        spike = vol > ma20_vol * mult
+    spike_cum = np.concatenate((np.zeros((1,) + spike.shape[1:], dtype=np.int64), np.cumsum(spike, axis=0)))
+    out = np.zeros(spike.shape, dtype=bool)
+    out[10:] = spike_cum[10:-1] - spike_cum[:-11] > 0
+    return out
+
+def shrink_mask(vol, ma20_vol, mult=None):
+    """极度缩量：前两日成交量都 < 当日 20日均量 × mult"""
+    mult = SHRINK_VOL_MULT if mult is None else mult
+    out = np.zeros(vol.shape, dtype=bool)
+    with np.errstate(invalid='ignore'):
+        out[2:] = (vol[1:-1] < ma20_vol[2:] * mult) & (vol[:-2] < ma20_vol[2:] * mult)
+    return out
+
+def reversal_mask(close, opens, high):
+    """反包确认：今日收盘 > 昨日最高 且 今日收阳"""
+    out = np.zeros(close.shape, dtype=bool)
+    with np.errstate(invalid='ignore'):
+        out[1:] = (close[1:] > high[:-1]) & (close[1:] > opens[1:])
+    return out
+
+def strategy_hits(close, opens, high, vol, ma20_vol, spike_mult=None, shrink_mult=None):
+    """整段历史一次算出每天是否触发战法，返回布尔数组 (前 20 天恒为 False)"""
+    hits = active_mask(vol, ma20_vol, spike_mult) & shrink_mask(vol, ma20_vol, shrink_mult) \
+        & reversal_mask(close, opens, high)
+    hits[:20] = False
+    return hits
+
+def forward_returns(close, idx, days_list):
+    """信号日 idx 之后持有 N 天的收益矩阵 (信号数 × 周期数)，超出数据末尾为 NaN"""
+    target = idx[:, None] + np.asarray(days_list)[None, :]
+    ok = target < len(close)
+    base = close[idx][:, None]
+    future = close[np.where(ok, target, idx[:, None])]
+    return np.where(ok, (future - base) / base, np.nan)
+
+LOAD_COLUMNS = ['日期', '开盘', '收盘', '最高', '最低', '成交量', '涨跌幅', '换手率']
+LEDGER_WINDOW = 500          # 账本统计最近 N 个交易日的信号
+LEDGER_TAIL_ROWS = 160       # 增量模式读取 CSV 末尾行数，需覆盖 上下文 + 新增行 + 最长持有周期
+LEDGER_CONTEXT_ROWS = 30     # 判定一根新 K 线所需的前置行数 (20日均量 + 前10日放量)
 
 def analyze_stock(file_path, names_dict):
     try:
         # 加载必要数据
-        df = pd.read_csv(file_path, usecols=['日期', '开盘', '收盘', '最高', '最低', '成交量', '涨跌幅', '换手率'])
-        if len(df) < 120: return None
-        
+        df = load_stock(file_path, columns=LOAD_COLUMNS)
         code = os.path.basename(file_path).split('.')[0]
-        name = names_dict.get(code, "未知")
+        return analyze_frame(df, code, names_dict.get(code, "未知"), universe=load_universe())
+    except:
+        return None
+
+def analyze_frame(df, code, name, features=None, universe=None):
+    """对已加载的日线执行战法判定与虚拟账本统计，今日触发返回结果行
+
+    universe 为时点股票池 (UniverseHistory) 时，历史信号只统计当日在池内的，避免用今天的名单回测过去。
+    """
+    try:
+        if len(df) < 120: return None
+        if features is None:
+            features = StockFeatures(df)
         
         # 基础过滤
         last_price = df['收盘'].iloc[-1]
@@ -30,51 +91,33 @@ def analyze_stock(file_path, names_dict):
 
         # 向量化准备
         close = df['收盘'].values
+        opens = df['开盘'].values
         vol = df['成交量'].values
         high = df['最高'].values
-        ma20_vol = df['成交量'].rolling(20).mean().values
-        
-        # 战法判定函数
-        def is_strategy_hit(i):
-            if i < 20: return False
-            # 1. 前期活跃：10日内有过放量 (量 > 20日均量 1.5倍)
-            active = (vol[i-10:i] > ma20_vol[i-10:i] * 1.5).any()
-            # 2. 极度缩量：前两日成交量 < 20日均量 * 0.75
-            shrink = (vol[i-1] < ma20_vol[i] * 0.75) and (vol[i-2] < ma20_vol[i] * 0.75)
-            # 3. 反包确认：今日收盘 > 昨日最高 且 今日收阳
-            reversal = (close[i] > high[i-1]) and (close[i] > df['开盘'].iloc[i])
-            return active and shrink and reversal
+        ma20_vol = features.vol_ma(20).values
+        hits = strategy_hits(close, opens, high, vol, ma20_vol)
 
         # --- 建立“虚拟持仓账本” (扫描历史所有信号点) ---
-        history_ledger = []
-        # 扫描过去 500 个交易日
+        # 扫描过去 500 个交易日，-1 是为了排除掉“今天”
         start_scan = max(20, len(df) - 500)
-        for j in range(start_scan, len(df) - 1): # -1 是为了排除掉“今天”
-            if is_strategy_hit(j):
-                # 计算模拟持有收益率
-                res = {}
-                for days in [7, 14, 20, 60]:
-                    target = j + days
-                    if target < len(df):
-                        res[f'p{days}'] = (close[target] - close[j]) / close[j]
-                    else:
-                        res[f'p{days}'] = None
-                history_ledger.append(res)
+        signal_idx = np.flatnonzero(hits[start_scan:len(df) - 1]) + start_scan
+        if universe is not None and len(signal_idx):
+            signal_idx = signal_idx[universe.eligible(code, df['日期'].values[signal_idx])]
+        forward = forward_returns(close, signal_idx, HOLD_DAYS)
 
         # 统计账本战绩
-        hit_count = len(history_ledger)
+        hit_count = len(signal_idx)
         win_rate_20d = 0
         avg_ret_20d = 0
-        if hit_count > 0:
-            ledger_df = pd.DataFrame(history_ledger)
-            p20_valid = ledger_df['p20'].dropna()
-            if not p20_valid.empty:
-                win_rate_20d = (p20_valid > 0).sum() / len(p20_valid)
-                avg_ret_20d = p20_valid.mean()
+        p20 = forward[:, HOLD_DAYS.index(20)]
+        p20_valid = p20[~np.isnan(p20)]
+        if p20_valid.size:
+            win_rate_20d = (p20_valid > 0).sum() / p20_valid.size
+            avg_ret_20d = p20_valid.mean()
 
         # --- 判断今日是否触发信号 ---
         today_idx = len(df) - 1
-        if is_strategy_hit(today_idx):
+        if hits[today_idx]:
             # 综合强度逻辑
             strength = "⭐⭐⭐⭐⭐" if win_rate_20d > 0.6 and avg_ret_20d > 0.05 else "⭐⭐⭐"
             if hit_count == 0: strength = "⭐⭐ (新股或首次触发)"
@@ -98,18 +141,130 @@ def analyze_stock(file_path, names_dict):
     except:
         return None
 
-def main():
-    if not os.path.exists(NAMES_FILE): return
-    names_df = pd.read_csv(NAMES_FILE)
-    names_dict = dict(zip(names_df['code'].astype(str).str.zfill(6), names_df['name']))
-    
-    files = glob.glob(os.path.join(DATA_DIR, "*.csv"))
-    print(f"[{datetime.now()}] 启动虚拟账本全量回测，扫描 {len(files)} 只标的...")
-    
-    # 使用 n_jobs=2 稳定运行，防止 Actions 卡死
-    results = Parallel(n_jobs=2)(delayed(analyze_stock)(f, names_dict) for f in files)
-    
-    final_hits = [r for r in results if r is not None]
+def ledger_task(file_path, names_dict, ledger, universe=None):
+    """增量账本：只判定上次处理之后的新 K 线，并为到期的历史信号补写收益
+
+    ledger 为 {代码: {'rows', 'last_date', 'pending': [(行号, 日期, 缺失周期)]}}，universe 为时点股票池 (可为 None)。
+    读取 CSV 末尾即可覆盖新增行和所有待补信号时不加载全历史；首次处理或历史被改写时全量重建该股。
+    返回 {'代码', 'rows', 'last_date', 'rebuilt', 'signals', 'returns', 'today'}，失败返回 None。
+    """
+    code = os.path.basename(file_path).split('.')[0]
+    try:
+        state = ledger.get(code)
+        df, first_row = None, 0
+        if state is not None:
+            tail = read_csv_tail(file_path, LEDGER_TAIL_ROWS)
+            pos = np.flatnonzero(tail['日期'].astype(str).values == state['last_date'])
+            if len(pos):
+                first_row = state['rows'] - 1 - pos[0]
+                oldest = min((p[0] for p in state['pending']), default=first_row)
+                if pos[0] + 1 >= LEDGER_CONTEXT_ROWS and oldest >= first_row:
+                    df = tail
+        if df is None:
+            df = load_stock(file_path, columns=LOAD_COLUMNS)
+            first_row = 0
+        dates = df['日期'].astype(str).values
+        rows = first_row + len(df)
+        # 水位行的日期对不上说明历史被改写，丢弃旧信号从头重建
+        rebuilt = state is None or not (first_row <= state['rows'] - 1 < rows
+                                        and dates[state['rows'] - 1 - first_row] == state['last_date'])
+        start = 0 if rebuilt else state['rows'] - first_row
+
+        close = df['收盘'].values
+        vol = df['成交量'].values
+        ma20_vol = StockFeatures(df).vol_ma(20).values
+        hits = strategy_hits(close, df['开盘'].values, df['最高'].values, vol, ma20_vol)
+        idx = np.flatnonzero(hits[start:]) + start
+        if universe is not None and len(idx):
+            idx = idx[universe.eligible(code, dates[idx])]
+
+        signals = [{'日期': dates[i], '代码': code, '行号': first_row + i, '收盘': close[i],
+                    '量比': round(vol[i] / ma20_vol[i], 4), '涨跌幅': df['涨跌幅'].iloc[i]} for i in idx]
+        returns = []
+        forward = forward_returns(close, idx, HOLD_DAYS)
+        for i, row in zip(idx, forward):
+            returns += [(dates[i], code, h, r) for h, r in zip(HOLD_DAYS, row) if not np.isnan(r)]
+        if not rebuilt:
+            for row_no, date, missing in state['pending']:
+                i = row_no - first_row
+                returns += [(date, code, h, r) for h, r in
+                            zip(missing, forward_returns(close, np.array([i]), missing)[0]) if not np.isnan(r)]
+
+        # 今日触发且通过基础过滤的标的，账本统计由调用方从信号库计算
+        today = None
+        name = names_dict.get(code, "未知")
+        last_price = close[-1]
+        if rows >= 120 and hits[-1] and not ("ST" in name or code.startswith("30")) and 5.0 <= last_price <= 20.0:
+            today = {"日期": df['日期'].iloc[-1], "代码": code, "名称": name, "现价": last_price,
+                     "涨跌幅": f"{df['涨跌幅'].iloc[-1]}%", "换手率": f"{df['换手率'].iloc[-1]}%"}
+        return {'代码': code, 'rows': rows, 'last_date': dates[-1], 'rebuilt': rebuilt,
+                'signals': signals, 'returns': returns, 'today': today}
+    except:
+        return None
+
+def ledger_report(today, frame, rows):
+    """用信号库中该股最近 LEDGER_WINDOW 日 (不含今天) 的信号统计战绩，生成与 analyze_frame 相同的结果行"""
+    row_no = frame['行号'].values
+    in_window = (row_no >= max(20, rows - LEDGER_WINDOW)) & (row_no < rows - 1)
+    hit_count = int(in_window.sum())
+    p20 = frame['20日收益'].values[in_window]
+    p20_valid = p20[~np.isnan(p20)]
+    win_rate_20d = (p20_valid > 0).sum() / p20_valid.size if p20_valid.size else 0
+    avg_ret_20d = p20_valid.mean() if p20_valid.size else 0
+
+    strength = "⭐⭐⭐⭐⭐" if win_rate_20d > 0.6 and avg_ret_20d > 0.05 else "⭐⭐⭐"
+    if hit_count == 0: strength = "⭐⭐ (新股或首次触发)"
+    if win_rate_20d > 0.7: advice = "历史强势基因，重仓买入"
+    elif win_rate_20d > 0.5: advice = "概率占优，分批建仓"
+    else: advice = "历史表现平平，轻仓试错"
+    return dict(today, **{
+        "虚拟账本触发数": hit_count,
+        "历史20日胜率": f"{win_rate_20d*100:.1f}%",
+        "历史20日均益": f"{avg_ret_20d*100:.2f}%",
+        "买入信号强度": strength,
+        "操作建议": advice
+    })
+
+def run_ledger(files, names_dict):
+    """增量账本主流程：信号库 -> 逐股增量判定 -> 追加信号与到期收益 -> 生成今日结果"""
+    from signal_store import SignalStore
+
+    store = SignalStore(STRATEGY_NAME, HOLD_DAYS)
+    ledger = {code: {'rows': s['rows'], 'last_date': s['last_date'], 'pending': []}
+              for code, s in store.symbols.items()}
+    pending = store.pending()
+    if len(pending):
+        missing = np.isnan(pending[[f"{h}日收益" for h in HOLD_DAYS]].values)
+        for code, row_no, date, miss in zip(pending['代码'], pending['行号'], pending['日期'], missing):
+            if code in ledger:
+                ledger[code]['pending'].append((int(row_no), date, [h for h, m in zip(HOLD_DAYS, miss) if m]))
+
+    # 股票池快照只读一次，随共享参数每进程传输一次
+    results = run_parallel(ledger_task, files, shared=(names_dict, ledger, load_universe()), processes=2)
+    rebuilt = 0
+    for r in results:
+        if r is None:
+            continue
+        if r['rebuilt']:
+            rebuilt += 1
+            if r['代码'] in store.symbols:
+                store.rebuild_symbol(r['代码'])
+        store.add_signals(r['signals'])
+        store.add_returns(r['returns'])
+        store.set_watermark(r['代码'], r['rows'], r['last_date'])
+    new_signals, new_returns = store.flush()
+    print(f"📒 信号库: 新增信号 {new_signals} 个，补写收益 {new_returns} 条，全量重建 {rebuilt} 只")
+
+    candidates = [r for r in results if r is not None and r['today'] is not None]
+    if not candidates:
+        return []
+    frame = store.frame()
+    frame = frame[frame['代码'].isin([r['代码'] for r in candidates])]
+    groups = dict(list(frame.groupby('代码')))
+    return [ledger_report(r['today'], groups.get(r['代码'], frame.iloc[:0]), r['rows']) for r in candidates]
+
+def save_results(final_hits):
+    """按胜率排序后保存到 YYYY-MM/ 目录"""
     if final_hits:
         res_df = pd.DataFrame(final_hits).sort_values(by="历史20日胜率", ascending=False)
         
@@ -124,5 +279,16 @@ def main():
     else:
         print("今日暂未发现符合条件的信号（尝试放宽缩量条件或检查数据更新）。")
 
+def main():
+    if not os.path.exists(NAMES_FILE): return
+    names_df = pd.read_csv(NAMES_FILE)
+    names_dict = dict(zip(names_df['code'].astype(str).str.zfill(6), names_df['name']))
+    
+    files = glob.glob(os.path.join(DATA_DIR, "*.csv"))
+    print(f"[{datetime.now()}] 启动虚拟账本增量回测，扫描 {len(files)} 只标的...")
+    
+    # 使用 n_jobs=2 稳定运行，防止 Actions 卡死；历史信号来自信号库，每晚只判定新增 K 线
+    save_results(run_ledger(files, names_dict))
+
 if __name__ == "__main__":
     main()
@@ -3,59 +3,97 @@ import numpy as np
 import os
 import glob
 from datetime import datetime
-from multiprocessing import Pool
+from stock_storage import load_stock
+from stock_features import StockFeatures
+from parallel_utils import run_parallel
+from limit_table import limit_up_flags, recent_limit_symbols
 
 # --- 战法配置 ---
 STRATEGY_NAME = "涨停回马枪+缩倍量深度回测版"
 MIN_PRICE = 5.0
 MAX_PRICE = 20.0
 BACKTEST_DAYS = [7, 14, 20] # 回测持有周期
+ZT_PCT = 9.5                # 没有涨跌停标记时的涨停判定涨幅 (%)
+ZT_LOOKBACK = 15            # 涨停需出现在最近 N 个交易日内
+MAX_VOL_RATIO = 0.35        # 当前量 / 涨停量 上限
+
+def zhangting_signals(close, low, vol, is_zt=None):
+    """整段历史一次算出每天是否满足回马枪条件
+
+    第 t 天触发: [t-14, t) 内有涨停 (取最近一个)，收盘不破涨停日最低价，且成交量 <= 涨停量 × 0.35。
+    is_zt 为涨跌停表给出的收盘涨停标记；不传时退回按涨幅 > ZT_PCT 判定。
+    返回 (信号布尔数组, 每天对应的最近涨停位置，无涨停为 -1)。
+    """
+    n = len(close)
+    idx = np.arange(n)
+    if is_zt is None:
+        pct = np.full(n, np.nan)
+        pct[1:] = (close[1:] / close[:-1] - 1) * 100
+        is_zt = pct > ZT_PCT
+    last_zt = np.maximum.accumulate(np.where(is_zt, idx, -1))
+    # 当天本身涨停时没有“涨停后”的走势，不算信号
+    recent = (last_zt >= 0) & (last_zt < idx) & (idx - last_zt < ZT_LOOKBACK)
+    ref = np.where(recent, last_zt, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        signal = recent & (close >= low[ref]) & (vol / vol[ref] <= MAX_VOL_RATIO)
+    return signal, last_zt
+
+def backtest_signals(close, signal, in_band):
+    """历史信号日买入、持有 BACKTEST_DAYS 的收益统计 (不含今天)，返回 {周期: (样本数, 胜率, 均益)}"""
+    n = len(close)
+    hist_idx = np.flatnonzero(signal[:-1] & in_band[:-1])
+    days = np.asarray(BACKTEST_DAYS)
+    target = hist_idx[:, None] + days[None, :]
+    ok = target < n
+    base = close[hist_idx][:, None]
+    rets = np.where(ok, close[np.where(ok, target, hist_idx[:, None])] / base - 1, np.nan)
+    stats = {}
+    for k, day in enumerate(BACKTEST_DAYS):
+        valid = rets[:, k][ok[:, k]]
+        stats[day] = (valid.size, (valid > 0).mean() if valid.size else 0.0,
+                      valid.mean() if valid.size else 0.0)
+    return len(hist_idx), stats
 
 def analyze_stock(file_path, name_map):
     try:
-        df = pd.read_csv(file_path)
+        df = load_stock(file_path)
         if len(df) < 30: return None
         
         code = str(df['股票代码'].iloc[0]).zfill(6)
+        return analyze_frame(df, code, name_map.get(code, "未知"))
+    except Exception as e:
+        return None
+
+def analyze_frame(df, code, name, features=None):
+    """对已加载的日线执行回马枪判定与历史回测 (features 需基于按日期排序后的同一份 df)"""
+    try:
+        if len(df) < 30: return None
+        
         # 基础过滤：排除ST(需文件名或数据含有)、30开头、价格区间
         if code.startswith('30') or code.startswith('688'): return None
         
-        df = df.sort_values('日期')
+        df = df.sort_values('日期').reset_index(drop=True)
+        if features is None:
+            features = StockFeatures(df)
         last_close = df['收盘'].iloc[-1]
         if not (MIN_PRICE <= last_close <= MAX_PRICE): return None
 
         # 计算移动平均线
-        df['MA10'] = df['收盘'].rolling(10).mean()
-        df['MA20'] = df['收盘'].rolling(20).mean()
+        df['MA10'] = features.ma(10)
+        df['MA20'] = features.ma(20)
         
-        # 寻找最近15天内的涨停板 (涨幅 > 9.5%)
-        df['涨幅'] = df['收盘'].pct_change() * 100
-        zt_indices = df.index[df['涨幅'] > 9.5].tolist()
-        
-        # 过滤掉距离今天太远的涨停
-        zt_indices = [i for i in zt_indices if len(df) - i <= 15]
-        if not zt_indices: return None
+        # 寻找最近15天内的涨停板，并检查涨停后的缩量回踩 (整段历史一次算完，供回测复用)
+        close = df['收盘'].values
+        is_zt = limit_up_flags(df, code, "ST" in name.upper())
+        signal, last_zt = zhangting_signals(close, df['最低'].values, df['成交量'].values, is_zt)
+        if not signal[-1]: return None
         
         # 获取最近的一个涨停日信息
-        zt_idx = zt_indices[-1]
-        zt_date = df.loc[zt_idx, '日期']
+        zt_idx = last_zt[-1]
         zt_vol = df.loc[zt_idx, '成交量']
-        zt_low = df.loc[zt_idx, '最低']
-        
-        # 检查涨停后的缩量逻辑 (从涨停次日至今)
-        after_zt = df.loc[zt_idx+1:]
-        if after_zt.empty: return None
-        
         curr_vol = df['成交量'].iloc[-1]
-        min_vol_after = after_zt['成交量'].min()
         curr_close = df['收盘'].iloc[-1]
-        
-        # 条件1：洗盘不破涨停底
-        if curr_close < zt_low: return None
-        
-        # 条件2：缩量表现 (当前量小于涨停量1/3)
         vol_ratio = curr_vol / zt_vol
-        if vol_ratio > 0.35: return None
 
         # --- 信号评分系统 ---
         score = 0
@@ -68,32 +106,23 @@ def analyze_stock(file_path, name_map):
         if score >= 70: advice = "重点关注/一击必中"
         elif score >= 50: advice = "轻仓试错"
         
-        # --- 历史回测模拟 (虚拟账本) ---
-        # 假设在发现信号当天买入，计算后续表现
-        results = {"code": code, "name": name_map.get(code, "未知"), "advice": advice, "score": score}
+        # --- 历史回测 (虚拟账本) ---
+        # 历史上每个同样满足条件 (且当天价格在区间内) 的交易日收盘买入，统计持有 N 天的表现
+        in_band = (close >= MIN_PRICE) & (close <= MAX_PRICE)
+        hit_count, stats = backtest_signals(close, signal, in_band)
+        results = {"code": code, "name": name, "advice": advice, "score": score,
+                   "历史信号数": hit_count}
         for day in BACKTEST_DAYS:
-            # 这里的简单回测逻辑：如果在历史上某天也出现过此信号，收益如何
-            # 仅作为模拟，此处记录当前信号的预期
-            results[f"{day}日预期"] = "等待验证"
+            samples, win_rate, avg_ret = stats[day]
+            results[f"{day}日胜率"] = f"{win_rate*100:.1f}%" if samples else "无样本"
+            results[f"{day}日均益"] = f"{avg_ret*100:.2f}%" if samples else "无样本"
 
         return results
     except Exception as e:
         return None
 
-def run():
-    # 加载股票名称
-    name_df = pd.read_csv('stock_names.csv', dtype={'code': str})
-    name_map = dict(zip(name_df['code'], name_df['name']))
-    
-    # 扫描 stock_data 目录
-    files = glob.glob('stock_data/*.csv')
-    
-    # 并行处理
-    with Pool() as pool:
-        all_results = pool.starmap(analyze_stock, [(f, name_map) for f in files])
-    
-    # 过滤空值并排序
-    valid_results = [r for r in all_results if r is not None]
+def save_results(valid_results):
+    """按评分排序后保存到 YYYYMM/ 目录"""
     valid_results.sort(key=lambda x: x['score'], reverse=True)
     
     # 保存结果
@@ -109,5 +138,25 @@ def run():
     else:
         print("今日未筛选出符合战法要求的股票。")
 
+def run():
+    # 加载股票名称
+    name_df = pd.read_csv('stock_names.csv', dtype={'code': str})
+    name_map = dict(zip(name_df['code'], name_df['name']))
+    
+    # 扫描 stock_data 目录
+    files = glob.glob('stock_data/*.csv')
+
+    # 有事件索引时只加载最近 ZT_LOOKBACK 日内有涨停 (或索引之后有变化) 的候选股票
+    candidates = recent_limit_symbols(ZT_LOOKBACK)
+    if candidates is not None:
+        total = len(files)
+        files = [f for f in files if os.path.basename(f)[:-4] in candidates]
+        print(f"📇 涨停事件索引: 候选 {len(files)} / {total} 只")
+    
+    # 并行处理
+    all_results = run_parallel(analyze_stock, files, shared=(name_map,))
+    
+    save_results([r for r in all_results if r is not None])
+
 if __name__ == "__main__":
     run()